@@ -9,10 +9,16 @@ server_ip = None
 server_port = None
 username = None
 
+# Formatted time of the current second, reused for every message within it
+timestamp_cache = (None, "")
+
 # Function to add a timestamp to messages
 def add_timestamp(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    return f"[{timestamp}] {message}"
+    global timestamp_cache
+    second = int(time.time())
+    if timestamp_cache[0] != second:
+        timestamp_cache = (second, datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S'))
+    return f"[{timestamp_cache[1]}] {message}"
 
 # Function to receive messages from the server
 def receive_messages():
@@ -1,27 +1,34 @@
 import socket
 import threading
+import time
 from datetime import datetime
 from tkinter import Tk, Text, Entry, Button, END, Label, Frame, simpledialog
 
 # Server configuration
 clients = {}
 
+# Formatted time of the current second, reused for every message within it
+timestamp_cache = (None, "")
+
 # Function to add a timestamp to messages
 def add_timestamp(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    return f"[{timestamp}] {message}"
+    global timestamp_cache
+    second = int(time.time())
+    if timestamp_cache[0] != second:
+        timestamp_cache = (second, datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S'))
+    return f"[{timestamp_cache[1]}] {message}"
 
 # Function to broadcast messages to all clients except the sender
 def broadcast(message, sender_socket=None):
     # Add timestamp only once on the server
     timestamped_message = add_timestamp(message)
-    for client in clients:
+    for client in list(clients):  # Iterate a snapshot so removals below are safe
         if client != sender_socket:  # Exclude the sender from receiving their own message
             try:
                 client.send(timestamped_message.encode('utf-8'))
             except:
                 client.close()
-                del clients[client]
+                clients.pop(client, None)
     update_status()  # Update status after broadcasting
 
 # Function to handle each client connection
@@ -49,12 +56,13 @@ def handle_client(client_socket):
                 chat_box.insert(END, add_timestamp(formatted_message) + "\n")
                 broadcast(formatted_message, client_socket)
     except:
-        # Handle client disconnect
-        leave_message = f"{clients[client_socket]} has left the chat."
-        chat_box.insert(END, add_timestamp(leave_message) + "\n")
-        broadcast(leave_message)
+        # Handle client disconnect (a failed broadcast may have removed it already)
         client_socket.close()
-        del clients[client_socket]
+        username = clients.pop(client_socket, None)
+        if username is not None:
+            leave_message = f"{username} has left the chat."
+            chat_box.insert(END, add_timestamp(leave_message) + "\n")
+            broadcast(leave_message)
         update_status()
 
 # Function to start the server
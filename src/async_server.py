@@ -0,0 +1,140 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: async_server.py implements an asyncio-based engine
+for the chat server. Instead of one thread per client, every
+connection is multiplexed on a single event loop, so thousands
+of idle users cost only a small protocol object each.
+'''
+
+# IMPORTS
+import asyncio
+import time
+import chat_core
+import fanout
+import heartbeat
+import metrics
+import protocol
+import ratelimit
+import retransmit
+import tls
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# Pending connections the OS may queue before they are accepted
+LISTEN_BACKLOG = 4096
+
+# UTILITY FUNCTIONS
+def raise_fd_limit():
+    ''' Raise the open file limit so many sockets can stay connected '''
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+# CLIENT HANDLER
+class ChatProtocol(asyncio.BufferedProtocol):
+    ''' Handles communication with a connected client '''
+    __slots__ = ("connection", "username", "decoder", "limiter", "watch")
+
+    def connection_made(self, transport):
+        started = time.perf_counter()
+        metrics.connections_accepted.inc()
+        self.connection = fanout.AsyncConnection(transport, window=retransmit.new_window())
+        self.username = None
+        self.decoder = protocol.FrameDecoder()
+        self.limiter = ratelimit.RateLimiter()
+        self.watch = heartbeat.watch(self.connection)
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            tls.handshake_done(ssl_object)  # Called once the handshake is over
+        metrics.accept_seconds.observe(time.perf_counter() - started)
+
+    def pause_writing(self):
+        self.connection.pause_writing()
+
+    def resume_writing(self):
+        self.connection.resume_writing()
+
+    def get_buffer(self, sizehint):
+        # The transport reads straight into the frame decoder's buffer
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        started = time.perf_counter()
+        metrics.bytes_received.inc(nbytes)
+        if self.watch is not None:
+            self.watch.touch()
+        self.decoder.buffer_updated(nbytes)
+        self.process_frames()
+        metrics.recv_seconds.observe(time.perf_counter() - started)
+
+    def process_frames(self):
+        ''' Handle buffered frames until they run out or the client must wait '''
+        try:
+            for msg_type, _, payload in self.decoder.frames():
+                metrics.frames_received.inc()
+                pause = self.frame_received(msg_type, payload)
+                if pause:
+                    # Over its rate limit: leave the rest buffered and stop reading
+                    self.connection.transport.pause_reading()
+                    asyncio.get_running_loop().call_later(pause, self.resume_frames)
+                    return
+        except ValueError:
+            self.connection.close()
+
+    def resume_frames(self):
+        if self.connection.closed:
+            return
+        self.connection.transport.resume_reading()
+        self.process_frames()
+
+    def frame_received(self, msg_type, payload):
+        ''' Dispatch one complete frame from the client; returns seconds to pause reading '''
+        if self.username is None:
+            # The first frame must carry the username
+            self.username = chat_core.register_client(self.connection, msg_type, payload)
+            return 0.0
+        return chat_core.handle_frame(self.connection, self.username, msg_type, payload, self.limiter)
+
+    def connection_lost(self, exc):
+        # Handle client disconnection and notify others
+        metrics.connections_closed.inc()
+        self.connection.closed = True
+        if self.username is not None:
+            chat_core.unregister_client(self.connection, self.username)
+
+# SERVER MANAGEMENT FUNCTIONS
+def start_server(ip, port, reuse_port=False):
+    ''' Initializes and runs the asyncio server until the loop is stopped '''
+    raise_fd_limit()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    chat_core.engine_loop = loop
+    # TLS handshakes are driven by the loop as data arrives, so a slow one holds up nobody else
+    server = loop.run_until_complete(
+        loop.create_server(
+            ChatProtocol, ip, port, backlog=LISTEN_BACKLOG, reuse_address=True, reuse_port=reuse_port or None,
+            ssl=tls.context, ssl_handshake_timeout=tls.HANDSHAKE_TIMEOUT if tls.context else None,
+        )
+    )
+    chat_core.notify(f"Server started on {ip}:{port} (asyncio)\nWaiting for clients to connect...", "System")
+    if chat_core.cluster is not None:
+        chat_core.cluster.start(ip)  # Its updates queue up until the loop runs
+    heartbeat.start()
+
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+        chat_core.engine_loop = None
@@ -0,0 +1,388 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: bench.py is a headless load generator for the chat
+server. For every combination of server mode and message size it
+starts chat_server.py on localhost, connects simulated clients
+that perform the username handshake, drives chat traffic at a
+fixed rate and reports connect throughput, broadcast latency
+percentiles, delivered messages per second and server memory.
+
+    python src/bench.py --modes threaded asyncio --sizes 32 1024 --clients 200
+
+With --rooms K the clients are spread over K rooms, so every
+message fans out to a K-th of the server instead of all of it.
+
+Latency is measured end to end: senders stamp each message with
+the send time and receivers subtract it on arrival. Senders and
+receivers share one process and one clock, so no synchronization
+is needed. The harness is single-threaded; if its own CPU usage
+saturates, lower --clients or --rate rather than trusting numbers
+that measure the load generator instead of the server.
+
+With --tls the benchmark only connects: it compares how fast each
+engine accepts clients (connection, handshake and username
+handshake) over plaintext, over TLS with a full handshake per
+client, and over TLS resuming a session as reconnecting clients do.
+Without --certfile a throwaway self-signed certificate is made with
+the openssl command.
+
+    python src/bench.py --tls --clients 1000 --connect-batch 50
+'''
+
+# IMPORTS
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import async_server
+import chat_server
+import protocol
+import tls
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_server.py")
+STARTUP_TIMEOUT = 10.0   # Seconds to wait for the server to accept connections
+DRAIN_TIME = 1.0         # Seconds to keep reading after the last message is sent
+SETTLE_TIMEOUT = 10.0    # Seconds to wait for every roster to list the whole room
+READ_SIZE = 64 * 1024
+
+# UTILITY FUNCTIONS
+def free_port(host):
+    ''' Ask the OS for a port nobody is listening on '''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+def process_tree(pid):
+    ''' A process and its children, such as server workers (Linux only) '''
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            return [pid] + [int(child) for child in children.read().split()]
+    except OSError:
+        return [pid]
+
+def server_memory(pid):
+    ''' Current and peak resident set size of the server processes in KiB, if known '''
+    rss = peak = 0
+    try:
+        for process in process_tree(pid):
+            with open(f"/proc/{process}/status") as status:
+                fields = dict(line.split(":", 1) for line in status if ":" in line)
+            rss += int(fields["VmRSS"].split()[0])
+            peak += int(fields["VmHWM"].split()[0])
+        return rss, peak
+    except (OSError, KeyError, ValueError):
+        return None, None  # Not Linux
+
+def server_cpu(pid):
+    ''' CPU seconds used so far by the server processes, if known (Linux only) '''
+    ticks = 0
+    try:
+        for process in process_tree(pid):
+            with open(f"/proc/{process}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])  # utime and stime
+        return ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def make_certificate(directory):
+    ''' Self-signed certificate and key for localhost, made with the openssl command '''
+    certfile, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+         "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+         "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+def percentile(ordered, fraction):
+    ''' Nearest-rank percentile of an already sorted list '''
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def room_of(index, room_count):
+    ''' Room a simulated client is placed in, the default one for a single room '''
+    return protocol.DEFAULT_ROOM if room_count == 1 else f"bench{index % room_count}"
+
+def make_message(size):
+    ''' Chat text of the requested size carrying the send time in nanoseconds '''
+    stamp = f"{time.perf_counter_ns()} "
+    return stamp + "x" * max(0, size - len(stamp))
+
+# SIMULATED CLIENTS
+class BenchClient:
+    ''' One simulated chat user counting and timing what it receives '''
+    __slots__ = ("reader", "writer", "decoder", "room", "roster", "received", "latencies")
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.room = protocol.DEFAULT_ROOM
+        self.roster = 0  # Users the server has listed in our room so far
+        self.decoder = protocol.FrameDecoder()
+        self.received = 0
+        self.latencies = None  # A list on clients that record latency
+
+    async def read_loop(self):
+        ''' Consume frames until the connection is closed '''
+        while True:
+            data = await self.reader.read(READ_SIZE)
+            if not data:
+                return
+            self.decoder.feed(data)
+            for msg_type, _, payload in self.decoder.frames():
+                if msg_type == protocol.PING:
+                    self.writer.write(protocol.encode_frame(protocol.PONG))
+                    continue
+                if msg_type != protocol.CHAT:
+                    self.track_presence(msg_type, payload)
+                    continue
+                self.received += 1
+                if self.latencies is not None:
+                    text = bytes(payload).rsplit(protocol.FIELD_SEPARATOR.encode(), 1)[-1]
+                    self.latencies.append(time.perf_counter_ns() - int(text.split(b" ", 1)[0]))
+
+    def track_presence(self, msg_type, payload):
+        ''' Follow the size of our room's roster '''
+        fields = protocol.decode_fields(payload)
+        if msg_type == protocol.PRESENCE and fields[1] == self.room:
+            self.roster = len(fields) - 2
+        elif msg_type in (protocol.JOIN, protocol.LEAVE) and fields[1] == self.room:
+            self.roster += 1 if msg_type == protocol.JOIN else -1
+
+async def connect_client(host, port, name, room):
+    ''' Connect, finish the username handshake and move to the room '''
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    writer.write(protocol.encode_text(protocol.JOIN, name))
+    client = BenchClient(reader, writer)
+    if room != protocol.DEFAULT_ROOM:
+        writer.write(protocol.encode_text(protocol.ROOM_PART, protocol.DEFAULT_ROOM))
+        writer.write(protocol.encode_text(protocol.ROOM_JOIN, room))
+        client.room = room
+
+    # The handshake is done once the roster snapshot of the room arrives
+    while True:
+        data = await reader.read(READ_SIZE)
+        if not data:
+            raise ConnectionError(f"{name} was rejected")
+        client.decoder.feed(data)
+        for msg_type, _, payload in client.decoder.frames():
+            client.track_presence(msg_type, payload)
+            if msg_type == protocol.PRESENCE and protocol.decode_fields(payload)[1] == room:
+                return client
+
+async def send_loop(client, size, interval, deadline):
+    ''' Send messages on a fixed schedule until the deadline '''
+    sent = 0
+    next_send = time.perf_counter()
+    while next_send < deadline:
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        client.writer.write(protocol.encode_text(protocol.CHAT, client.room, make_message(size)))
+        sent += 1
+        next_send += interval
+    await client.writer.drain()
+    return sent
+
+async def run_load(host, port, args, size):
+    ''' Connect every client, drive traffic and collect raw results '''
+    started = time.perf_counter()
+    pending = [connect_client(host, port, f"bench{index}", room_of(index, args.rooms)) for index in range(args.clients)]
+    clients = []
+    for batch in range(0, len(pending), args.connect_batch):
+        clients += await asyncio.gather(*pending[batch:batch + args.connect_batch])
+    connect_time = time.perf_counter() - started
+
+    latencies = []
+    for client in clients[-args.observers:]:
+        client.latencies = latencies
+    readers = [asyncio.create_task(client.read_loop()) for client in clients]
+
+    # Clustered servers (--workers) learn about each other's users shortly after
+    room_sizes = Counter(client.room for client in clients)
+    deadline = time.perf_counter() + SETTLE_TIMEOUT
+    while time.perf_counter() < deadline and any(client.roster < room_sizes[client.room] for client in clients):
+        await asyncio.sleep(0.05)
+
+    senders = clients[:args.senders]
+    interval = len(senders) / args.rate
+    started = time.perf_counter()
+    sent_each = await asyncio.gather(*(send_loop(client, size, interval, started + args.duration) for client in senders))
+    await asyncio.sleep(DRAIN_TIME)
+    elapsed = time.perf_counter() - started
+
+    # Every message should reach the rest of its sender's room
+    expected = sum(sent * (room_sizes[client.room] - 1) for client, sent in zip(senders, sent_each))
+
+    received = sum(client.received for client in clients)
+    for client in clients:
+        client.writer.close()
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    return connect_time, sum(sent_each), expected, received, elapsed, latencies
+
+def connect_blocking(host, port, name, tls_client=None):
+    ''' Connect and finish the username handshake; returns the socket and seconds taken '''
+    started = time.perf_counter()
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if tls_client is not None:
+        sock = tls_client.wrap(sock, host)
+    sock.sendall(protocol.encode_text(protocol.JOIN, name))
+    decoder = protocol.FrameDecoder()
+    while True:
+        if not decoder.recv_from(sock):
+            raise ConnectionError(f"{name} was rejected")
+        for msg_type, _, payload in decoder.frames():
+            if msg_type == protocol.PRESENCE:
+                return sock, time.perf_counter() - started
+
+def connect_once(host, port, name, tls_client=None):
+    ''' Connect, log in and leave; returns seconds taken and whether TLS resumed a session
+
+    Clients leave at once so the room stays small and the numbers
+    measure accepting and handshaking rather than presence fan-out.
+    '''
+    sock, seconds = connect_blocking(host, port, name, tls_client)
+    reused = getattr(sock, "session_reused", False)
+    sock.close()
+    return seconds, reused
+
+# BENCHMARK FUNCTIONS
+def start_server(args, mode, port, extra_args=()):
+    ''' Run chat_server.py and wait until it accepts connections '''
+    command = [sys.executable, SERVER_SCRIPT, "--host", args.host, "--port", str(port), "--mode", mode, "--quiet", "--rate-limit", "0", "--byte-limit", "0"]
+    server = subprocess.Popen(command + list(extra_args) + args.server_args, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            socket.create_connection((args.host, port), timeout=1).close()
+            return server
+        except OSError:
+            if time.monotonic() > deadline or server.poll() is not None:
+                server.kill()
+                raise RuntimeError(f"{mode} server did not start")
+            time.sleep(0.05)
+
+def run_case(args, mode, size):
+    ''' Benchmark one server mode with one message size '''
+    port = free_port(args.host)
+    server = start_server(args, mode, port)
+    try:
+        idle_rss, _ = server_memory(server.pid)
+
+        connect_time, sent, expected, received, elapsed, latencies = asyncio.run(run_load(args.host, port, args, size))
+        rss, peak_rss = server_memory(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "size": size,
+        "rooms": args.rooms,
+        "connects/s": args.clients / connect_time,
+        "sent/s": sent / args.duration,
+        "delivered/s": received / elapsed,
+        "delivered %": 100.0 * received / expected if expected else 100.0,
+        "p50 ms": percentile(latencies, 0.50) / 1e6,
+        "p99 ms": percentile(latencies, 0.99) / 1e6,
+        "p999 ms": percentile(latencies, 0.999) / 1e6,
+        "idle RSS KiB": idle_rss,
+        "RSS KiB": rss,
+        "peak RSS KiB": peak_rss,
+    }
+
+def run_connect_case(args, mode, transport):
+    ''' Measure how fast one server mode accepts clients over one transport '''
+    port = free_port(args.host)
+    extra_args = ["--certfile", args.certfile, "--keyfile", args.keyfile] if transport != "plain" else []
+    server = start_server(args, mode, port, extra_args)
+    try:
+        tls_client = None
+        if transport != "plain":
+            tls_client = tls.ClientTLS(args.certfile)
+        if transport == "tls resumed":
+            # Every client resumes the session of an earlier connection, as after a server restart
+            sock, _ = connect_blocking(args.host, port, "warmup", tls_client)
+            tls_client.remember(sock)
+            sock.close()
+
+        cpu_before = server_cpu(server.pid)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.connect_batch) as pool:
+            connected = list(pool.map(lambda index: connect_once(args.host, port, f"bench{index}", tls_client), range(args.clients)))
+        elapsed = time.perf_counter() - started
+        cpu_after = server_cpu(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    times = sorted(seconds for seconds, _ in connected)
+    resumed = sum(1 for _, reused in connected if reused)
+    return {
+        "mode": mode,
+        "transport": transport,
+        "clients": args.clients,
+        "connects/s": args.clients / elapsed,
+        "p50 ms": percentile(times, 0.50) * 1000,
+        "p99 ms": percentile(times, 0.99) * 1000,
+        "resumed %": 100.0 * resumed / args.clients,
+        "server CPU ms/connect": (cpu_after - cpu_before) * 1000 / args.clients if cpu_before is not None else None,
+    }
+
+def print_results(results):
+    ''' Print one aligned row per benchmark case '''
+    columns = list(results[0])
+    rows = [[f"{value:.2f}" if isinstance(value, float) else str(value) for value in result.values()] for result in results]
+    widths = [max(len(column), *(len(row[index]) for row in rows)) for index, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+# PROGRAM ENTRY POINT
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the chat server")
+    parser.add_argument("--host", default=chat_server.DEFAULT_HOST, help="address to run the server on")
+    parser.add_argument("--modes", nargs="+", choices=chat_server.SERVER_MODES, default=list(chat_server.SERVER_MODES), help="server engines to compare")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[64], help="chat message sizes in bytes")
+    parser.add_argument("--rooms", type=int, default=1, help="rooms the clients are spread over")
+    parser.add_argument("--clients", type=int, default=100, help="simulated clients connected at once")
+    parser.add_argument("--senders", type=int, default=10, help="clients that send messages")
+    parser.add_argument("--observers", type=int, default=10, help="clients that record latency")
+    parser.add_argument("--rate", type=float, default=100.0, help="messages per second across all senders")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of traffic per case")
+    parser.add_argument("--connect-batch", type=int, default=100, help="handshakes in flight while connecting")
+    parser.add_argument("--tls", action="store_true", help="compare connect rates over plaintext and TLS instead of running chat traffic")
+    parser.add_argument("--certfile", help="server certificate for --tls (default: a throwaway self-signed one)")
+    parser.add_argument("--keyfile", help="private key of --certfile")
+    parser.add_argument("server_args", nargs=argparse.REMAINDER, help="extra chat_server.py options after --, e.g. -- --overflow disconnect")
+    args = parser.parse_args()
+    if args.server_args[:1] == ["--"]:
+        args.server_args = args.server_args[1:]
+    args.senders = max(1, min(args.senders, args.clients))
+    args.observers = max(1, min(args.observers, args.clients))
+    args.rooms = max(1, min(args.rooms, args.clients))
+
+    async_server.raise_fd_limit()  # The harness holds every client socket
+    if args.tls:
+        with tempfile.TemporaryDirectory() as directory:
+            if not args.certfile:
+                args.certfile, args.keyfile = make_certificate(directory)
+            transports = ("plain", "tls full", "tls resumed")
+            print_results([run_connect_case(args, mode, transport) for mode in args.modes for transport in transports])
+    else:
+        print_results([run_case(args, mode, size) for mode in args.modes for size in args.sizes])
@@ -0,0 +1,498 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: chat_core.py holds the chat logic shared by both
+server engines: the client registry, chat rooms, broadcasting and
+the handling of every frame a client sends. It never imports
+tkinter; user interfaces and loggers observe the server by
+subscribing to its events.
+'''
+
+# IMPORTS
+import threading
+import time
+import direct
+import message_log
+import metrics
+import protocol
+import registry
+import rooms
+import search_index
+import sessions
+import timestamps
+
+# Registry of connected clients with their usernames
+clients = registry.ClientRegistry()
+
+# Chat rooms with their members and per-room presence
+chat_rooms = rooms.RoomDirectory()
+
+# Resumable sessions, held for a grace period after a connection drops
+client_sessions = sessions.SessionTable()
+
+# Direct messages waiting for recipients who are offline
+offline_messages = direct.OfflineQueue()
+
+# Callbacks receiving (message, sender) for everything the server shows
+subscribers = []
+
+# Event loop of the asyncio engine, so other threads can hand it work
+engine_loop = None
+
+# Links to the other nodes of a server cluster, None for a single server
+cluster = None
+
+# Store and channel for shared files, None when file sharing is off
+file_server = None
+
+# Chat messages are numbered, persisted and broadcast under one lock so
+# every client receives them in sequence order
+chat_lock = threading.Lock()
+last_sequence = 0
+last_timestamp = 0  # Epoch milliseconds of the newest message, never decreases
+chat_log = None  # message_log.MessageLog once open_log() is called
+history_index = None  # search_index.SearchIndex over chat_log
+
+# EVENT FUNCTIONS
+def subscribe(callback):
+    ''' Register a callback for server events '''
+    subscribers.append(callback)
+
+def notify(message, sender):
+    ''' Pass a server event to every subscriber '''
+    for callback in subscribers:
+        callback(message, sender)
+
+def run_in_engine(callback, *args):
+    ''' Run callback on the thread that owns client connections (any thread) '''
+    if engine_loop is not None:
+        engine_loop.call_soon_threadsafe(callback, *args)
+    else:
+        callback(*args)
+
+def call_later(delay, callback, *args):
+    ''' Run callback on the engine thread after delay seconds (any thread) '''
+    if engine_loop is not None:
+        engine_loop.call_soon_threadsafe(engine_loop.call_later, delay, callback, *args)
+    else:
+        timer = threading.Timer(delay, callback, args)
+        timer.daemon = True
+        timer.start()
+
+# BROADCAST FUNCTIONS
+def relay_chat(room_name, sender_name, message, sender=None, forward=True, millis=None):
+    ''' Number, stamp, persist and broadcast one chat message to a room's members
+
+    Messages from this node's clients are also forwarded to the other
+    cluster nodes, with their timestamp; messages relayed from those
+    nodes are not.
+    '''
+    global last_sequence, last_timestamp
+    message = protocol.clean_text(message)  # Keep the text one field for every client
+    with chat_lock:
+        seq = last_sequence + 1
+        millis = max(millis or timestamps.now_millis(), last_timestamp)
+        frame = protocol.chat_frame(seq, room_name, sender_name, millis, message)
+        if chat_log is not None:
+            # The number is only taken once the message is saved, so a failed
+            # write (a full disk) loses this message and not every later one
+            try:
+                chat_log.append(seq, frame)
+            except OSError as error:
+                notify(f"Could not save a message from {sender_name}: {error}", "System")
+                if sender is not None:
+                    sender.send(protocol.system_frame("The server could not save your message, so it was not sent."))
+                return
+            history_index.add(seq, millis, room_name, sender_name, message)
+        last_sequence, last_timestamp = seq, millis
+        metrics.chat_messages.inc()
+        room = chat_rooms.get(room_name)
+        if room is not None:
+            room.broadcast(frame, sender, last_sequence)
+        if forward and cluster is not None:
+            cluster.relay_chat(room_name, sender_name, last_timestamp, message, room.nodes if room else ())
+
+def announce(message):
+    ''' Send a message from the server operator to the default room (any thread) '''
+    notify(f"Server: {message}", "Server")
+    run_in_engine(relay_chat, protocol.DEFAULT_ROOM, "Server", message)
+
+def room_label(room_name):
+    ''' Prefix shown before events outside the default room '''
+    return "" if room_name == protocol.DEFAULT_ROOM else f"[#{room_name}] "
+
+# HISTORY FUNCTIONS
+def open_log(directory):
+    ''' Persist chat messages in directory, continue its numbering and index them for search '''
+    global chat_log, history_index, last_sequence, last_timestamp
+    chat_log = message_log.MessageLog(directory)
+    history_index = search_index.open_index(chat_log)
+    last_sequence = chat_log.last_seq
+    if history_index.stamps:
+        # Carry on from the newest logged stamp, even if the clock has stepped back since
+        last_timestamp = max(last_timestamp, history_index.stamps[-1])
+
+def replay_missed(connection, last_seen, room_name):
+    ''' Send a returning client the room's logged messages after last_seen '''
+    if chat_log is None or last_seen >= last_sequence:
+        return
+    _, chunks = chat_log.replay(last_seen)
+
+    # Payloads are decoded only to check their room; the frames sent stay slices of the mapped segment
+    missed = [
+        frame
+        for chunk in chunks
+        for _, payload, frame in protocol.split_frames(chunk)
+        if protocol.decode_fields(payload)[1] == room_name
+    ]
+    if missed:
+        connection.send(protocol.system_frame(f"Catching up on {len(missed)} missed message(s) in #{room_name}."))
+        for frame in missed:
+            connection.send(protocol.compress_frame(frame, connection.codec))
+
+def resend_unacknowledged(old, connection, last_seen):
+    ''' Give a resumed session the chat frames its old connection never confirmed '''
+    if old.window is None or connection.window is None:
+        return
+    if old.window.acking:
+        connection.acknowledge(last_seen)  # Keep holding frames for a client known to ack
+    for seq, frame in old.unacknowledged(last_seen):
+        if old.codec != connection.codec:
+            frame = protocol.compress_frame(protocol.decompress_frame(frame), connection.codec)
+        connection.send_numbered(seq, frame)
+
+# ROOM FUNCTIONS
+def join_room(connection, username, room_name, last_seen=None):
+    ''' Put a client in a room and catch it up; returns False if refused '''
+    if not protocol.valid_room(room_name):
+        connection.send(protocol.system_frame("Invalid room name."))
+        return False
+    # No chat message may slip in between the roster snapshot and the replay
+    with chat_lock:
+        if chat_rooms.join(connection, username, room_name) is None:
+            connection.send(protocol.system_frame(f"Could not join #{room_name}."))
+            return False
+        if last_seen is not None:
+            replay_missed(connection, last_seen, room_name)
+    if cluster is not None:
+        cluster.member_joined(room_name, username)
+    return True
+
+def part_room(connection, username, room_name):
+    ''' Take a client out of a room and tell the room '''
+    if chat_rooms.part(connection, room_name):
+        notify(f"{username} has left #{room_name}.", "System")
+        if cluster is not None:
+            cluster.member_left(room_name, username)
+
+def parse_number(text):
+    ''' Optional non-negative number sent as a text field '''
+    return int(text) if text.isascii() and text.isdecimal() else None  # isdigit also passes superscripts int() refuses
+
+def parse_last_seen(fields):
+    ''' Optional last seen sequence number following a name in a handshake '''
+    return parse_number(fields[1]) if len(fields) > 1 else None
+
+# SESSION FUNCTIONS
+def register_client(connection, msg_type, payload):
+    ''' Register a client from its first frame, a new login or a resumed session
+
+    A compression offer may come first; the client stays unregistered
+    (None is returned) until its handshake arrives.
+    '''
+    if msg_type == protocol.COMPRESS:
+        negotiate_compression(connection, payload)
+        return None
+    if msg_type == protocol.PONG:
+        return None  # Answer to a heartbeat that raced the handshake
+    started = time.perf_counter()
+    try:
+        if msg_type == protocol.RESUME:
+            return resume_client(connection, protocol.decode_fields(payload))
+        return join_client(connection, msg_type, payload)
+    except protocol.ProtocolError:
+        metrics.handshakes_failed.inc()
+        raise
+    finally:
+        metrics.handshake_seconds.observe(time.perf_counter() - started)
+
+def join_client(connection, msg_type, payload):
+    ''' Validate the username handshake and announce the new client '''
+    fields = protocol.decode_fields(payload) if msg_type == protocol.JOIN else []
+    username = fields[0].strip() if fields else ""
+    add_client(connection, username)
+
+    # Send the roster to the new user and notify others that they joined;
+    # a returning client also reports the last message it saw
+    notify(f"{username} has joined the chat!", "System")
+    join_room(connection, username, protocol.DEFAULT_ROOM, parse_last_seen(fields))
+    open_session(connection, username)
+    deliver_queued(connection, username)
+    return username
+
+def negotiate_compression(connection, payload):
+    ''' Compress what the client is sent from now on with its preferred codec '''
+    connection.codec = protocol.choose_codec(protocol.decode_fields(payload))
+    connection.send(protocol.encode_text(protocol.COMPRESS, connection.codec or ""))
+
+def add_client(connection, username):
+    ''' Claim a username for a connection or refuse the handshake '''
+    if not protocol.valid_username(username):
+        connection.send(protocol.system_frame("Invalid username."))
+        raise protocol.ProtocolError("Invalid username handshake")
+    if (cluster is not None and cluster.is_remote_user(username)) or not clients.add(connection, username):
+        connection.send(protocol.system_frame(f"Username {username} is already taken."))
+        raise protocol.ProtocolError("Duplicate username")
+
+def open_session(connection, username):
+    ''' Give a registered client the token that lets it resume later '''
+    session = client_sessions.open(connection, username)
+    connection.send(protocol.encode_text(protocol.SESSION, session.token))
+    offer_files(connection)
+
+def offer_files(connection):
+    ''' Tell a client where to upload and download files, if this server shares them '''
+    if file_server is not None:
+        connection.send(protocol.encode_text(protocol.FILES, str(file_server.port)))
+
+def resume_client(connection, fields):
+    ''' Let a reconnecting client take its held session back, or register it afresh '''
+    if len(fields) < 3:
+        raise protocol.ProtocolError("Malformed resume handshake")
+    username, token, last_seen = fields[0], fields[1], parse_number(fields[2])
+    known_versions = {room_name: parse_number(version) for room_name, version in zip(fields[3::2], fields[4::2])}
+
+    with chat_lock:
+        old = client_sessions.claim(token, username, connection)
+        if old is not None:
+            # Take over silently: same username, same rooms, same roster positions
+            clients.replace(old, connection)
+            chat_rooms.replace(old, connection)
+            for room_name in chat_rooms.rooms_of(connection):
+                if room_name in known_versions:
+                    chat_rooms.get(room_name).presence.catch_up(connection, known_versions[room_name])
+                    if last_seen is not None:
+                        replay_missed(connection, last_seen, room_name)
+            if last_seen is not None and chat_log is None:
+                resend_unacknowledged(old, connection, last_seen)
+    if old is None:
+        # Unknown or expired session: join the rooms the client had, as a newcomer
+        add_client(connection, username)
+        notify(f"{username} has joined the chat!", "System")
+        for room_name in known_versions:
+            join_room(connection, username, room_name, last_seen)
+        open_session(connection, username)
+        deliver_queued(connection, username)
+        return username
+
+    old.abort() # A half-open old connection must not linger
+
+    # Apply room changes the client made while it was offline
+    for room_name in chat_rooms.rooms_of(connection):
+        if room_name not in known_versions:
+            part_room(connection, username, room_name)
+    for room_name in known_versions:
+        if not chat_rooms.is_member(connection, room_name):
+            join_room(connection, username, room_name, last_seen)
+
+    connection.send(protocol.encode_text(protocol.SESSION, token))
+    offer_files(connection)
+    deliver_queued(connection, username)
+    notify(f"{username} reconnected.", "System")
+    return username
+
+def handle_frame(connection, username, msg_type, payload, limiter=None):
+    ''' Act on one frame from a registered client; returns seconds to pause reading '''
+    pause = 0.0
+    if limiter is not None:
+        pause = limiter.admit(protocol.HEADER_SIZE + len(payload))
+        if pause is None:
+            return rate_dropped(connection, limiter)
+
+    if msg_type == protocol.CHAT:
+        room_name, _, message = protocol.decode_text(payload).partition(protocol.FIELD_SEPARATOR)
+        message = protocol.clean_text(message).strip()
+        if not message:
+            return pause
+        if not chat_rooms.is_member(connection, room_name):
+            connection.send(protocol.system_frame(f"You are not in #{room_name}."))
+            return pause
+        if limiter is not None:
+            room = chat_rooms.get(room_name)
+            # One delivery per other local member and one per node link
+            wait = limiter.admit_fanout(len(room.snapshot) - 1 + len(room.nodes) if room is not None else 0)
+            if wait is None:
+                return rate_dropped(connection, limiter)
+            pause = max(pause, wait)
+        notify(f"{room_label(room_name)}{username}: {message}", username)
+        relay_chat(room_name, username, message, connection)
+    elif msg_type == protocol.ROOM_JOIN:
+        fields = protocol.decode_fields(payload)
+        room_name = fields[0] if fields else ""
+        if join_room(connection, username, room_name, parse_last_seen(fields)):
+            notify(f"{username} has joined #{room_name}.", "System")
+    elif msg_type == protocol.ROOM_PART:
+        part_room(connection, username, protocol.decode_text(payload))
+    elif msg_type == protocol.RESYNC:
+        room = chat_rooms.get(protocol.decode_text(payload))
+        if room is not None and chat_rooms.is_member(connection, room.name):
+            room.presence.resync(connection)
+    elif msg_type == protocol.COMPRESS:
+        negotiate_compression(connection, payload)
+    elif msg_type == protocol.SEARCH:
+        search_history(connection, protocol.decode_fields(payload))
+    elif msg_type == protocol.DIRECT:
+        fields = protocol.decode_fields(payload, 2)
+        if len(fields) < 3:
+            return pause
+        if limiter is not None:
+            wait = limiter.admit_fanout(1)
+            if wait is None:
+                return rate_dropped(connection, limiter)
+            pause = max(pause, wait)
+        message_id, recipient, text = fields
+        status = route_direct(message_id, username, recipient, timestamps.now_millis(), text)
+        if status is not None:
+            connection.send(protocol.encode_text(protocol.DIRECT_ACK, message_id, recipient, status))
+    elif msg_type == protocol.FILE_SHARE:
+        share_file(connection, username, protocol.decode_fields(payload))
+    elif msg_type == protocol.ACK:
+        seq = parse_number(protocol.decode_text(payload))
+        if seq is not None and connection.window is not None:
+            connection.acknowledge(seq)
+    return pause
+
+# DIRECT MESSAGE FUNCTIONS
+def route_direct(message_id, sender_name, recipient, millis, text, node=None):
+    ''' Deliver a direct message, pass it to the recipient's node, or hold it
+
+    Returns the status to acknowledge, or None when another node
+    will acknowledge it. node is the sender's node for messages
+    relayed from other cluster nodes, which are never relayed again.
+    '''
+    if not protocol.valid_username(recipient):
+        return direct.REJECTED
+    text = protocol.clean_text(text)  # Keep the text one field for the recipient, as with chat
+    target = clients.lookup(recipient)  # O(1) username -> connection
+    if target is not None and not target.closed:
+        frame = protocol.encode_text(protocol.DIRECT, sender_name, str(millis), text)
+        if target.send(protocol.compress_frame(frame, target.codec), reliable=True):
+            return direct.DELIVERED
+        # Dropped as a slow consumer just now: hold the message for its session to resume
+    if node is None and cluster is not None:
+        remote = cluster.node_of(recipient)
+        if remote is not None and cluster.relay_direct(remote, message_id, sender_name, recipient, millis, text):
+            return None
+    if offline_messages.put(recipient, direct.QueuedMessage(message_id, sender_name, millis, text, node)):
+        return direct.QUEUED
+    return direct.REJECTED
+
+def acknowledge(sender_name, message_id, recipient, status, node=None):
+    ''' Tell the sender of a direct message what became of it, wherever they are '''
+    if node is not None:
+        cluster.acknowledge_direct(node, message_id, sender_name, recipient, status)
+        return
+    connection = clients.lookup(sender_name)
+    if connection is not None and not connection.closed:
+        connection.send(protocol.encode_text(protocol.DIRECT_ACK, message_id, recipient, status))
+
+def deliver_queued(connection, username):
+    ''' Hand a user the direct messages held while they were offline '''
+    for message in offline_messages.take(username):
+        frame = protocol.encode_text(protocol.DIRECT, message.sender, str(message.millis), message.text)
+        if not connection.send(protocol.compress_frame(frame, connection.codec), reliable=True):
+            offline_messages.put(username, message)  # The connection dropped already; try again next time
+            continue
+        acknowledge(message.sender, message.message_id, username, direct.DELIVERED, message.node)
+
+def search_history(connection, fields):
+    ''' Send one page of logged messages in a room matching a query '''
+    if len(fields) < 3 or not chat_rooms.is_member(connection, fields[0]):
+        connection.send(protocol.system_frame("Join a room to search its history."))
+        return
+    if history_index is None:
+        connection.send(protocol.system_frame("This server keeps no message history to search."))
+        return
+    room_name, cursor, query = fields[0], fields[1], protocol.FIELD_SEPARATOR.join(fields[2:])
+    hits, more = history_index.search(room_name, query, parse_number(cursor))
+
+    # Hits are read back from the log, so the index holds nothing but numbers
+    results = []
+    for seq in hits:
+        frame = chat_log.read(seq)
+        if frame is not None:
+            seq, _, sender, millis, text = protocol.decode_fields(memoryview(frame)[protocol.HEADER_SIZE:], 4)
+            # Messages logged before separators were stripped may still hold some, so
+            # each hit says how many fields its text takes
+            parts = text.split(protocol.FIELD_SEPARATOR)
+            results += [seq, sender, millis, str(len(parts)), *parts]
+    next_cursor = str(hits[-1]) if more else ""
+    frame = protocol.encode_text(protocol.SEARCH_HITS, room_name, next_cursor, *results)
+    connection.send(protocol.compress_frame(frame, connection.codec))
+
+def share_file(connection, username, fields):
+    ''' Announce an uploaded file to the members of a room '''
+    if file_server is None:
+        connection.send(protocol.system_frame("This server does not share files."))
+        return
+    if len(fields) != 4 or not chat_rooms.is_member(connection, fields[0]):
+        connection.send(protocol.system_frame("Join a room to share files in it."))
+        return
+    room_name, name, size, digest = fields
+    if not (protocol.valid_file_name(name) and protocol.valid_digest(digest) and parse_number(size) is not None):
+        connection.send(protocol.system_frame("That file cannot be shared."))
+        return
+    if file_server.store.size(digest) != int(size):
+        connection.send(protocol.system_frame(f"{name} has not been uploaded."))
+        return
+    notify(f"{room_label(room_name)}{username} shared {name}", username)
+    room = chat_rooms.get(room_name)
+    if room is not None:
+        # The sender gets the announcement too, to download from like everyone else
+        room.broadcast(protocol.encode_text(protocol.FILE_SHARE, room_name, username, str(timestamps.now_millis()), name, size, digest))
+
+def rate_dropped(connection, limiter):
+    ''' Tell a flooding client, now and then, that its frames are being dropped '''
+    if limiter.should_warn():
+        connection.send(protocol.system_frame("You are sending too fast; some messages were not delivered."))
+    return 0.0
+
+def unregister_client(connection, username):
+    ''' Hold a disconnected client's session, or remove the client right away '''
+    with chat_lock:
+        if connection not in clients:
+            return  # Its session was already resumed on a new connection
+        session = client_sessions.detach(connection)
+    if session is not None:
+        call_later(client_sessions.grace, expire_session, session, connection, username)
+    else:
+        drop_client(connection, username)
+
+def expire_session(session, connection, username):
+    ''' Remove a client whose session was not resumed in time '''
+    if client_sessions.expire(session, connection):
+        drop_client(connection, username)
+
+def drop_client(connection, username):
+    ''' Remove a client for good and notify others '''
+    notify(f"{username} has left the chat.", "System")
+    room_names = chat_rooms.part_all(connection) # Notify the rooms and update their rosters
+    if cluster is not None:
+        for room_name in room_names:
+            cluster.member_left(room_name, username)
+    clients.remove(connection) # Free the username only after the rosters changed
+
+# METRICS
+def send_queue_depths():
+    ''' Frames waiting in each registered client's send queue '''
+    return [len(connection.queue) for connection in clients]
+
+def slow_consumers():
+    ''' Clients whose send queue is at least half full '''
+    return sum(1 for connection in clients if len(connection.queue) * 2 >= connection.queue_size)
+
+metrics.gauge("chat_clients", "Registered clients", lambda: len(clients))
+metrics.gauge("chat_rooms", "Rooms with at least one member", lambda: len(chat_rooms))
+metrics.gauge("chat_send_queue_frames", "Frames waiting in client send queues", lambda: sum(send_queue_depths()))
+metrics.gauge("chat_send_queue_max_frames", "Frames waiting in the deepest client send queue", lambda: max(send_queue_depths(), default=0))
+metrics.gauge("chat_slow_consumers", "Clients whose send queue is at least half full", slow_consumers)
@@ -0,0 +1,245 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: chat_server.py runs the chat server without a GUI.
+It contains the thread-per-connection engine, starts whichever
+engine was selected and provides the command line shared with
+the GUI server. Run it directly for a headless server:
+
+    python src/chat_server.py --host 0.0.0.0 --port 12345 --mode asyncio
+
+With --workers N the headless server forks N worker processes
+that all accept on the same port (SO_REUSEPORT) and share rooms,
+presence and messages as a cluster linked over Unix sockets, so
+the server can use more than one CPU core.
+'''
+
+# IMPORTS
+import argparse
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import async_server
+import chat_core
+import cluster
+import fanout
+import file_server
+import heartbeat
+import metrics
+import protocol
+import ratelimit
+import retransmit
+import sessions
+import timestamps
+import tls
+
+# Server engine: one thread per client or a single asyncio event loop
+SERVER_MODES = ("threaded", "asyncio")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 12345
+WORKER_RESTART_DELAY = 1.0  # Keeps a worker that fails at startup from spinning
+
+# UTILITY FUNCTIONS
+def add_timestamp(millis=None):
+    ''' Add a timestamp to messages, formatted at most once a minute '''
+    return timestamps.format_timestamp(millis)
+
+def build_parser(description="Headless chat server"):
+    ''' Command line options shared by the headless and GUI servers '''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--host", help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--mode", choices=SERVER_MODES, default="threaded", help="server engine to run (default: threaded)")
+    parser.add_argument("--overflow", choices=fanout.OVERFLOW_POLICIES, default=fanout.DROP_OLDEST, help="what to do when a slow client's send queue is full")
+    parser.add_argument("--queue-size", type=int, default=fanout.max_queued_frames, help="frames buffered per client before the overflow policy applies")
+    parser.add_argument("--retransmit-window", type=int, default=retransmit.window_size, help="unacknowledged chat frames held per client for resending, 0 to disable")
+    parser.add_argument("--log-dir", help="persist chat messages here so reconnecting clients can catch up")
+    parser.add_argument("--cluster-port", type=int, help="accept links from other server nodes on this port")
+    parser.add_argument("--peers", nargs="*", default=[], metavar="HOST:PORT", help="cluster ports of every other node")
+    parser.add_argument("--node-id", help="name of this node in the cluster (default: hostname:cluster-port)")
+    parser.add_argument("--resume-grace", type=float, default=sessions.RESUME_GRACE, help="seconds a dropped client's session is held for it to resume, 0 to disable")
+    parser.add_argument("--rate-limit", type=float, default=ratelimit.message_rate, help="frames per second a client may send, 0 for no limit")
+    parser.add_argument("--byte-limit", type=float, default=ratelimit.byte_rate, help="bytes per second a client may send, 0 for no limit")
+    parser.add_argument("--fanout-budget", type=float, default=0, help="chat deliveries per second across all rooms, 0 for no limit")
+    parser.add_argument("--limit-action", choices=ratelimit.LIMIT_ACTIONS, default=ratelimit.DELAY, help="what to do with a client over its limit")
+    parser.add_argument("--heartbeat-interval", type=float, default=heartbeat.DEFAULT_INTERVAL, help="seconds of silence before a client is pinged, 0 to disable")
+    parser.add_argument("--heartbeat-timeout", type=float, default=heartbeat.DEFAULT_TIMEOUT, help="seconds a pinged client has to answer before it is dropped")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this localhost port (workers use consecutive ports)")
+    parser.add_argument("--stats-interval", type=float, default=0, help="log a line of server stats every this many seconds")
+    parser.add_argument("--file-dir", help="store files shared by clients here and serve them on the file port")
+    parser.add_argument("--file-port", type=int, help="port of the file transfer channel (default: chat port + 1)")
+    parser.add_argument("--max-file-size", type=float, default=file_server.MAX_FILE_SIZE / (1024 * 1024), help="largest file a client may upload, in MB")
+    parser.add_argument("--certfile", help="serve chat and file connections over TLS with this PEM certificate")
+    parser.add_argument("--keyfile", help="private key of the certificate, if not in the certificate file")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the port, 0 for one per CPU core (headless only)")
+    return parser
+
+def configure(args):
+    ''' Apply parsed command line options to the server modules '''
+    fanout.configure(args.overflow, args.queue_size)
+    retransmit.window_size = args.retransmit_window
+    ratelimit.configure(args.rate_limit, args.byte_limit, args.fanout_budget, args.limit_action)
+    heartbeat.configure(args.heartbeat_interval, args.heartbeat_timeout)
+    tls.configure(args.certfile, args.keyfile)
+    metrics.port = args.metrics_port
+    metrics.dump_interval = args.stats_interval
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    if args.workers > 1 and (args.cluster_port or args.log_dir or args.file_dir):
+        # Workers number messages independently, each one is already a cluster node,
+        # and an upload may reach a worker that does not know the uploader's session
+        raise SystemExit("--workers cannot be combined with --cluster-port, --log-dir or --file-dir")
+    # A reconnecting client may land on another worker, which cannot resume its session
+    chat_core.client_sessions.grace = args.resume_grace if args.workers == 1 else 0
+    if args.log_dir:
+        chat_core.open_log(args.log_dir)
+    if args.file_dir:
+        file_port = args.file_port or (args.port or DEFAULT_PORT) + 1
+        chat_core.file_server = file_server.FileServer(args.file_dir, file_port, int(args.max_file_size * 1024 * 1024))
+    if args.cluster_port:
+        node_id = args.node_id or f"{socket.gethostname()}:{args.cluster_port}"
+        peers = [cluster.parse_address(peer, args.host or DEFAULT_HOST) for peer in args.peers]
+        chat_core.cluster = cluster.Cluster(node_id, args.cluster_port, peers)
+
+# CLIENT HANDLER FUNCTIONS
+def handle_client(client_socket):
+    ''' Handles communication with a connected client '''
+    if tls.context is not None:
+        try:
+            client_socket = tls.SharedSocket(tls.accept(client_socket))  # On this thread, never the accept loop
+        except (OSError, ValueError):
+            metrics.connections_closed.inc()
+            client_socket.close()
+            return
+    connection = fanout.ThreadedConnection(client_socket, window=retransmit.new_window())
+    decoder = protocol.FrameDecoder()
+    limiter = ratelimit.RateLimiter()
+    watch = heartbeat.watch(connection)
+    username = None
+    try:
+        # Continuously listen for frames until the client disconnects
+        while nbytes := decoder.recv_from(client_socket):
+            started = time.perf_counter()
+            if watch is not None:
+                watch.touch()
+            metrics.bytes_received.inc(nbytes)
+            for msg_type, _, payload in decoder.frames():
+                metrics.frames_received.inc()
+                if username is None:
+                    # The first frame must carry the username
+                    username = chat_core.register_client(connection, msg_type, payload)
+                elif pause := chat_core.handle_frame(connection, username, msg_type, payload, limiter):
+                    time.sleep(pause) # Over its rate limit: stop reading, TCP pushes back
+            metrics.recv_seconds.observe(time.perf_counter() - started)
+    except (OSError, ValueError):
+        pass
+    metrics.connections_closed.inc()
+
+    # Handle client disconnection and notify others
+    if username is not None:
+        chat_core.unregister_client(connection, username)
+    connection.close()
+    client_socket.close()
+
+# SERVER MANAGEMENT FUNCTIONS
+def start_server(ip, port, mode="threaded", reuse_port=False):
+    ''' Initializes and starts the server with the chosen engine '''
+    metrics.start(lambda text: chat_core.notify(text, "System"))
+    if chat_core.file_server is not None:
+        chat_core.file_server.start(ip)  # Transfers run on threads of their own in either mode
+    if mode == "asyncio":
+        async_server.start_server(ip, port, reuse_port)
+        return
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Restart while old connections linger in TIME_WAIT
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((ip, port))
+    server_socket.listen()
+    chat_core.notify(f"Server started on {ip}:{port}\nWaiting for clients to connect...", "System")
+    if chat_core.cluster is not None:
+        chat_core.cluster.start(ip)
+    heartbeat.start()
+
+    while True:
+        client_socket, _ = server_socket.accept()
+        started = time.perf_counter()
+        metrics.connections_accepted.inc()
+        threading.Thread(target=handle_client, args=(client_socket,), daemon=True).start()
+        metrics.accept_seconds.observe(time.perf_counter() - started)
+
+def start_workers(ip, port, mode, workers):
+    ''' Fork workers sharing the port and restart any that die (Linux/BSD) '''
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+        raise SystemExit("--workers needs SO_REUSEPORT and fork()")
+    bus_dir = tempfile.mkdtemp(prefix="chat-workers-")
+    bus_paths = [os.path.join(bus_dir, f"worker-{index}.sock") for index in range(workers)]
+
+    def spawn(index):
+        pid = os.fork()
+        if pid:
+            return pid
+        # Worker process: one cluster node linked to its siblings
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if metrics.port:
+            metrics.port += index
+        peers = [path for path in bus_paths if path != bus_paths[index]]
+        # Each message is logged only by the worker its sender is connected to
+        chat_core.cluster = cluster.Cluster(f"worker-{index}", bus_paths[index], peers, notify_remote=False)
+        try:
+            start_server(ip, port, mode, reuse_port=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os._exit(0)
+
+    # Turn SIGTERM into SystemExit so the workers are stopped with us
+    signal.signal(signal.SIGTERM, lambda signum, frame: exit())
+    children = {spawn(index): index for index in range(workers)}
+    try:
+        while True:
+            pid, _ = os.wait()
+            index = children.pop(pid, None)
+            if index is not None:
+                chat_core.notify(f"Worker {index} exited, restarting it", "System")
+                time.sleep(WORKER_RESTART_DELAY)
+                children[spawn(index)] = index
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        shutil.rmtree(bus_dir, ignore_errors=True)
+
+# CONSOLE OUTPUT
+def log_event(message, sender):
+    ''' Print server events to the console '''
+    print(f"[{add_timestamp()}] {message}", flush=True)
+
+def log_notice(message, sender):
+    ''' Print only joins, leaves and server notices to the console '''
+    if sender in ("System", "Server"):
+        log_event(message, sender)
+
+# PROGRAM ENTRY POINT
+if __name__ == "__main__":
+    parser = build_parser()
+    parser.add_argument("--quiet", action="store_true", help="only log joins, leaves and server notices")
+    args = parser.parse_args()
+    configure(args)
+
+    chat_core.subscribe(log_notice if args.quiet else log_event)
+
+    try:
+        if args.workers > 1:
+            start_workers(args.host or DEFAULT_HOST, args.port or DEFAULT_PORT, args.mode, args.workers)
+        else:
+            start_server(args.host or DEFAULT_HOST, args.port or DEFAULT_PORT, args.mode)
+    except KeyboardInterrupt:
+        print("Server stopped.")
@@ -0,0 +1,168 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: chat_view.py implements the scrolling message list
+used by both the client and server windows. The whole history
+lives in a list of small slotted records, while only a fixed pool
+of row widgets is ever created; scrolling and appending just
+re-point those rows at different records, so the cost of both
+stays the same no matter how long the chat gets.
+'''
+
+# IMPORTS
+import queue
+import tkinter as tk
+
+# Redraw cadence and burst limit for messages posted from other threads
+RENDER_INTERVAL_MS = 16        # About one render pass per display frame
+MAX_MESSAGES_PER_FRAME = 200   # Leaves the rest of a burst for the next pass
+
+# Colors shared with the rest of the GUI
+BACKGROUND = "#263859"
+OUTGOING_BG = "#3b4b67"
+INCOMING_BG = "#4c5c77"
+
+class MessageRecord:
+    ''' One message in the chat history '''
+    __slots__ = ("text", "timestamp", "outgoing")
+
+    def __init__(self, text, timestamp, outgoing):
+        self.text = text
+        self.timestamp = timestamp
+        self.outgoing = outgoing
+
+class _Row:
+    ''' Reusable widgets showing one record '''
+    __slots__ = ("frame", "timestamp_label", "message_label", "record")
+
+    def __init__(self, parent, pady, wraplength, bindtag):
+        self.frame = tk.Frame(parent, bg=BACKGROUND, pady=pady)
+        self.timestamp_label = tk.Label(self.frame, bg=BACKGROUND, fg="lightgray", font=("Helvetica", 8, "italic"))
+        self.message_label = tk.Label(self.frame, fg="white", font=("Helvetica", 10), padx=10, pady=5, wraplength=wraplength)
+        self.timestamp_label.pack()
+        self.message_label.pack()
+        self.record = None
+        for widget in (self.frame, self.timestamp_label, self.message_label):
+            widget.bindtags((bindtag,) + widget.bindtags())
+
+class ChatView:
+    ''' Virtualized, bottom-anchored list of chat messages
+
+    Rows are packed from the bottom up starting at the newest visible
+    record; rows that do not fit are simply clipped by the container.
+    post() may be called from any thread, everything else belongs to
+    the Tk thread.
+    '''
+
+    def __init__(self, parent, width=460, height=300, rows=24, row_pady=5,
+                 wraplength=300, outgoing_padx=(230, 10), incoming_padx=(10, 50)):
+        self.records = []
+        self.end = None  # One past the newest visible record, None follows the tail
+        self.pending = queue.SimpleQueue()
+        self.outgoing_padx = outgoing_padx
+        self.incoming_padx = incoming_padx
+
+        self.container = tk.Frame(parent, bg=BACKGROUND, width=width, height=height)
+        self.container.pack_propagate(False)
+        self.scrollbar = tk.Scrollbar(parent, orient="vertical", command=self.yview)
+        self.container.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+        # Mouse wheel scrolling for the container and every pooled row
+        bindtag = f"ChatView{id(self)}"
+        self.container.bindtags((bindtag,) + self.container.bindtags())
+        self.container.bind_class(bindtag, "<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.container.bind_class(bindtag, "<Button-4>", lambda e: self.scroll(-1))
+        self.container.bind_class(bindtag, "<Button-5>", lambda e: self.scroll(1))
+
+        self.rows = [_Row(self.container, row_pady, wraplength, bindtag) for _ in range(rows)]
+        self.shown = 0
+        self.dirty = False
+
+    # MODEL
+    def post(self, text, timestamp, outgoing=False):
+        ''' Queue a message for the next render pass (safe from any thread) '''
+        self.pending.put(MessageRecord(text, timestamp, outgoing))
+
+    def drain(self):
+        ''' Move posted messages into the history and redraw once '''
+        for _ in range(MAX_MESSAGES_PER_FRAME):
+            try:
+                record = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            self.records.append(record)
+            self.dirty = self.dirty or self.end is None
+        self.refresh()
+
+    def start(self):
+        ''' Keep draining posted messages on a fixed timer '''
+        self.drain()
+        self.container.after(RENDER_INTERVAL_MS, self.start)
+
+    # SCROLLING
+    def scroll(self, units):
+        ''' Move the view by a number of messages (negative is older) '''
+        total = len(self.records)
+        end = (total if self.end is None else self.end) + units
+        self._move_to(end)
+
+    def yview(self, action, value, unit=None):
+        ''' Scrollbar command handler '''
+        if action == "moveto":
+            span = min(len(self.rows), len(self.records))
+            self._move_to(int(float(value) * len(self.records)) + span)
+        elif action == "scroll":
+            step = int(value) * (len(self.rows) // 2 if unit == "pages" else 1)
+            self.scroll(step)
+
+    def _move_to(self, end):
+        total = len(self.records)
+        end = max(min(end, total), min(1, total))
+        self.end = None if end >= total else end
+        self.dirty = True
+        self.refresh()
+
+    # RENDERING
+    def refresh(self):
+        ''' Point the pooled rows at the visible records and redraw '''
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        total = len(self.records)
+        end = total if self.end is None else self.end
+        count = min(len(self.rows), end)
+        for index in range(count):
+            row = self.rows[index]
+            record = self.records[end - 1 - index]
+            if index >= self.shown:
+                row.frame.pack(side="bottom", fill="x", pady=5)
+            if row.record is not record:
+                self._show(row, record)
+
+        # Rows without a record are the top of the pool, hide them
+        for index in range(count, self.shown):
+            self.rows[index].frame.pack_forget()
+            self.rows[index].record = None
+        self.shown = count
+
+        if total:
+            self.scrollbar.set((end - count) / total, end / total)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _show(self, row, record):
+        ''' Load a record into a pooled row and align it to its side '''
+        anchor = "e" if record.outgoing else "w"
+        row.timestamp_label.config(text=record.timestamp)
+        row.timestamp_label.pack_configure(anchor=anchor)
+        row.message_label.config(
+            text=record.text,
+            bg=OUTGOING_BG if record.outgoing else INCOMING_BG,
+            anchor=anchor,
+            justify="right" if record.outgoing else "left",
+        )
+        row.message_label.pack_configure(anchor=anchor)
+        row.frame.pack_configure(anchor=anchor, padx=self.outgoing_padx if record.outgoing else self.incoming_padx)
+        row.record = record
@@ -3,16 +3,39 @@ Authors: Kristina Celis & Christian Salinas
 
 Description: client.py implements the client-side functionality
 of the chat app. It allows user to connect to a chat server,
-send and receive messages, and view a list of online users.
+join chat rooms, send and receive messages, and view the users
+online in the current room.
+
+Commands typed in the message box:
+    /join <room>    join a room and make it the current one
+    /part [room]    leave a room (default: the current one)
+    /room <room>    switch to a room already joined
+    /rooms          list the rooms joined
+    /search <words> search the current room's history (from:name,
+                    after:YYYY-MM-DD and before:YYYY-MM-DD narrow it)
+    /more           show older results of the last search
+    /msg <user> <text>  send a private message, held by the server
+                    until the user is next online
+    /send <path>    share a file with the current room
+    /files          list the files shared since connecting
+    /get <number>   download a shared file to ~/Downloads
 '''
 
 # IMPORTS
-import socket
+import argparse
+import os
+import queue
+import random
 import threading
 import time
-from datetime import datetime
 import tkinter as tk
 from tkinter import font, simpledialog
+import chat_view as view
+import file_client
+import outbox
+import protocol
+import timestamps
+import tls
 
 # GLOBALS (avoids multiple,repetitive parameters)
 client_socket = None
@@ -20,15 +43,77 @@ server_ip = None
 server_port = None
 username = None
 status_value_label = None
+room_value_label = None
 online_users_label = None
-canvas = None
-scrollable_frame = None
+chat_view = None
 msg_entry = None
 
+class RoomRoster:
+    ''' Local copy of one room's roster and the presence version it reflects '''
+    __slots__ = ("users", "version")
+
+    def __init__(self):
+        self.users = {}
+        self.version = None  # None until a snapshot arrives
+
+# Rooms this client is in, and the one messages are sent to
+rooms = {protocol.DEFAULT_ROOM: RoomRoster()}
+current_room = protocol.DEFAULT_ROOM
+
+# Sequence number of the newest chat message seen, reported when reconnecting
+last_sequence = None
+
+# Newest sequence number acknowledged to the server, and when
+last_acked = None
+last_ack_time = 0.0
+ACK_EVERY = 32       # Messages between acks while chat is busy
+ACK_INTERVAL = 1.0   # Seconds before a quieter stream is acknowledged
+
+# Token of the server-side session, used to resume it after a dropped connection
+session_token = None
+
+# TLS settings and the session to resume, None for plaintext
+tls_client = None
+
+# Compression codec the server chose for this connection, None for none
+server_codec = None
+
+# Room and query of the last search, and where its next page starts
+last_search = None
+next_search_page = ""
+
+# Direct messages sent and not yet acknowledged, by message id
+direct_counter = 0
+pending_direct = {}
+
+# Port of the server's file channel, None if it does not share files
+file_port = None
+
+# Files shared in our rooms, as (name, size, digest), numbered from 1 for /get
+shared_files = []
+TRANSFER_ATTEMPTS = 5  # Connections tried per transfer before giving up
+
+# Reconnect attempts wait a random time up to an exponentially growing cap
+RECONNECT_BASE = 0.5   # Seconds
+RECONNECT_CAP = 30.0
+
+# Roster and status updates posted from any thread, drained by the Tk main loop
+ui_queue = queue.SimpleQueue()
+
+# Outgoing frames, written by a background thread and kept across reconnects
+outgoing = outbox.Outbox()
+
 # UTILITY FUNCTIONS
-def add_timestamp():
-    ''' Add a timestamp to messages '''
-    return datetime.now().strftime('%b %d, %Y - %I:%M %p')
+def add_timestamp(millis=None):
+    ''' Add a timestamp to messages, formatted at most once a minute '''
+    return timestamps.format_timestamp(millis)
+
+def reconnect_delays():
+    ''' Endless "full jitter" backoff delays, so clients don't reconnect in lockstep '''
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(RECONNECT_CAP, RECONNECT_BASE * 2 ** attempt))
+        attempt = min(attempt + 1, 16)
 
 def create_label(frame, label_text, value_text, row, status=False):
     ''' Create labels for header information '''
@@ -38,21 +123,59 @@ def create_label(frame, label_text, value_text, row, status=False):
     label.grid(row=row, column=1, sticky='w', padx=5, pady=2)
     return label if status else None
 
-def update_online_users(users):
-    ''' Update the online users list display '''
-    global online_users_label
-    users_text = ", ".join(users)
-    online_users_label.config(text=users_text)
+def room_label(room):
+    ''' Prefix shown before messages outside the default room '''
+    return "" if room == protocol.DEFAULT_ROOM else f"[#{room}] "
+
+def update_online_users(room):
+    ''' Queue an update of the online users list display if room is shown '''
+    if room == current_room:
+        roster = rooms.get(room)
+        ui_queue.put(("roster", list(roster.users) if roster else []))
+
+def apply_presence_snapshot(fields):
+    ''' Replace a room's roster with a full snapshot from the server '''
+    room = fields[1]
+    roster = rooms.get(room)
+    if roster is None:
+        return  # Left the room since asking for it
+    roster.version = int(fields[0])
+    roster.users = dict.fromkeys(fields[2:])
+    update_online_users(room)
+
+def apply_presence_delta(msg_type, fields):
+    ''' Apply one join/leave delta, asking for a snapshot on a version gap '''
+    version, room, name = int(fields[0]), fields[1], fields[2]
+    roster = rooms.get(room)
+    if roster is None or roster.version is None or version <= roster.version:
+        return  # Not in the room, waiting for a snapshot, or already reflected in it
+    if version != roster.version + 1:
+        roster.version = None
+        outgoing.send(protocol.encode_text(protocol.RESYNC, room), keep=False)
+        return
+
+    roster.version = version
+    if msg_type == protocol.JOIN:
+        roster.users[name] = None
+    else:
+        roster.users.pop(name, None)
+    update_online_users(room)
+
+def switch_room(room):
+    ''' Make room the one messages are sent to and whose users are shown '''
+    global current_room
+    current_room = room
+    ui_queue.put(("room", f"#{room}" if room else "(none)"))
+    update_online_users(room)
 
 def update_status(message, color):
-    ''' Update the status label with connection status '''
-    global status_value_label
-    status_value_label.config(text=message, bg=color)
+    ''' Queue an update of the status label with connection status '''
+    ui_queue.put(("status", (message, color)))
 
 # GUI SETUP FUNCTIONS
 def setup_gui(root, client_ip, client_port):
     ''' Setup the chat client GUI '''
-    global status_value_label, online_users_label, canvas, scrollable_frame, msg_entry
+    global status_value_label, room_value_label, online_users_label, chat_view, msg_entry
     
     text_font = font.Font(family="Helvetica", size=11)
     root.title("Chat Client")
@@ -69,6 +192,7 @@ def setup_gui(root, client_ip, client_port):
     create_label(header_frame, "Your Name:", username, row=2)
     create_label(header_frame, "Connected with:", f"{server_ip}:{server_port}", row=3)
     status_value_label = create_label(header_frame, "Status:", "Connecting...", row=4, status=True)
+    room_value_label = create_label(header_frame, "Room:", f"#{current_room}", row=5, status=True)
 
     # Online Users frame & labels
     online_users_frame = tk.LabelFrame(root, text="Online Users", font=("Helvetica", 10), bg="#1f2a44", fg="lightgreen", labelanchor="n")
@@ -81,18 +205,8 @@ def setup_gui(root, client_ip, client_port):
     chat_frame = tk.Frame(root, bg="#263859")
     chat_frame.pack(padx=10, pady=10, fill="both", expand=True)
 
-    # Canvas and Scrollbar setup
-    canvas = tk.Canvas(chat_frame, bg="#263859", borderwidth=0, highlightthickness=0)
-    scrollbar = tk.Scrollbar(chat_frame, orient="vertical", command=canvas.yview)
-    scrollable_frame = tk.Frame(canvas, bg="#263859")
-
-    scrollable_frame.bind("<Configure>",lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-
-    canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-    canvas.configure(yscrollcommand=scrollbar.set)
-
-    canvas.pack(side="left", fill="both", expand=True)
-    scrollbar.pack(side="right", fill="y")
+    # Virtualized message list with its own scrollbar
+    chat_view = view.ChatView(chat_frame)
 
     # Message entry and send button
     msg_entry = tk.Entry(root, font=text_font, bg="#3b4b67", fg="white", insertbackground="white", relief="flat")
@@ -104,92 +218,260 @@ def setup_gui(root, client_ip, client_port):
     send_button.bind("<Enter>", lambda e: send_button.config(bg="#596985"))
     send_button.bind("<Leave>", lambda e: send_button.config(bg="#4c5c77"))
 
-def display_message(message, sender):
-    ''' Display a message in the chat display area '''
-    global canvas, scrollable_frame
+def display_message(message, sender, millis=None):
+    ''' Queue a message for the chat display area (safe from any thread) '''
+    chat_view.post(message, add_timestamp(millis), outgoing=sender == username)
 
-    # Create message frame in the scrollable area
-    message_frame = tk.Frame(scrollable_frame, bg="#263859", pady=5)
-    
-    # Display timestamp label
-    timestamp_label = tk.Label(
-        message_frame,
-        text=add_timestamp(),
-        bg="#263859",
-        fg="lightgray",
-        font=("Helvetica", 8, "italic")
-    )
-    timestamp_label.pack(anchor="e" if sender == username else "w")
-
-    # Define common properties
-    wrap_length = 300
-    bg_color = "#3b4b67" if sender == username else "#4c5c77"
-    anchor = "e" if sender == username else "w"
-    justify = "right" if sender == username else "left"
-    padx = (230, 10) if sender == username else (10, 50)
-
-    # Create the message label based on sender
-    message_label = tk.Label(
-        message_frame,
-        text=message,
-        bg=bg_color,
-        fg="white",
-        font=("Helvetica", 10),
-        padx=10,
-        pady=5,
-        wraplength=wrap_length,
-        anchor=anchor,
-        justify=justify
-    )
-    message_label.pack(anchor=anchor)
-    message_frame.pack(anchor=anchor, fill="x", padx=padx, pady=5)
-
-    # Update the canvas to scroll to the bottom for each new message
-    canvas.update_idletasks()
-    canvas.yview_moveto(1.0) 
+def render_pending():
+    ''' Drain queued UI updates on the Tk thread with one redraw per frame '''
+    global online_users_label, status_value_label, room_value_label
+    roster = status = room = None
+    while True:
+        try:
+            kind, data = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "roster":
+            roster = data  # Only the latest roster, status and room are worth drawing
+        elif kind == "room":
+            room = data
+        else:
+            status = data
+
+    if roster is not None:
+        online_users_label.config(text=", ".join(roster))
+    if status is not None:
+        status_value_label.config(text=status[0], bg=status[1])
+    if room is not None:
+        room_value_label.config(text=room)
+
+    chat_view.drain()
+    chat_view.container.after(view.RENDER_INTERVAL_MS, render_pending)
 
 # CLIENT FUNCTIONS
 def send_message():
-    ''' Send a message to the server and display it locally '''
-    global msg_entry, client_socket
+    ''' Send a message or command to the server and display it locally '''
+    global msg_entry
     message = msg_entry.get()
     if message:
-        formatted_message = f"{username}: {message}"
-        display_message(formatted_message, username)
-        try:
-            client_socket.send(message.encode('utf-8'))
-        except (BrokenPipeError, OSError):
-            display_message("Message not sent. Server is offline.", "System")
+        if message.startswith("/"):
+            run_command(message)
+        elif current_room is None:
+            display_message("Join a room with /join <room> first.", "System")
+        elif outgoing.send(protocol.compress_frame(protocol.encode_text(protocol.CHAT, current_room, message), server_codec)):
+            # Only queued here; sent now or right after reconnecting
+            display_message(f"{room_label(current_room)}{username}: {message}", username)
+        else:
+            display_message("Message not sent. Too many messages are waiting for the server.", "System")
         msg_entry.delete(0, tk.END)
 
+def run_command(command):
+    ''' Handle a /join, /part, /room, /rooms, /search, /more, /msg, /send, /files or /get command '''
+    global last_search
+    name, _, room = command[1:].partition(" ")
+    room = room.strip().lstrip("#")
+    if name == "join" and protocol.valid_room(room):
+        if room not in rooms:
+            rooms[room] = RoomRoster()
+            outgoing.send(protocol.encode_text(protocol.ROOM_JOIN, room), keep=False)  # Rejoined anyway after a reconnect
+        switch_room(room)
+    elif name == "part" and (room or current_room) in rooms:
+        room = room or current_room
+        del rooms[room]
+        outgoing.send(protocol.encode_text(protocol.ROOM_PART, room), keep=False)
+        display_message(f"You left #{room}.", "System")
+        if room == current_room:
+            switch_room(next(iter(rooms), None))
+    elif name == "room" and room in rooms:
+        switch_room(room)
+    elif name == "rooms":
+        display_message("Rooms: " + ", ".join(f"#{room}" for room in rooms), "System")
+    elif name == "search" and room and current_room is not None:
+        last_search = (current_room, command[len("/search "):].strip())
+        outgoing.send(protocol.encode_text(protocol.SEARCH, last_search[0], "", last_search[1]), keep=False)
+    elif name == "more" and last_search is not None and next_search_page:
+        outgoing.send(protocol.encode_text(protocol.SEARCH, last_search[0], next_search_page, last_search[1]), keep=False)
+    elif name == "msg" and len(command.split(" ", 2)) == 3:
+        send_direct(*command.split(" ", 2)[1:])
+    elif name == "send" and room and current_room is not None:
+        start_transfer(upload_file, command[len("/send "):].strip(), current_room)
+    elif name == "files":
+        for number, (name, size, _) in enumerate(shared_files, 1):
+            display_message(f"{number}. {name} ({file_client.format_size(size)})", "System")
+    elif name == "get" and room.isdigit() and 0 < int(room) <= len(shared_files):
+        start_transfer(download_file, *shared_files[int(room) - 1])
+    else:
+        display_message("Commands: /join <room>, /part [room], /room <room>, /rooms, /search <words>, /more, /msg <user> <text>, /send <path>, /files, /get <number>", "System")
+
+def send_direct(recipient, message):
+    ''' Send a private message to one user, online or not '''
+    global direct_counter
+    direct_counter += 1
+    message_id = str(direct_counter)
+    frame = protocol.encode_text(protocol.DIRECT, message_id, recipient, message)
+    if outgoing.send(protocol.compress_frame(frame, server_codec)):
+        pending_direct[message_id] = recipient
+        display_message(f"[to {recipient}] {message}", username)
+    else:
+        display_message("Message not sent. Too many messages are waiting for the server.", "System")
+
 def receive_messages():
     ''' Handle receiving messages from the server '''
+    decoder = protocol.FrameDecoder()
+    remembered = tls_client is None
     while True:
         try:
-            message = client_socket.recv(1024).decode('utf-8')
-            # Check if message is an online users list
-            if all(part.isalpha() or part.isnumeric() for part in message.split(",")):
-                users = message.split(",")
-                update_online_users(users)
-            else:
-                # Display regular message
-                sender = message.split(":")[0]
-                display_message(message, sender)
-        except (ConnectionResetError, OSError):
+            if not decoder.recv_from(client_socket):
+                raise ConnectionResetError("Server closed the connection")
+            if not remembered:
+                tls_client.remember(client_socket)  # Resumed by the next reconnect
+                remembered = True
+            for msg_type, _, payload in decoder.frames():
+                handle_frame(msg_type, payload)
+            acknowledge_chat()
+        except (ConnectionResetError, OSError, ValueError):
+            client_socket.close()  # A bad frame leaves the connection open; never keep two
             update_status("Reconnecting...", "orange")
             display_message("Connection lost. Attempting to reconnect...", "System")
             attempt_reconnect()
             break
 
+def handle_frame(msg_type, payload):
+    ''' Dispatch one frame received from the server '''
+    global last_sequence, session_token, server_codec, file_port
+    if msg_type == protocol.CHAT:
+        sequence, room, sender, millis, message = protocol.decode_fields(payload, 4)
+        last_sequence = max(int(sequence), last_sequence or 0)
+        if sender != username:  # Own messages only come back when replayed
+            display_message(f"{room_label(room)}{sender}: {message}", sender, int(millis))  # Shown at the server's time
+    elif msg_type == protocol.JOIN:
+        fields = protocol.decode_fields(payload)
+        display_message(f"{room_label(fields[1])}{fields[2]} has joined the chat!", "System")
+        apply_presence_delta(msg_type, fields)
+    elif msg_type == protocol.LEAVE:
+        fields = protocol.decode_fields(payload)
+        display_message(f"{room_label(fields[1])}{fields[2]} has left the chat.", "System")
+        apply_presence_delta(msg_type, fields)
+    elif msg_type == protocol.PRESENCE:
+        apply_presence_snapshot(protocol.decode_fields(payload))
+    elif msg_type == protocol.SYSTEM:
+        display_message(protocol.decode_text(payload), "System")
+    elif msg_type == protocol.SEARCH_HITS:
+        show_search_hits(protocol.decode_fields(payload))
+    elif msg_type == protocol.DIRECT:
+        sender, millis, message = protocol.decode_fields(payload, 2)
+        display_message(f"[from {sender}] {message}", sender, int(millis))
+    elif msg_type == protocol.DIRECT_ACK:
+        show_direct_ack(*protocol.decode_fields(payload))
+    elif msg_type == protocol.FILES:
+        file_port = int(protocol.decode_text(payload))
+    elif msg_type == protocol.FILE_SHARE:
+        room, sender, millis, name, size, digest = protocol.decode_fields(payload)
+        shared_files.append((name, int(size), digest))
+        display_message(f"{room_label(room)}{sender} shared {name} ({file_client.format_size(int(size))}). Type /get {len(shared_files)} to download it.", sender, int(millis))
+    elif msg_type == protocol.SESSION:
+        session_token = protocol.decode_text(payload)
+    elif msg_type == protocol.COMPRESS:
+        server_codec = protocol.decode_text(payload) or None
+    elif msg_type == protocol.PING:
+        outgoing.send(protocol.encode_frame(protocol.PONG), keep=False)
+
+def acknowledge_chat():
+    ''' Tell the server which chat messages arrived, so it can stop holding them '''
+    global last_acked, last_ack_time
+    if last_sequence is None or last_sequence == last_acked:
+        return
+    now = time.monotonic()
+    if last_sequence - (last_acked or 0) >= ACK_EVERY or now - last_ack_time >= ACK_INTERVAL:
+        last_acked, last_ack_time = last_sequence, now
+        outgoing.send(protocol.encode_text(protocol.ACK, str(last_sequence)), keep=False)
+
+def show_search_hits(fields):
+    ''' Display one page of search results, newest first '''
+    global next_search_page
+    room, next_search_page, hits = fields[0], fields[1], fields[2:]
+    if not hits:
+        display_message(f"{room_label(room)}No messages found.", "System")
+    index = 0
+    while index + 4 <= len(hits):
+        _, sender, millis, count = hits[index:index + 4]
+        count = int(count)
+        message = protocol.FIELD_SEPARATOR.join(hits[index + 4:index + 4 + count])
+        index += 4 + count
+        display_message(f"{room_label(room)}[found] {sender}: {message}", "System", int(millis))
+    if next_search_page:
+        display_message("Type /more for older results.", "System")
+
+def show_direct_ack(message_id, recipient, status):
+    ''' Tell the user what became of a private message they sent '''
+    if status == "queued":
+        display_message(f"{recipient} is offline; they will get your message when they are back.", "System")
+    elif status == "rejected":
+        display_message(f"Your message to {recipient} could not be delivered.", "System")
+    elif status == "delivered" and pending_direct.get(message_id) is None:
+        display_message(f"{recipient} got your message.", "System")  # Delivered after being held
+    pending_direct.pop(message_id, None)
+
+# FILE TRANSFER FUNCTIONS
+def start_transfer(transfer, *args):
+    ''' Run a file transfer on its own thread and connection, away from the chat '''
+    if file_port is None:
+        display_message("This server does not share files.", "System")
+        return
+    threading.Thread(target=transfer, args=args, daemon=True).start()
+
+def retry_transfer(transfer, *args):
+    ''' Run a transfer, reconnecting after a dropped connection; each attempt resumes the last '''
+    delays = reconnect_delays()
+    for _ in range(TRANSFER_ATTEMPTS - 1):
+        try:
+            return transfer((server_ip, file_port), *args)
+        except OSError:
+            time.sleep(next(delays))
+    return transfer((server_ip, file_port), *args)
+
+def upload_file(path, room):
+    ''' Upload a file unless the server has it already, then share it with a room '''
+    name = os.path.basename(path)
+    try:
+        digest, size = file_client.file_digest(path)
+        display_message(f"Uploading {name} ({file_client.format_size(size)})...", "System")
+        # The token is read again on each attempt, in case the chat reconnected meanwhile
+        retry_transfer(lambda address: file_client.upload(address, username, session_token, path, digest, size))
+    except (OSError, ValueError) as error:
+        display_message(f"Could not upload {name}: {error}", "System")
+        return
+    outgoing.send(protocol.encode_text(protocol.FILE_SHARE, room, name, str(size), digest))
+
+def download_file(name, size, digest):
+    ''' Download a shared file into the downloads folder '''
+    display_message(f"Downloading {name} ({file_client.format_size(size)})...", "System")
+    try:
+        path = retry_transfer(file_client.download, digest, name)
+    except (OSError, ValueError) as error:
+        display_message(f"Could not download {name}: {error}", "System")
+        return
+    display_message(f"Saved {name} to {path}.", "System")
+
 def attempt_reconnect():
     ''' Function to attempt reconnection '''
     global client_socket
-    while True:
+    outgoing.detach()  # Unsent chat messages wait for the new connection
+    for delay in reconnect_delays():
         try:
-            time.sleep(5)  # Wait before attempting to reconnect
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a new socket for clean, stable reconnection
-            client_socket.connect((server_ip, server_port))  # Try to reconnect
-            client_socket.send(username.encode('utf-8'))  # Resend username after reconnecting
+            time.sleep(delay)  # Wait before attempting to reconnect
+            client_socket = connect_to_server()  # Create a new socket for clean, stable reconnection
+            client_socket.sendall(compression_offer())
+            if session_token is not None:
+                # Take the held session back; only missed changes are sent to us
+                client_socket.sendall(resume_frame())
+            else:
+                for roster in rooms.values():
+                    roster.version = None  # The new session starts with fresh snapshots
+                handshake = (username,) if last_sequence is None else (username, str(last_sequence))
+                client_socket.sendall(protocol.encode_text(protocol.JOIN, *handshake))  # Resend username and catch up after reconnecting
+                rejoin_rooms(handshake[1:])
+            outgoing.attach(client_socket)  # Then flush what was typed while offline
             update_status("Connected", "lightgreen")
             threading.Thread(target=receive_messages, daemon=True).start()  # Restart message receiving thread
             display_message("Reconnected to the server.", "System")
@@ -198,21 +480,55 @@ def attempt_reconnect():
             update_status("Reconnecting...", "orange")
             continue
 
+def connect_to_server():
+    ''' Open the chat connection, over TLS if the server uses it '''
+    sock = outbox.open_connection((server_ip, server_port))
+    if tls_client is not None:
+        # Resumes the last session when it can; shared by the receiving thread and the outbox
+        sock = tls.SharedSocket(tls_client.wrap(sock, server_ip))
+    return sock
+
+def compression_offer():
+    ''' Tell the server which compressed payloads we can decode '''
+    return protocol.encode_text(protocol.COMPRESS, *protocol.CODECS)
+
+def resume_frame():
+    ''' Handshake resuming our session, with the rooms and roster versions we have '''
+    fields = [username, session_token, "" if last_sequence is None else str(last_sequence)]
+    for room, roster in list(rooms.items()):
+        fields += [room, "" if roster.version is None else str(roster.version)]
+    return protocol.encode_text(protocol.RESUME, *fields)
+
+def rejoin_rooms(last_seen):
+    ''' Restore room memberships after the server placed us in the default room '''
+    if protocol.DEFAULT_ROOM not in rooms:
+        client_socket.sendall(protocol.encode_text(protocol.ROOM_PART, protocol.DEFAULT_ROOM))
+    for room in list(rooms):
+        if room != protocol.DEFAULT_ROOM:
+            client_socket.sendall(protocol.encode_text(protocol.ROOM_JOIN, room, *last_seen))
+
 def initial_connect():
     ''' Initial client connection setup '''
     global client_socket
-    while True:
+    for delay in reconnect_delays():
         try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect((server_ip, server_port))
+            client_socket = connect_to_server()
             return
         except (ConnectionRefusedError, OSError):
             print("Server is offline. Attempting to reconnect...")
-            time.sleep(5)
+            time.sleep(delay)
 
 
 # PROGRAM ENTRY POINT
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat client")
+    parser.add_argument("--tls", action="store_true", help="connect over TLS")
+    parser.add_argument("--cafile", help="trust the server certificate in this PEM file, e.g. a self-signed one")
+    parser.add_argument("--insecure", action="store_true", help="with --tls, skip verifying the server certificate")
+    args = parser.parse_args()
+    if args.tls:
+        tls_client = file_client.tls_client = tls.ClientTLS(args.cafile, verify=not args.insecure)
+
     # Initialize Tkinter root for prompts
     root = tk.Tk()
     root.withdraw()
@@ -234,7 +550,9 @@ if __name__ == "__main__":
     initial_connect()
 
     # Send username to the server
-    client_socket.send(username.encode('utf-8'))
+    client_socket.sendall(compression_offer())
+    client_socket.sendall(protocol.encode_text(protocol.JOIN, username))
+    outgoing.attach(client_socket)
 
     # Retrieve client's local IP and port
     client_ip, client_port = client_socket.getsockname()
@@ -243,6 +561,7 @@ if __name__ == "__main__":
     root = tk.Tk()
     setup_gui(root, client_ip, client_port)
     update_status("Connected", "lightgreen")
+    render_pending()  # Start the periodic render pass
 
     # Start the receiving thread to continuously listen for new messages from the server
     threading.Thread(target=receive_messages, daemon=True).start()
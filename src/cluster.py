@@ -0,0 +1,298 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: cluster.py links several chat server nodes into one
+chat. Every node dials each of its peers and streams its local
+room memberships and chat messages over that node link using the
+regular frame format. A chat message is encoded once and crosses
+each link at most once, and only towards nodes that have members
+in its room; the receiving node delivers it to its own clients.
+
+Node links run over TCP between hosts, or over Unix sockets
+between the worker processes of one host (chat_server --workers).
+A link always starts with a full snapshot of the sender's
+memberships, and a node whose link drops takes its users with it,
+so every roster converges again after a node restarts. Usernames
+are checked against the users of other nodes, but two nodes
+accepting the same new name at the same moment is not prevented.
+'''
+
+# IMPORTS
+import os
+import socket
+import threading
+import time
+import chat_core
+import fanout
+import protocol
+
+RECONNECT_DELAY = 1.0      # Seconds between attempts to dial a peer
+STATE_CHUNK = 1000         # Memberships per NODE_STATE frame
+LINK_QUEUE_SIZE = 65536    # Frames queued per link before it is reset and resynced
+
+# UTILITY FUNCTIONS
+def parse_address(text, default_host="127.0.0.1"):
+    ''' Split "host:port" (or just "port") into a socket address '''
+    host, _, port = text.rpartition(":")
+    return host or default_host, int(port)
+
+def dial(address):
+    ''' Connect to a TCP (host, port) address or a Unix socket path '''
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    sock = socket.create_connection(address)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+class PeerLink:
+    ''' Outbound node link to one peer, redialled whenever it drops '''
+
+    def __init__(self, cluster, address):
+        self.cluster = cluster
+        self.address = address
+        self.node_id = None      # Learned from the peer's hello
+        self.connection = None   # fanout.ThreadedConnection while the link is up
+
+    def send(self, frame):
+        ''' Queue a frame if the link is up; a dropped link resyncs on reconnect '''
+        connection = self.connection
+        if connection is not None:
+            connection.send(frame)
+
+    def run(self):
+        ''' Keep the link to the peer up for the lifetime of the server '''
+        while True:
+            try:
+                sock = dial(self.address)
+            except OSError:
+                time.sleep(RECONNECT_DELAY)
+                continue
+
+            # An overflowing link is reset rather than silently losing updates
+            connection = fanout.ThreadedConnection(sock, fanout.DISCONNECT, LINK_QUEUE_SIZE)
+            with self.cluster.lock:
+                connection.send(protocol.encode_text(protocol.NODE_HELLO, self.cluster.node_id))
+                for frame in self.cluster.state_frames():
+                    connection.send(frame)
+                self.connection = connection
+
+            self._wait_for_close(sock)
+            self.connection = None
+            connection.close()
+            sock.close()
+            time.sleep(RECONNECT_DELAY)
+
+    def _wait_for_close(self, sock):
+        ''' Read the peer's hello, then block until the link drops '''
+        decoder = protocol.FrameDecoder()
+        try:
+            while decoder.recv_from(sock):
+                for msg_type, _, payload in decoder.frames():
+                    if msg_type == protocol.NODE_HELLO:
+                        self.node_id = protocol.decode_text(payload)
+        except (OSError, ValueError):
+            pass
+
+class Cluster:
+    ''' This node's links to its peers and what they told it
+
+    Updates from peers are applied on the server engine's thread
+    (see chat_core.run_in_engine), in the order they arrived.
+    '''
+
+    def __init__(self, node_id, address, peers, notify_remote=True):
+        self.node_id = node_id
+        self.notify_remote = notify_remote  # Show peers' chat to this node's subscribers
+        self.address = address  # Cluster port, or a Unix socket path for local workers
+        self.lock = threading.Lock()        # Orders snapshots and deltas on outbound links
+        self.apply_lock = threading.Lock()  # Serializes updates from inbound links
+        self.links = [PeerLink(self, address) for address in peers]
+        self.inbound = {}  # Node id -> socket whose updates are current
+        self.remote = {}   # Node id -> {username: set of room names}
+
+    def start(self, host):
+        ''' Accept node links on host and start dialling every peer '''
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)  # Left behind by a worker that died
+            server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server_socket.bind(self.address)
+            where = self.address
+        else:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind((host, self.address))
+            where = f"{host}:{self.address}"
+        server_socket.listen()
+        threading.Thread(target=self._accept_loop, args=(server_socket,), daemon=True).start()
+        for link in self.links:
+            threading.Thread(target=link.run, daemon=True).start()
+        chat_core.notify(f"Node {self.node_id} linking on {where} with {len(self.links)} peer(s)", "System")
+
+    # LOCAL CHANGES (any thread)
+    def member_joined(self, room_name, username):
+        self._send_all(protocol.encode_text(protocol.NODE_JOIN, room_name, username))
+
+    def member_left(self, room_name, username):
+        self._send_all(protocol.encode_text(protocol.NODE_PART, room_name, username))
+
+    def relay_chat(self, room_name, sender_name, millis, message, nodes):
+        ''' Forward a local chat message once to each node with members in the room '''
+        frame = protocol.encode_text(protocol.NODE_CHAT, room_name, sender_name, str(millis), message)
+        for link in self.links:
+            if link.node_id is None or link.node_id in nodes:
+                link.send(frame)
+
+    def relay_direct(self, node, message_id, sender_name, recipient, millis, text):
+        ''' Pass a direct message to the node of its recipient; returns False if unreachable '''
+        link = self._link_to(node)
+        if link is None or link.connection is None:
+            return False
+        link.send(protocol.encode_text(protocol.NODE_DIRECT, message_id, sender_name, recipient, str(millis), text))
+        return True
+
+    def acknowledge_direct(self, node, message_id, sender_name, recipient, status):
+        ''' Send a direct message's status back to the sender's node '''
+        link = self._link_to(node)
+        if link is not None:
+            link.send(protocol.encode_text(protocol.NODE_DIRECT_ACK, message_id, sender_name, recipient, status))
+
+    def is_remote_user(self, username):
+        ''' Whether another node reported a user with this name '''
+        return any(username in users for users in list(self.remote.values()))
+
+    def node_of(self, username):
+        ''' Node a remote user is connected to, or None '''
+        for node, users in list(self.remote.items()):
+            if username in users:
+                return node
+        return None
+
+    def _link_to(self, node):
+        return next((link for link in self.links if link.node_id == node), None)
+
+    def _send_all(self, frame):
+        with self.lock:
+            for link in self.links:
+                link.send(frame)
+
+    def state_frames(self):
+        ''' NODE_STATE frames listing every membership of this node's clients '''
+        members = chat_core.chat_rooms.local_members()
+        frames = []
+        for start in range(0, max(len(members), 1), STATE_CHUNK):
+            last = "1" if start + STATE_CHUNK >= len(members) else "0"
+            fields = [name for pair in members[start:start + STATE_CHUNK] for name in pair]
+            frames.append(protocol.encode_text(protocol.NODE_STATE, last, *fields))
+        return frames
+
+    # INBOUND LINKS
+    def _accept_loop(self, server_socket):
+        while True:
+            sock, _ = server_socket.accept()
+            threading.Thread(target=self._serve_link, args=(sock,), daemon=True).start()
+
+    def _serve_link(self, sock):
+        ''' Read one peer's updates and hand them to the engine thread '''
+        dispatch = chat_core.run_in_engine
+        decoder = protocol.FrameDecoder()
+        node = None
+        pending = set()  # Memberships of a snapshot still arriving in chunks
+        try:
+            while decoder.recv_from(sock):
+                for msg_type, _, payload in decoder.frames():
+                    fields = protocol.decode_fields(payload)
+                    if node is None:
+                        if msg_type != protocol.NODE_HELLO or not fields:
+                            raise protocol.ProtocolError("Node link must start with a hello")
+                        node = fields[0]
+                        sock.sendall(protocol.encode_text(protocol.NODE_HELLO, self.node_id))
+                        dispatch(self._attach, node, sock)
+                    elif msg_type == protocol.NODE_STATE:
+                        pending.update(zip(fields[1::2], fields[2::2]))
+                        if fields[0] == "1":
+                            dispatch(self._apply_state, node, sock, pending)
+                            pending = set()
+                    elif msg_type == protocol.NODE_JOIN:
+                        dispatch(self._apply_join, node, sock, fields[0], fields[1])
+                    elif msg_type == protocol.NODE_PART:
+                        dispatch(self._apply_part, node, sock, fields[0], fields[1])
+                    elif msg_type == protocol.NODE_CHAT:
+                        dispatch(self._apply_chat, fields[0], fields[1], int(fields[2]), protocol.FIELD_SEPARATOR.join(fields[3:]))
+                    elif msg_type == protocol.NODE_DIRECT:
+                        dispatch(self._apply_direct, node, *fields[:3], int(fields[3]), protocol.FIELD_SEPARATOR.join(fields[4:]))
+                    elif msg_type == protocol.NODE_DIRECT_ACK:
+                        dispatch(chat_core.acknowledge, fields[1], fields[0], fields[2], fields[3])
+        except (OSError, ValueError, IndexError):
+            pass
+        sock.close()
+        if node is not None:
+            dispatch(self._detach, node, sock)
+
+    # PEER UPDATES (engine thread)
+    def _attach(self, node, sock):
+        with self.apply_lock:
+            self.inbound[node] = sock  # A restarted peer replaces its old link
+
+    def _detach(self, node, sock):
+        with self.apply_lock:
+            if self.inbound.get(node) is not sock:
+                return
+            del self.inbound[node]
+            for room_name, username in self._memberships(node):
+                self._part(node, room_name, username)
+            self.remote.pop(node, None)
+
+    def _apply_state(self, node, sock, members):
+        with self.apply_lock:
+            if self.inbound.get(node) is not sock:
+                return
+            known = self._memberships(node)
+            for room_name, username in known - members:
+                self._part(node, room_name, username)
+            for room_name, username in members - known:
+                self._join(node, room_name, username)
+
+    def _apply_join(self, node, sock, room_name, username):
+        with self.apply_lock:
+            if self.inbound.get(node) is sock:
+                self._join(node, room_name, username)
+
+    def _apply_part(self, node, sock, room_name, username):
+        with self.apply_lock:
+            if self.inbound.get(node) is sock:
+                self._part(node, room_name, username)
+
+    def _apply_chat(self, room_name, sender_name, millis, message):
+        if self.notify_remote:
+            chat_core.notify(f"{chat_core.room_label(room_name)}{sender_name}: {message}", sender_name)
+        chat_core.relay_chat(room_name, sender_name, message, forward=False, millis=millis)
+
+    def _apply_direct(self, node, message_id, sender_name, recipient, millis, text):
+        status = chat_core.route_direct(message_id, sender_name, recipient, millis, text, node)
+        chat_core.acknowledge(sender_name, message_id, recipient, status, node)
+
+    def _memberships(self, node):
+        users = self.remote.get(node, {})
+        return {(room_name, username) for username, room_names in users.items() for room_name in room_names}
+
+    def _join(self, node, room_name, username):
+        room_names = self.remote.setdefault(node, {}).setdefault(username, set())
+        if room_name not in room_names:
+            room_names.add(room_name)
+            chat_core.chat_rooms.join_remote(node, username, room_name)
+
+    def _part(self, node, room_name, username):
+        users = self.remote.get(node, {})
+        room_names = users.get(username)
+        if room_names and room_name in room_names:
+            room_names.discard(room_name)
+            if not room_names:
+                del users[username]
+            chat_core.chat_rooms.part_remote(username, room_name)
@@ -0,0 +1,62 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: direct.py holds direct (private) messages for users
+who are not connected. A direct message goes to its recipient's
+connection through the username index of the client registry;
+when nobody of that name is online it waits here, in memory, and
+is handed over when the recipient next logs in or resumes.
+'''
+
+# IMPORTS
+import threading
+from collections import deque
+
+MAX_QUEUED = 100          # Messages held for one offline user
+MAX_RECIPIENTS = 10000    # Offline users with messages held at once
+
+# ACKNOWLEDGEMENT STATUSES
+DELIVERED = "delivered"   # Handed to the recipient's connection
+QUEUED = "queued"         # Recipient offline; delivered when they log in
+REJECTED = "rejected"     # Invalid recipient or no room left to hold it
+
+class QueuedMessage:
+    ''' A direct message waiting for its recipient '''
+    __slots__ = ("message_id", "sender", "millis", "text", "node")
+
+    def __init__(self, message_id, sender, millis, text, node=None):
+        self.message_id = message_id
+        self.sender = sender
+        self.millis = millis
+        self.text = text
+        self.node = node  # Cluster node of the sender, None if local
+
+class OfflineQueue:
+    ''' Bounded per-recipient queues of held messages, safe from any thread '''
+
+    def __init__(self, max_queued=MAX_QUEUED, max_recipients=MAX_RECIPIENTS):
+        self.lock = threading.Lock()
+        self.queues = {}  # Username -> deque of QueuedMessage, oldest first
+        self.max_queued = max_queued
+        self.max_recipients = max_recipients
+
+    def put(self, recipient, message):
+        ''' Hold a message; returns False if there is no room for it '''
+        with self.lock:
+            queue = self.queues.get(recipient)
+            if queue is None:
+                if len(self.queues) >= self.max_recipients:
+                    return False
+                queue = self.queues[recipient] = deque()
+            if len(queue) >= self.max_queued:
+                return False
+            queue.append(message)
+            return True
+
+    def take(self, recipient):
+        ''' Remove and return every message held for a user '''
+        with self.lock:
+            return list(self.queues.pop(recipient, ()))
+
+    def __len__(self):
+        return sum(len(queue) for queue in list(self.queues.values()))
@@ -0,0 +1,322 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: fanout.py implements the outbound side of every
+client connection. A broadcast frame is encoded once and the same
+immutable bytes object is queued for each recipient; a writer
+drains each bounded queue, so a slow client only ever delays
+itself instead of everyone else in the room. Chat frames also go
+through the connection's retransmit window, which holds them back
+while the queue is full instead of dropping them.
+'''
+
+# IMPORTS
+import socket
+import threading
+import time
+from collections import deque
+import metrics
+import protocol
+import tls
+
+# OVERFLOW POLICIES
+DROP_OLDEST = "drop_oldest"   # Discard the oldest queued frame to make room
+DISCONNECT = "disconnect"     # Drop the slow consumer altogether
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+# Defaults used by new connections, set from the server command line
+overflow_policy = DROP_OLDEST
+max_queued_frames = 1024
+
+# How long a closing connection may spend flushing its queue
+FLUSH_TIMEOUT = 1.0
+# Most buffers handed to a single sendmsg() call
+MAX_GATHER = 64
+
+# UTILITY FUNCTIONS
+def configure(policy=None, queue_size=None):
+    ''' Change the overflow policy and queue bound for new connections '''
+    global overflow_policy, max_queued_frames
+    if policy is not None:
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        overflow_policy = policy
+    if queue_size is not None:
+        if queue_size < 1:
+            raise ValueError("Queue size must be at least 1")
+        max_queued_frames = queue_size
+
+def send_frames(sock, frames):
+    ''' Write frames with as few system calls as the platform allows '''
+    if isinstance(sock, tls.SharedSocket):
+        # TLS cannot gather; one joined write still makes as few records as possible
+        sock.sendall(frames[0] if len(frames) == 1 else b"".join(frames))
+        return
+    if len(frames) == 1 or not hasattr(sock, "sendmsg"):
+        for frame in frames:
+            sock.sendall(frame)
+        return
+
+    # Gather write straight from the shared frame buffers, no joining copy
+    views = [memoryview(frame) for frame in frames]
+    first = 0
+    while first < len(views):
+        sent = sock.sendmsg(views[first:first + MAX_GATHER])
+        while first < len(views) and sent >= len(views[first]):
+            sent -= len(views[first])
+            first += 1
+        if sent:
+            views[first] = views[first][sent:]
+
+def droppable(frame):
+    ''' Whether an overflowing queue may discard a frame: anything but a direct message '''
+    return frame[4] != protocol.DIRECT  # Type byte of the frame header
+
+def window_push(connection, seq, frame):
+    ''' Put a chat frame in a connection's window; returns False if the client must be dropped
+
+    A client a whole window behind gets the overflow policy, applied
+    to the window: it is disconnected, or its oldest entry goes.
+    Called with the connection's lock held, if it has one.
+    '''
+    window = connection.window
+    if window.push(seq, frame):
+        return True
+    connection.dropped += 1
+    metrics.frames_dropped.inc()
+    if connection.policy == DISCONNECT:
+        if not connection.closed:
+            metrics.slow_disconnects.inc()  # Once: a dropped client's held window stays full
+        return False
+    window.drop_oldest()
+    return window.push(seq, frame)
+
+class ThreadedConnection:
+    ''' Outbound queue for a blocking socket drained by a writer thread '''
+
+    def __init__(self, sock, policy=None, queue_size=None, window=None):
+        self.sock = sock
+        self.policy = policy or overflow_policy
+        self.queue_size = queue_size or max_queued_frames
+        self.queue = deque()
+        self.dropped = 0
+        self.closed = False
+        self.codec = None  # Compression codec the peer negotiated
+        self.window = window  # retransmit.RetransmitWindow of a client connection, else None
+        self.condition = threading.Condition(threading.Lock())
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def send(self, frame, reliable=False):
+        ''' Queue an encoded frame without blocking the caller; returns False if it was not queued
+
+        A reliable frame (a direct message) goes past the bound rather
+        than be dropped, unless the overflow policy drops the client.
+        '''
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.queue) >= self.queue_size:
+                if self.policy == DISCONNECT:
+                    self.dropped += 1
+                    metrics.frames_dropped.inc()
+                    metrics.slow_disconnects.inc()
+                    self._abort()
+                    return False
+                if not reliable:
+                    self.dropped += 1
+                    metrics.frames_dropped.inc()
+                    if self.window is not None or not droppable(self.queue[0]):
+                        return False  # Queued chat and direct messages are never dropped; the new frame is
+                    self.queue.popleft()
+            self.queue.append(frame)
+            self.condition.notify()
+            return True
+
+    def send_numbered(self, seq, frame):
+        ''' Queue a chat frame through the window, or hold it there while the queue is full
+
+        A closed connection still holds the frame, since its session
+        may be resumed and sent what it missed.
+        '''
+        with self.condition:
+            if not window_push(self, seq, frame):
+                self._abort()
+                return
+            if self.closed:
+                return
+            self.queue.extend(self.window.take(self.queue_size - len(self.queue)))
+            if self.window.unsent:
+                metrics.frames_deferred.inc()  # Queued by the writer once the queue drains
+            self.condition.notify()
+
+    def acknowledge(self, seq):
+        ''' Release chat frames the client confirmed (any thread) '''
+        with self.condition:
+            self.window.ack(seq)
+
+    def unacknowledged(self, seq):
+        ''' (sequence, frame) pairs held after seq, for resending on a new connection '''
+        with self.condition:
+            return self.window.since(seq)
+
+    def close(self):
+        ''' Stop accepting frames and give the writer a moment to flush '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if threading.current_thread() is not self.writer:
+            self.writer.join(FLUSH_TIMEOUT)
+
+    def abort(self):
+        ''' Drop the connection without flushing (any thread) '''
+        with self.condition:
+            self._abort()
+
+    def _abort(self):
+        ''' Disconnect a slow or dead client; the reader thread then cleans up '''
+        self.closed = True
+        self.queue.clear()
+        self.condition.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        ''' Drain queued frames to the socket until the connection closes '''
+        while True:
+            with self.condition:
+                if self.window is not None and self.window.unsent and not self.closed:
+                    # Caught up: queue what was held back while the queue was full
+                    self.queue.extend(self.window.take(self.queue_size - len(self.queue)))
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                batch = list(self.queue)
+                self.queue.clear()
+            started = time.perf_counter()
+            try:
+                send_frames(self.sock, batch)
+            except OSError:
+                metrics.send_failures.inc()
+                with self.condition:
+                    self._abort()
+                return
+            metrics.send_seconds.observe(time.perf_counter() - started)
+            metrics.frames_sent.inc(len(batch))
+            metrics.bytes_sent.inc(sum(map(len, batch)))
+
+class AsyncConnection:
+    ''' Outbound queue for an asyncio transport, used from the loop thread only
+
+    Frames go straight to the transport until it signals back-pressure
+    through pause_writing(); after that they wait in a bounded queue
+    that is flushed in one writelines() call on resume_writing().
+    '''
+    __slots__ = ("transport", "policy", "queue_size", "queue", "dropped", "paused", "closed", "codec", "window")
+
+    def __init__(self, transport, policy=None, queue_size=None, window=None):
+        self.transport = transport
+        self.policy = policy or overflow_policy
+        self.queue_size = queue_size or max_queued_frames
+        self.queue = deque()
+        self.dropped = 0
+        self.paused = False
+        self.closed = False
+        self.codec = None  # Compression codec the peer negotiated
+        self.window = window  # retransmit.RetransmitWindow of a client connection, else None
+
+    def send(self, frame, reliable=False):
+        ''' Queue an encoded frame without blocking the event loop; returns False if it was not queued
+
+        A reliable frame (a direct message) goes past the bound rather
+        than be dropped, unless the overflow policy drops the client.
+        '''
+        if self.closed or self.transport.is_closing():
+            return False
+        if not self.paused:
+            self.transport.write(frame)
+            metrics.frames_sent.inc_loop()
+            metrics.bytes_sent.inc_loop(len(frame))
+            return True
+        if len(self.queue) >= self.queue_size:
+            if self.policy == DISCONNECT:
+                self.dropped += 1
+                metrics.frames_dropped.inc()
+                metrics.slow_disconnects.inc()
+                self.abort()
+                return False
+            if not reliable:
+                self.dropped += 1
+                metrics.frames_dropped.inc()
+                if self.window is not None or not droppable(self.queue[0]):
+                    return False  # Queued chat and direct messages are never dropped; the new frame is
+                self.queue.popleft()
+        self.queue.append(frame)
+        return True
+
+    def send_numbered(self, seq, frame):
+        ''' Write a chat frame through the window, or hold it there while writing is paused
+
+        A closed connection still holds the frame, since its session
+        may be resumed and sent what it missed.
+        '''
+        if not window_push(self, seq, frame):
+            self.abort()
+            return
+        if self.closed or self.transport.is_closing():
+            return
+        if self.paused:
+            metrics.frames_deferred.inc()  # Written by resume_writing()
+        else:
+            self.write_held()
+
+    def write_held(self):
+        ''' Write the chat frames the window holds until the transport pushes back '''
+        while self.window.unsent and not self.paused:
+            frames = self.window.take(self.queue_size)
+            self.transport.writelines(frames)  # Calls pause_writing() once its buffer is full
+            metrics.frames_sent.inc_loop(len(frames))
+            metrics.bytes_sent.inc_loop(sum(map(len, frames)))
+
+    def acknowledge(self, seq):
+        ''' Release chat frames the client confirmed '''
+        self.window.ack(seq)
+
+    def unacknowledged(self, seq):
+        ''' (sequence, frame) pairs held after seq, for resending on a new connection '''
+        return self.window.since(seq)
+
+    def abort(self):
+        ''' Drop the connection without flushing '''
+        self.closed = True
+        self.queue.clear()
+        self.transport.abort()
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        if self.queue and not self.closed:
+            self.flush()
+        if self.window is not None and not self.closed:
+            self.write_held()
+
+    def flush(self):
+        ''' Hand every queued frame to the transport in one call '''
+        self.transport.writelines(self.queue)
+        metrics.frames_sent.inc_loop(len(self.queue))
+        metrics.bytes_sent.inc_loop(sum(map(len, self.queue)))
+        self.queue.clear()
+
+    def close(self):
+        ''' Flush whatever is queued and close the transport '''
+        if self.closed:
+            return
+        self.closed = True
+        if self.queue:
+            self.flush()
+        self.transport.close()
@@ -0,0 +1,106 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: file_client.py uploads and downloads shared files
+over the server's file channel. Each transfer opens a connection
+of its own next to the chat connection, so a large file never
+delays a chat line. Files are named by the SHA-256 digest of their
+contents: the server skips uploads it already has, and both
+directions continue from the last byte received after a dropped
+connection.
+'''
+
+# IMPORTS
+import hashlib
+import os
+import socket
+import protocol
+
+CHUNK_SIZE = 256 * 1024
+CONNECT_TIMEOUT = 10.0
+IDLE_TIMEOUT = 60.0
+PARTIAL_SUFFIX = ".part"
+
+# Where downloaded files are saved
+DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
+
+# tls.ClientTLS shared with the chat connection, None for plaintext
+tls_client = None
+
+def file_digest(path):
+    ''' SHA-256 hex digest and size of a file '''
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            hasher.update(chunk)
+        return hasher.hexdigest(), file.tell()
+
+def connect(address):
+    sock = socket.create_connection(address, timeout=CONNECT_TIMEOUT)
+    if tls_client is not None:
+        sock = tls_client.wrap(sock, address[0])
+    sock.settimeout(IDLE_TIMEOUT)
+    return sock
+
+def expect_ready(sock):
+    ''' Wait for the server's FILE_READY and return its number '''
+    msg_type, fields = protocol.recv_frame(sock)
+    if msg_type == protocol.SYSTEM:
+        raise protocol.ProtocolError(fields[0] if fields else "File transfer refused")
+    if msg_type != protocol.FILE_READY or not fields or not fields[0].isdigit():
+        raise protocol.ProtocolError("Unexpected reply on the file channel")
+    return int(fields[0])
+
+def upload(address, username, token, path, digest, size):
+    ''' Send a file the server does not have yet, from wherever an earlier attempt stopped '''
+    with connect(address) as sock:
+        sock.sendall(protocol.encode_text(protocol.FILE_PUT, username, token, digest, str(size)))
+        offset = expect_ready(sock)
+        if offset < size:
+            with open(path, "rb") as file:
+                sock.sendfile(file, offset, size - offset)
+            offset = expect_ready(sock)
+        if offset != size:
+            raise protocol.ProtocolError("The server did not store the whole file")
+
+def download(address, digest, name, directory=DOWNLOAD_DIR):
+    ''' Fetch a shared file into directory, continuing a partial download; returns its path '''
+    os.makedirs(directory, exist_ok=True)
+    partial = os.path.join(directory, digest + PARTIAL_SUFFIX)
+    with open(partial, "ab+") as file:
+        offset = file.tell()
+        with connect(address) as sock:
+            sock.sendall(protocol.encode_text(protocol.FILE_GET, digest, str(offset)))
+            size = expect_ready(sock)
+            buffer = bytearray(CHUNK_SIZE)
+            with memoryview(buffer) as view:
+                while offset < size:
+                    nbytes = sock.recv_into(view[:min(CHUNK_SIZE, size - offset)])
+                    if not nbytes:
+                        raise ConnectionResetError("Server closed the connection")
+                    file.write(view[:nbytes])
+                    offset += nbytes
+
+    if file_digest(partial)[0] != digest:
+        os.remove(partial)
+        raise protocol.ProtocolError(f"{name} arrived damaged")
+    path = unused_path(directory, name)
+    os.replace(partial, path)
+    return path
+
+def unused_path(directory, name):
+    ''' Path for name in directory that does not overwrite an existing file '''
+    stem, extension = os.path.splitext(name)
+    path, copy = os.path.join(directory, name), 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem} ({copy}){extension}")
+        copy += 1
+    return path
+
+def format_size(size):
+    ''' Human readable file size '''
+    for unit in ("bytes", "KB", "MB"):
+        if size < 1024:
+            return f"{size:g} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
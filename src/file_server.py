@@ -0,0 +1,169 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: file_server.py stores shared files and serves the
+file channel. Files travel on connections of their own, one per
+transfer and each on its own thread, so an upload never queues
+behind chat frames or chat frames behind it, whichever engine runs
+the chat.
+
+Files are stored once under the SHA-256 digest of their contents:
+uploading a file the server already has costs one round trip, and
+an interrupted upload or download picks up at the byte it stopped
+at. Downloads are written to the socket with sendfile(), so the
+contents go from the page cache to the network without passing
+through Python. (Over TLS the contents must be encrypted in
+Python first, so sendfile() falls back to ordinary writes.)
+'''
+
+# IMPORTS
+import hashlib
+import os
+import socket
+import threading
+import chat_core
+import metrics
+import protocol
+import tls
+
+MAX_FILE_SIZE = 100 * 1024 * 1024  # Largest file a client may upload
+CHUNK_SIZE = 256 * 1024            # Bytes received per write to disk
+IDLE_TIMEOUT = 60.0                # Seconds a stalled transfer keeps its connection
+PARTIAL_SUFFIX = ".part"
+
+class FileStore:
+    ''' Content-addressed directory of complete and partly uploaded files '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.uploading = set()  # Digests with an upload in progress
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest)
+
+    def size(self, digest):
+        ''' Size of a stored file, or None if it is not stored '''
+        try:
+            return os.path.getsize(self.path(digest))
+        except OSError:
+            return None
+
+    def receive(self, sock, digest, size):
+        ''' Store a file uploaded over sock, resuming any earlier partial upload
+
+        Tells the client the offset to send from, receives the rest
+        and checks the digest; returns True once the file is stored.
+        '''
+        with self.lock:
+            if digest in self.uploading:
+                raise protocol.ProtocolError("This file is already being uploaded")
+            self.uploading.add(digest)
+        partial = self.path(digest) + PARTIAL_SUFFIX
+        try:
+            with open(partial, "ab+") as file:
+                # Hash what an earlier connection left behind before appending to it
+                hasher = hashlib.sha256()
+                file.seek(0)
+                while chunk := file.read(CHUNK_SIZE):
+                    hasher.update(chunk)
+                offset = file.tell()
+                if offset > size:
+                    file.truncate(0)
+                    hasher, offset = hashlib.sha256(), 0
+                sock.sendall(protocol.encode_text(protocol.FILE_READY, str(offset)))
+
+                buffer = bytearray(CHUNK_SIZE)
+                with memoryview(buffer) as view:
+                    while offset < size:
+                        nbytes = sock.recv_into(view[:min(CHUNK_SIZE, size - offset)])
+                        if not nbytes:
+                            return False  # Kept for the client to resume
+                        file.write(view[:nbytes])
+                        hasher.update(view[:nbytes])
+                        offset += nbytes
+                        metrics.file_bytes_received.inc(nbytes)
+
+            if hasher.hexdigest() != digest:
+                os.remove(partial)
+                raise protocol.ProtocolError("Uploaded contents do not match their digest")
+            os.replace(partial, self.path(digest))
+            metrics.files_stored.inc()
+            return True
+        finally:
+            with self.lock:
+                self.uploading.discard(digest)
+
+    def send(self, sock, digest, offset):
+        ''' Stream a stored file from offset with sendfile() '''
+        with open(self.path(digest), "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            sock.sendall(protocol.encode_text(protocol.FILE_READY, str(size)))
+            if offset < size:
+                metrics.file_bytes_sent.inc(sock.sendfile(file, offset))
+
+class FileServer:
+    ''' Accepts file channel connections and runs each transfer on its own thread '''
+
+    def __init__(self, directory, port, max_size=MAX_FILE_SIZE):
+        self.store = FileStore(directory)
+        self.port = port
+        self.max_size = max_size
+
+    def start(self, host):
+        ''' Listen for file transfers on host '''
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((host, self.port))
+        server_socket.listen()
+        threading.Thread(target=self._accept_loop, args=(server_socket,), daemon=True).start()
+        chat_core.notify(f"File transfers on {host}:{self.port}", "System")
+
+    def _accept_loop(self, server_socket):
+        while True:
+            sock, _ = server_socket.accept()
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        try:
+            if tls.context is not None:
+                sock = tls.accept(sock)
+            sock.settimeout(IDLE_TIMEOUT)
+            msg_type, fields = protocol.recv_frame(sock)
+            if msg_type == protocol.FILE_PUT and len(fields) == 4:
+                self._upload(sock, *fields)
+            elif msg_type == protocol.FILE_GET and len(fields) == 2:
+                self._download(sock, *fields)
+            else:
+                raise protocol.ProtocolError("Unknown file request")
+        except protocol.ProtocolError as error:
+            try:
+                sock.sendall(protocol.system_frame(str(error)))
+            except OSError:
+                pass
+        except (OSError, ValueError):
+            pass
+        sock.close()
+
+    def _upload(self, sock, username, token, digest, size):
+        # Only clients connected to the chat, under their own name, may upload
+        if chat_core.client_sessions.owner(token) != username:
+            raise protocol.ProtocolError("Log in to the chat before uploading files")
+        size = chat_core.parse_number(size)
+        if not protocol.valid_digest(digest) or size is None:
+            raise protocol.ProtocolError("Malformed upload request")
+        if size > self.max_size:
+            raise protocol.ProtocolError(f"Files are limited to {self.max_size // (1024 * 1024)} MB")
+        if self.store.size(digest) == size:
+            metrics.files_deduplicated.inc()  # Stored already: nothing to send
+            sock.sendall(protocol.encode_text(protocol.FILE_READY, str(size)))
+            return
+        if self.store.receive(sock, digest, size):
+            sock.sendall(protocol.encode_text(protocol.FILE_READY, str(size)))
+
+    def _download(self, sock, digest, offset):
+        offset = chat_core.parse_number(offset)
+        if not protocol.valid_digest(digest) or offset is None or self.store.size(digest) is None:
+            raise protocol.ProtocolError("No such file")
+        self.store.send(sock, digest, offset)
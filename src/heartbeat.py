@@ -0,0 +1,133 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: heartbeat.py finds dead client connections. Each
+connection records the tick of the last bytes it sent us. A
+connection that stays quiet for an interval is pinged, and one
+that still says nothing before the timeout is aborted; the engine
+then cleans it up like any other disconnect, so the room sees one
+leave. Deadlines live in a single timer wheel, one slot per tick,
+so tens of thousands of connections cost one timer in total and a
+received frame only writes an integer.
+'''
+
+# IMPORTS
+import threading
+import time
+import chat_core
+import metrics
+import protocol
+
+DEFAULT_INTERVAL = 30.0  # Seconds of silence before a connection is pinged
+DEFAULT_TIMEOUT = 10.0   # Seconds a pinged connection has to answer
+TICK = 1.0               # Seconds per wheel slot
+
+# Set by configure(); None while heartbeats are off
+monitor = None
+
+class TimerWheel:
+    ''' Hashed timer wheel with one slot per tick
+
+    Delays are capped to the wheel size, and entries are never
+    removed early: whoever handles a due entry checks whether it
+    still matters.
+    '''
+
+    def __init__(self, slots):
+        self.slots = [[] for _ in range(slots)]
+        self.now = 0  # Ticks elapsed
+        self.lock = threading.Lock()
+
+    def schedule(self, entry, ticks):
+        ''' Make entry due after the given number of ticks (any thread) '''
+        ticks = max(1, min(ticks, len(self.slots) - 1))
+        with self.lock:
+            self.slots[(self.now + ticks) % len(self.slots)].append(entry)
+
+    def advance(self):
+        ''' Move on one tick; returns the entries now due '''
+        with self.lock:
+            self.now += 1
+            index = self.now % len(self.slots)
+            due, self.slots[index] = self.slots[index], []
+        return due
+
+class Watch:
+    ''' Liveness of one connection, touched whenever it sends us bytes '''
+    __slots__ = ("connection", "wheel", "seen", "pinged")
+
+    def __init__(self, connection, wheel):
+        self.connection = connection
+        self.wheel = wheel
+        self.seen = wheel.now
+        self.pinged = False
+
+    def touch(self):
+        self.seen = self.wheel.now
+        self.pinged = False
+
+class HeartbeatMonitor:
+    ''' Pings quiet connections and aborts those that stay silent '''
+
+    def __init__(self, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT):
+        self.interval = max(1, round(interval / TICK))  # In ticks
+        self.timeout = max(1, round(timeout / TICK))
+        self.wheel = TimerWheel(self.interval + self.timeout + 1)
+        self.ping = protocol.encode_text(protocol.PING, str(interval))
+
+    def watch(self, connection):
+        ''' Start tracking a newly accepted connection '''
+        watch = Watch(connection, self.wheel)
+        self.wheel.schedule(watch, self.interval)
+        return watch
+
+    def start(self):
+        ''' Tick on the engine's event loop, or on a thread of its own '''
+        loop = chat_core.engine_loop
+        if loop is not None:
+            def tick():
+                self.tick()
+                loop.call_later(TICK, tick)
+            loop.call_soon_threadsafe(loop.call_later, TICK, tick)
+        else:
+            threading.Thread(target=self._tick_loop, daemon=True).start()
+
+    def tick(self):
+        ''' Check every connection whose deadline falls in the next slot '''
+        wheel = self.wheel
+        for watch in wheel.advance():
+            if watch.connection.closed:
+                continue  # Gone already; dropped from the wheel here
+            idle = wheel.now - watch.seen
+            if idle < self.interval:
+                wheel.schedule(watch, self.interval - idle)
+            elif not watch.pinged:
+                watch.pinged = True
+                metrics.pings_sent.inc()
+                watch.connection.send(self.ping)
+                wheel.schedule(watch, self.timeout)
+            else:
+                # No answer: abort, and let the engine's disconnect path clean up once
+                metrics.connections_reaped.inc()
+                watch.connection.abort()
+
+    def _tick_loop(self):
+        deadline = time.monotonic()
+        while True:
+            deadline += TICK
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            self.tick()
+
+def configure(interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    ''' Turn heartbeats on, or off with an interval of 0 '''
+    global monitor
+    monitor = HeartbeatMonitor(interval, timeout) if interval > 0 else None
+
+def watch(connection):
+    ''' Track a new connection; returns its Watch, or None if heartbeats are off '''
+    return monitor.watch(connection) if monitor is not None else None
+
+def start():
+    ''' Start the heartbeat ticker if heartbeats are on '''
+    if monitor is not None:
+        monitor.start()
@@ -0,0 +1,179 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: message_log.py persists relayed chat messages in an
+append-only log split into rotating segment files. Each segment
+stores the encoded frames back to back, exactly as they went out
+on the wire, next to an index of fixed-size file offsets. Replay
+maps a segment into memory and hands out the byte range holding
+every frame after a given sequence number, so nothing is decoded
+or copied into the heap on the way back to the client.
+'''
+
+# IMPORTS
+import errno
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_right
+import protocol
+
+SEGMENT_BYTES = 16 * 1024 * 1024   # Start a new segment once this size is reached
+MAX_SEGMENTS = 64                  # Oldest segments beyond this are deleted
+MAX_REPLAY = 1000                  # Most messages sent to one reconnecting client
+INDEX_ENTRY = struct.Struct("!Q")  # Offset of one frame inside its segment
+
+class Segment:
+    ''' One log file and its offset index, covering consecutive sequence numbers '''
+    __slots__ = ("first_seq", "log_path", "index_path", "count", "size")
+
+    def __init__(self, directory, first_seq):
+        name = f"segment-{first_seq:020d}"
+        self.first_seq = first_seq
+        self.log_path = os.path.join(directory, name + ".log")
+        self.index_path = os.path.join(directory, name + ".idx")
+        self.count = 0
+        self.size = 0
+
+    def offset_of(self, seq):
+        ''' File offset of a frame, read from the on-disk index '''
+        with open(self.index_path, "rb") as index:
+            index.seek((seq - self.first_seq) * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+
+    def recover(self):
+        ''' Load sizes from disk and cut off a write torn by a crash '''
+        self.count = os.path.getsize(self.index_path) // INDEX_ENTRY.size
+        log_size = os.path.getsize(self.log_path)
+        self.size = 0
+        while self.count:
+            offset = self.offset_of(self.first_seq + self.count - 1)
+            with open(self.log_path, "rb") as log:
+                log.seek(offset)
+                header = log.read(protocol.HEADER_SIZE)
+            if len(header) == protocol.HEADER_SIZE:
+                end = offset + protocol.HEADER_SIZE + protocol.HEADER.unpack(header)[0]
+                if end <= log_size:
+                    self.size = end
+                    break
+            self.count -= 1
+
+        os.truncate(self.index_path, self.count * INDEX_ENTRY.size)
+        os.truncate(self.log_path, self.size)
+
+class MessageLog:
+    ''' Append-only, segmented store of chat frames keyed by sequence number '''
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_segments=MAX_SEGMENTS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.segments = []
+        self.last_seq = 0
+        self._log_file = self._index_file = None
+
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("segment-") and name.endswith(".log"):
+                segment = Segment(directory, int(name[len("segment-"):-len(".log")]))
+                if os.path.exists(segment.index_path):
+                    segment.recover()
+                    self.segments.append(segment)
+        if self.segments:
+            last = self.segments[-1]
+            self.last_seq = last.first_seq + last.count - 1
+            self._open(last)
+
+    @property
+    def first_seq(self):
+        ''' Oldest sequence number still on disk '''
+        return self.segments[0].first_seq if self.segments else self.last_seq + 1
+
+    def _open(self, segment):
+        ''' Make a segment the one receiving appends '''
+        if self._log_file is not None:
+            self._log_file.close()
+            self._index_file.close()
+        self._log_file = open(segment.log_path, "ab", buffering=0)
+        self._index_file = open(segment.index_path, "ab", buffering=0)
+
+    def _rotate(self, first_seq):
+        ''' Start a new segment and drop the oldest ones past the limit '''
+        segment = Segment(self.directory, first_seq)
+        self.segments.append(segment)
+        self._open(segment)
+        while len(self.segments) > self.max_segments:
+            old = self.segments.pop(0)
+            os.remove(old.log_path)
+            os.remove(old.index_path)
+
+    def append(self, seq, frame):
+        ''' Persist the frame for the next sequence number '''
+        with self.lock:
+            if seq != self.last_seq + 1:
+                raise ValueError(f"Expected sequence {self.last_seq + 1}, got {seq}")
+            segment = self.segments[-1] if self.segments else None
+            if segment is None or segment.size >= self.segment_bytes:
+                self._rotate(seq)
+                segment = self.segments[-1]
+
+            # Frame first, then its index entry, so recovery never indexes missing bytes
+            try:
+                if self._log_file.write(frame) != len(frame):
+                    raise OSError(errno.ENOSPC, "Short write to the message log")
+                self._index_file.write(INDEX_ENTRY.pack(segment.size))
+            except OSError:
+                # Cut off a partly written entry so the next append lands where it should
+                self._log_file.truncate(segment.size)
+                self._index_file.truncate(segment.count * INDEX_ENTRY.size)
+                raise
+            segment.size += len(frame)
+            segment.count += 1
+            self.last_seq = seq
+
+    def replay(self, since, limit=MAX_REPLAY):
+        ''' Return (count, chunks) holding every frame after sequence since
+
+        Each chunk is a read-only memoryview over a memory-mapped
+        segment and can be written to a socket as it is.
+        '''
+        with self.lock:
+            first = max(since + 1, self.last_seq - limit + 1, self.first_seq)
+            if first > self.last_seq:
+                return 0, []
+            count = self.last_seq - first + 1
+            position = bisect_right([segment.first_seq for segment in self.segments], first) - 1
+            ranges = [(segment, segment.size) for segment in self.segments[position:]]
+
+        chunks = []
+        for segment, size in ranges:
+            start = segment.offset_of(first) if segment.first_seq < first else 0
+            if size > start:
+                with open(segment.log_path, "rb") as log:
+                    mapped = mmap.mmap(log.fileno(), size, access=mmap.ACCESS_READ)
+                chunks.append(memoryview(mapped)[start:size])
+        return count, chunks
+
+    def read(self, seq):
+        ''' The frame stored for one sequence number, or None if it is gone '''
+        with self.lock:
+            if not self.first_seq <= seq <= self.last_seq:
+                return None
+            segment = self.segments[bisect_right([segment.first_seq for segment in self.segments], seq) - 1]
+        try:
+            with open(segment.log_path, "rb") as log:
+                log.seek(segment.offset_of(seq))
+                header = log.read(protocol.HEADER_SIZE)
+                return header + log.read(protocol.HEADER.unpack(header)[0])
+        except OSError:
+            return None  # Segment deleted by a rotation meanwhile
+
+    def close(self):
+        ''' Close the files receiving appends '''
+        with self.lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._index_file.close()
+                self._log_file = self._index_file = None
@@ -0,0 +1,215 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: metrics.py counts what the chat server does. Hot
+paths only bump counters and drop timings into fixed histogram
+buckets; the text is built when someone asks for it. Metrics are
+served in the Prometheus text format from a local HTTP port and
+can also be dumped to the server log every few seconds.
+'''
+
+# IMPORTS
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Set from the server command line; each worker process serves port + its index
+port = None
+host = "127.0.0.1"
+dump_interval = 0  # Seconds between stats lines in the log, 0 for none
+
+# Every metric in the order it is exposed
+metrics = []
+
+class Counter:
+    ''' Monotonic total, safe to bump from any thread
+
+    The event loop of the asyncio engine bumps its own unlocked part
+    instead, which costs a plain addition per frame; only that one
+    thread writes it, and both parts are added up when collected.
+    '''
+    __slots__ = ("name", "help", "value", "lock", "loop_value")
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+        self.loop_value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def inc_loop(self, amount=1):
+        ''' Bump without locking; only ever call this from the asyncio engine's event loop '''
+        self.loop_value += amount
+
+    def samples(self):
+        yield self.name, self.value + self.loop_value
+
+class Gauge:
+    ''' Value read from a callback whenever metrics are collected '''
+    __slots__ = ("name", "help", "read")
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def samples(self):
+        yield self.name, self.read()
+
+class Histogram:
+    ''' Counts of observed durations per bucket, plus their sum '''
+    __slots__ = ("name", "help", "bounds", "counts", "sum", "lock")
+    kind = "histogram"
+
+    def __init__(self, name, help_text, bounds=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def quantile(self, fraction):
+        ''' Upper bound of the bucket holding the given fraction of observations '''
+        with self.lock:
+            counts = list(self.counts)
+        rank = fraction * sum(counts)
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0.0
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        seen = 0
+        for bound, count in zip(self.bounds, counts):
+            seen += count
+            yield f'{self.name}_bucket{{le="{bound}"}}', seen
+        yield f'{self.name}_bucket{{le="+Inf"}}', seen + counts[-1]
+        yield f"{self.name}_sum", total
+        yield f"{self.name}_count", seen + counts[-1]
+
+def counter(name, help_text):
+    metrics.append(Counter(name, help_text))
+    return metrics[-1]
+
+def gauge(name, help_text, read):
+    metrics.append(Gauge(name, help_text, read))
+    return metrics[-1]
+
+def histogram(name, help_text, bounds=LATENCY_BUCKETS):
+    metrics.append(Histogram(name, help_text, bounds))
+    return metrics[-1]
+
+# SERVER METRICS
+connections_accepted = counter("chat_connections_accepted_total", "Client connections accepted")
+connections_closed = counter("chat_connections_closed_total", "Client connections closed")
+handshakes_failed = counter("chat_handshakes_failed_total", "Connections refused at the username handshake")
+frames_received = counter("chat_frames_received_total", "Frames received from clients")
+bytes_received = counter("chat_bytes_received_total", "Bytes received from clients")
+chat_messages = counter("chat_messages_total", "Chat messages numbered and broadcast")
+frames_sent = counter("chat_frames_sent_total", "Frames written to clients and node links")
+bytes_sent = counter("chat_bytes_sent_total", "Bytes written to clients and node links")
+send_failures = counter("chat_send_failures_total", "Socket writes that failed")
+frames_dropped = counter("chat_frames_dropped_total", "Frames discarded because a send queue was full")
+slow_disconnects = counter("chat_slow_consumer_disconnects_total", "Clients dropped for not keeping up")
+frames_deferred = counter("chat_frames_deferred_total", "Chat frames held in a retransmit window until the client's queue drained")
+frames_delayed = counter("chat_rate_limit_delays_total", "Frames after which a client over its rate limit was paused")
+frames_rate_dropped = counter("chat_rate_limit_drops_total", "Frames discarded because a client was over its rate limit")
+pings_sent = counter("chat_pings_total", "Heartbeat pings sent to quiet connections")
+connections_reaped = counter("chat_connections_reaped_total", "Connections aborted for not answering a ping")
+rate_disconnects = counter("chat_rate_limit_disconnects_total", "Clients dropped for exceeding their rate limit")
+files_stored = counter("chat_files_stored_total", "Uploaded files stored under their digest")
+files_deduplicated = counter("chat_files_deduplicated_total", "Uploads skipped because the file was stored already")
+file_bytes_received = counter("chat_file_bytes_received_total", "File bytes received on the file channel")
+file_bytes_sent = counter("chat_file_bytes_sent_total", "File bytes sent on the file channel")
+tls_sessions_resumed = counter("chat_tls_sessions_resumed_total", "TLS handshakes that resumed an earlier session")
+tls_handshakes_failed = counter("chat_tls_handshakes_failed_total", "TLS handshakes that failed or timed out")
+
+accept_seconds = histogram("chat_accept_seconds", "Time to hand an accepted connection to its handler")
+handshake_seconds = histogram("chat_handshake_seconds", "Time to register a client from its first frame")
+recv_seconds = histogram("chat_recv_seconds", "Time to handle the frames of one read from a client")
+fanout_seconds = histogram("chat_fanout_seconds", "Time to queue one frame for every member of a room")
+send_seconds = histogram("chat_send_seconds", "Time of one blocking write of queued frames to a client socket (threaded engine)")
+tls_handshake_seconds = histogram("chat_tls_handshake_seconds", "Time of one TLS handshake run on a connection thread (threaded engine, file channel)")
+
+# EXPOSITION
+def render():
+    ''' Every metric in the Prometheus text exposition format '''
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name} {value}" for name, value in metric.samples())
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    ''' Answers GET /metrics; anything else is not found '''
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would drown out the chat log
+
+def summary(elapsed, previous_messages):
+    ''' One log line with the numbers worth watching live '''
+    values = {metric.name: value for metric in metrics for name, value in metric.samples() if name == metric.name}
+    rate = (chat_messages.value - previous_messages) / elapsed
+    return (
+        f"Stats: {values.get('chat_clients', 0)} clients, {values.get('chat_rooms', 0)} rooms, "
+        f"{rate:.1f} msg/s, {values.get('chat_send_queue_frames', 0)} frames queued "
+        f"(deepest {values.get('chat_send_queue_max_frames', 0)}), "
+        f"{values.get('chat_slow_consumers', 0)} slow consumer(s), {frames_dropped.value} dropped, "
+        f"fan-out p99 <= {fanout_seconds.quantile(0.99) * 1000:g} ms, "
+        f"send p99 <= {send_seconds.quantile(0.99) * 1000:g} ms"
+    )
+
+def dump_loop(write):
+    last_time, last_messages = time.monotonic(), chat_messages.value
+    while True:
+        time.sleep(dump_interval)
+        now = time.monotonic()
+        write(summary(now - last_time, last_messages))
+        last_time, last_messages = now, chat_messages.value
+
+def start(write):
+    ''' Serve /metrics and start the stats dump, as configured '''
+    if port:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        write(f"Metrics on http://{host}:{port}/metrics")
+    if dump_interval > 0:
+        threading.Thread(target=dump_loop, args=(write,), daemon=True).start()
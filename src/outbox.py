@@ -0,0 +1,86 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: outbox.py implements the client's send pipeline.
+The GUI thread only appends encoded frames to a queue; a writer
+thread drains everything queued since its last write in a single
+gather write, so a pasted burst of lines costs one system call
+instead of one per line. While the client is reconnecting, chat
+frames stay queued and are written to the new connection once the
+handshake is done.
+'''
+
+# IMPORTS
+import socket
+import threading
+from collections import deque
+import fanout
+
+MAX_PENDING = 1000   # Frames kept while disconnected before send() refuses more
+MAX_BATCH = 256      # Most frames coalesced into one write
+
+def open_connection(address):
+    ''' Connect with Nagle's algorithm disabled; batching happens in the outbox '''
+    sock = socket.create_connection(address)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+class Outbox:
+    ''' Queue of outgoing frames written by a background thread
+
+    A frame stays queued until it has been written, so frames queued
+    while offline or lost with a failed write go out on the next
+    connection. Frames sent with keep=False (room commands, resync
+    requests) only make sense on the current connection and are
+    dropped when it goes away.
+    '''
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.queue = deque()  # (frame, keep) pairs, oldest first
+        self.sock = None      # Connection being written to, None while offline
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def send(self, frame, keep=True):
+        ''' Queue a frame without blocking; returns False if the outbox is full '''
+        with self.condition:
+            if len(self.queue) >= MAX_PENDING:
+                return False
+            self.queue.append((frame, keep))
+            self.condition.notify()
+            return True
+
+    def attach(self, sock):
+        ''' Start writing to a connection whose handshake has been sent '''
+        with self.condition:
+            self.sock = sock
+            self.condition.notify()
+
+    def detach(self):
+        ''' Stop writing and forget frames that only belonged to the old connection '''
+        with self.condition:
+            self.sock = None
+            kept = [entry for entry in self.queue if entry[1]]
+            self.queue.clear()
+            self.queue.extend(kept)
+
+    def _write_loop(self):
+        while True:
+            with self.condition:
+                while not (self.queue and self.sock):
+                    self.condition.wait()
+                sock = self.sock
+                batch = [frame for frame, _ in list(self.queue)[:MAX_BATCH]]
+            try:
+                fanout.send_frames(sock, batch)
+            except OSError:
+                # Keep the batch; the receiving thread reconnects and attaches again
+                with self.condition:
+                    if self.sock is sock:
+                        self.sock = None
+                continue
+            with self.condition:
+                if self.sock is sock:
+                    for _ in batch:
+                        self.queue.popleft()
@@ -0,0 +1,89 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: presence.py keeps the versioned roster of the users
+in one chat room. A client receives one full snapshot when it connects and
+afterwards only numbered join/leave deltas; a client that notices
+a gap in the version numbers asks for a fresh snapshot. Recent
+deltas are kept so a resumed session is sent only what it missed.
+'''
+
+# IMPORTS
+import threading
+from collections import deque
+import protocol
+
+HISTORY_SIZE = 256  # Recent deltas kept for resumed sessions
+
+class Presence:
+    ''' Versioned roster that emits snapshots and join/leave deltas
+
+    Every change is numbered and queued for delivery while the lock
+    is held, so all clients see the deltas in version order.
+    '''
+
+    def __init__(self, room, broadcast):
+        self.room = room
+        self.broadcast = broadcast
+        self.lock = threading.Lock()
+        self.version = 0
+        self.roster = {}  # Username -> None, keeps join order
+        self.history = deque(maxlen=HISTORY_SIZE)  # (version, delta frame), oldest first
+        self._snapshots = {}  # Codec -> snapshot frame of the current version
+
+    def join(self, connection, username):
+        ''' Add a user, send them the snapshot and tell everyone else
+
+        connection is None for a user connected to another server node.
+        '''
+        with self.lock:
+            self.version += 1
+            self.roster[username] = None
+            self._snapshots.clear()
+            if connection is not None:
+                connection.send(self._snapshot_frame(connection.codec))
+            self._publish(protocol.join_frame(self.version, self.room, username), connection)
+
+    def leave(self, username):
+        ''' Remove a user and tell everyone still connected '''
+        with self.lock:
+            if username not in self.roster:
+                return
+            del self.roster[username]
+            self.version += 1
+            self._snapshots.clear()
+            self._publish(protocol.leave_frame(self.version, self.room, username))
+
+    def resync(self, connection):
+        ''' Resend the full snapshot to a client that missed a delta '''
+        with self.lock:
+            connection.send(self._snapshot_frame(connection.codec))
+
+    def catch_up(self, connection, known_version):
+        ''' Send a resumed client the deltas after known_version, or a snapshot '''
+        with self.lock:
+            if known_version == self.version:
+                return
+            oldest = self.history[0][0] if self.history else self.version + 1
+            if known_version is None or not oldest <= known_version + 1 <= self.version:
+                connection.send(self._snapshot_frame(connection.codec))
+                return
+            for version, frame in self.history:
+                if version > known_version:
+                    connection.send(frame)
+
+    def _publish(self, frame, sender=None):
+        # Caller holds the lock
+        self.history.append((self.version, frame))
+        self.broadcast(frame, sender)
+
+    def _snapshot_frame(self, codec=None):
+        # Rebuilt and compressed at most once per version and codec, shared by every resync
+        frame = self._snapshots.get(codec)
+        if frame is None:
+            if codec is None:
+                frame = protocol.presence_frame(self.version, self.room, self.roster)
+            else:
+                frame = protocol.compress_frame(self._snapshot_frame(), codec)
+            self._snapshots[codec] = frame
+        return frame
@@ -0,0 +1,341 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: protocol.py defines the wire format shared by the
+chat server and client. Every message travels as one frame:
+
+    +----------------+--------+--------+-----------------+
+    | length (4, BE) | type 1 | flags 1| payload (length)|
+    +----------------+--------+--------+-----------------+
+
+Text payloads are UTF-8 and multiple fields inside one payload
+are separated by the ASCII unit separator (0x1f). A flag marks a
+payload compressed with zlib, optionally primed with a dictionary
+of common chat text; each frame is compressed on its own, so one
+compressed broadcast can be shared by every recipient.
+
+File contents never travel on the chat connection. They are
+streamed over a separate file channel: one connection per transfer
+that opens with a single frame each way, after which the rest of
+the connection is the raw file bytes.
+'''
+
+# IMPORTS
+import struct
+import zlib
+
+# MESSAGE TYPES
+CHAT = 1         # client -> server: room, text / server -> client: sequence, room, sender, epoch milliseconds, text
+JOIN = 2         # client -> server: username[, last seen sequence] / server -> client: version, room, username
+LEAVE = 3        # server -> client: version, room, username
+PRESENCE = 4     # server -> client: version, room, every username in the room
+SYSTEM = 5       # server -> client: informational text
+RESYNC = 6       # client -> server: room, asks for a fresh presence snapshot
+ROOM_JOIN = 7    # client -> server: room[, last seen sequence]
+ROOM_PART = 8    # client -> server: room
+
+# Node links between the servers of a cluster
+NODE_HELLO = 9   # node -> node: node id
+NODE_STATE = 10  # node -> node: last chunk flag, then room, username pairs of every local member
+NODE_JOIN = 11   # node -> node: room, username
+NODE_PART = 12   # node -> node: room, username
+NODE_CHAT = 13   # node -> node: room, sender, epoch milliseconds, text
+
+# Resumable sessions
+SESSION = 14     # server -> client: token for resuming the session after a reconnect
+RESUME = 15      # client -> server: username, token, last seen sequence, then room, presence version pairs
+
+# Compression, offered by the client before or after its handshake
+COMPRESS = 16    # client -> server: codecs it decodes / server -> client: codec chosen, empty for none
+
+# Heartbeat, sent to connections that have been quiet for a while
+PING = 17        # server -> client: heartbeat interval in seconds, answer with PONG
+PONG = 18        # client -> server: no payload
+
+# Search over the logged chat history
+SEARCH = 19      # client -> server: room, cursor (empty for the newest hits), query
+SEARCH_HITS = 20 # server -> client: room, cursor of the next page (empty if none), then sequence, sender, epoch milliseconds, n and the text as n fields per hit
+
+# Direct messages between two users
+DIRECT = 21      # client -> server: message id, recipient, text / server -> client: sender, epoch milliseconds, text
+DIRECT_ACK = 22  # server -> client: message id, recipient, status (delivered, queued or rejected)
+NODE_DIRECT = 23 # node -> node: message id, sender, recipient, epoch milliseconds, text
+NODE_DIRECT_ACK = 24  # node -> node: message id, sender, recipient, status
+
+# File sharing; the contents go over the file channel, named by their SHA-256
+FILES = 25       # server -> client: port of the file channel
+FILE_SHARE = 26  # client -> server: room, file name, size, digest / server -> client: room, sender, epoch milliseconds, file name, size, digest
+FILE_PUT = 27    # file channel, client -> server: username, session token, digest, size; then the bytes from the offset
+FILE_GET = 28    # file channel, client -> server: digest, offset
+FILE_READY = 29  # file channel, server -> client: offset to upload from (the size once stored) or size to download
+
+# Delivery acks, letting the server release the chat frames it keeps for resending
+ACK = 30         # client -> server: sequence number of the newest chat message received
+
+# Room every client is placed in when it connects
+DEFAULT_ROOM = "general"
+
+# FRAME LAYOUT
+HEADER = struct.Struct("!IBB")
+HEADER_SIZE = HEADER.size
+FIELD_SEPARATOR = "\x1f"
+MAX_FRAME_SIZE = 1024 * 1024   # Largest payload a peer may send
+MAX_USERNAME_LENGTH = 32
+MAX_ROOM_LENGTH = 32
+MAX_FILE_NAME_LENGTH = 255
+DIGEST_LENGTH = 64             # Hex characters of a SHA-256 digest
+
+# Frame flags and compression codecs, in order of preference
+ZLIB = 0x01      # Payload is zlib compressed
+ZDICT = 0x02     # Payload is zlib compressed with SHARED_DICTIONARY
+COMPRESSED = ZLIB | ZDICT
+CODECS = {"zdict": ZDICT, "zlib": ZLIB}
+COMPRESS_THRESHOLD = 256       # Smaller payloads are never worth compressing
+COMPRESS_LEVEL = 6
+
+# Text that turns up in most frames, so even short payloads compress well;
+# zlib looks for matches nearest the end first, so frequent text goes last
+SHARED_DICTIONARY = (
+    " the and you that for is it to of in this was with have are not but what "
+    "just like know can think good yeah okay thanks lol "
+    "You are not in #. Catching up on missed message(s) in #. "
+    " has left the chat. has joined the chat!\x1fgeneral\x1f"
+).encode('utf-8')
+
+# Decoder buffer sizing
+READ_SIZE = 4096               # Minimum free space offered to each recv
+MAX_IDLE_BUFFER = 64 * 1024    # Shrink back once a large frame is consumed
+
+class ProtocolError(ValueError):
+    ''' Raised when a peer sends a malformed or oversized frame '''
+
+# ENCODING FUNCTIONS
+def encode_frame(msg_type, payload=b"", flags=0):
+    ''' Build a complete frame around an already encoded payload '''
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Payload of {len(payload)} bytes exceeds the frame limit")
+    return HEADER.pack(len(payload), msg_type, flags) + payload
+
+def encode_text(msg_type, *fields):
+    ''' Build a frame whose payload is one or more text fields '''
+    return encode_frame(msg_type, FIELD_SEPARATOR.join(fields).encode('utf-8'))
+
+def chat_frame(sequence, room, sender, millis, message):
+    ''' Frame relaying the numbered, server-stamped chat message from sender to a room '''
+    return encode_text(CHAT, str(sequence), room, sender, str(millis), message)
+
+def join_frame(version, room, username):
+    ''' Presence delta announcing that username has joined the room '''
+    return encode_text(JOIN, str(version), room, username)
+
+def leave_frame(version, room, username):
+    ''' Presence delta announcing that username has left the room '''
+    return encode_text(LEAVE, str(version), room, username)
+
+def presence_frame(version, room, usernames):
+    ''' Presence snapshot listing every username in the room '''
+    return encode_text(PRESENCE, str(version), room, *usernames)
+
+def system_frame(message):
+    ''' Frame carrying an informational server message '''
+    return encode_text(SYSTEM, message)
+
+# COMPRESSION FUNCTIONS
+def choose_codec(offered):
+    ''' Preferred codec among those a peer offered, or None '''
+    return next((codec for codec in CODECS if codec in offered), None)
+
+def compress_frame(frame, codec):
+    ''' Same frame with its payload compressed, or unchanged if that does not pay '''
+    if codec is None or len(frame) - HEADER_SIZE < COMPRESS_THRESHOLD:
+        return frame
+    length, msg_type, flags = HEADER.unpack_from(frame)
+    if flags & COMPRESSED:
+        return frame
+    flag = CODECS[codec]
+    if flag == ZDICT:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zdict=SHARED_DICTIONARY)
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL)
+    with memoryview(frame) as view:
+        payload = compressor.compress(view[HEADER_SIZE:]) + compressor.flush()
+    if len(payload) >= length:
+        return frame
+    return HEADER.pack(len(payload), msg_type, flags | flag) + payload
+
+def decompress_frame(frame):
+    ''' Same frame with its payload uncompressed '''
+    _, msg_type, flags = HEADER.unpack_from(frame)
+    if not flags & COMPRESSED:
+        return frame
+    with memoryview(frame) as view:
+        return encode_frame(msg_type, decompress_payload(flags, view[HEADER_SIZE:]), flags & ~COMPRESSED)
+
+def decompress_payload(flags, payload, max_size=MAX_FRAME_SIZE):
+    ''' Original payload of a compressed frame, refusing to inflate past max_size '''
+    if flags & ZDICT:
+        decompressor = zlib.decompressobj(zdict=SHARED_DICTIONARY)
+    else:
+        decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, max_size)
+    except zlib.error as error:
+        raise ProtocolError(f"Corrupt compressed payload: {error}") from None
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ProtocolError("Compressed payload is truncated or too large")
+    return data
+
+# DECODING FUNCTIONS
+def decode_text(payload):
+    ''' Decode a single text payload '''
+    return str(payload, 'utf-8')
+
+def decode_fields(payload, maxsplit=-1):
+    ''' Decode a payload holding separated text fields
+
+    With maxsplit, the last field is the rest of the payload, so free
+    text sent last may contain separators without shifting the others.
+    '''
+    if not payload:
+        return []
+    return str(payload, 'utf-8').split(FIELD_SEPARATOR, maxsplit)
+
+def clean_text(text):
+    ''' Message text with any field separators turned into spaces, safe to put in a frame among other fields '''
+    return text.replace(FIELD_SEPARATOR, " ") if FIELD_SEPARATOR in text else text
+
+def valid_username(username):
+    ''' Check that a username is non-empty, short and free of separators '''
+    return (
+        0 < len(username) <= MAX_USERNAME_LENGTH
+        and username.isprintable()
+        and FIELD_SEPARATOR not in username
+    )
+
+def valid_room(room):
+    ''' Check that a room name is non-empty, short and free of separators and spaces '''
+    return (
+        0 < len(room) <= MAX_ROOM_LENGTH
+        and room.isprintable()
+        and FIELD_SEPARATOR not in room
+        and " " not in room
+    )
+
+def valid_digest(digest):
+    ''' Check that text is a lowercase hex SHA-256 digest, and so safe as a file name '''
+    return len(digest) == DIGEST_LENGTH and all(char in "0123456789abcdef" for char in digest)
+
+def valid_file_name(name):
+    ''' Check that a shared file's name is short, printable and has no directory part '''
+    return (
+        0 < len(name) <= MAX_FILE_NAME_LENGTH
+        and name.isprintable()
+        and FIELD_SEPARATOR not in name
+        and "/" not in name and "\\" not in name
+        and name not in (".", "..")
+    )
+
+def recv_exact(sock, size):
+    ''' Receive exactly size bytes from a blocking socket '''
+    data = bytearray(size)
+    with memoryview(data) as view:
+        received = 0
+        while received < size:
+            nbytes = sock.recv_into(view[received:])
+            if not nbytes:
+                raise ConnectionResetError("Peer closed the connection")
+            received += nbytes
+    return data
+
+def recv_frame(sock, max_size=READ_SIZE):
+    ''' Receive one small frame from a blocking socket without reading past it
+
+    Used on the file channel, where the bytes after the opening frame
+    are file contents rather than frames.
+    '''
+    length, msg_type, _ = HEADER.unpack(recv_exact(sock, HEADER_SIZE))
+    if length > max_size:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the frame limit")
+    return msg_type, decode_fields(recv_exact(sock, length))
+
+def split_frames(buffer):
+    ''' Yield (type, payload, frame) memoryviews from a buffer of whole frames '''
+    view = memoryview(buffer)
+    position = 0
+    while position + HEADER_SIZE <= len(view):
+        length, msg_type, _ = HEADER.unpack_from(view, position)
+        end = position + HEADER_SIZE + length
+        yield msg_type, view[position + HEADER_SIZE:end], view[position:end]
+        position = end
+
+class FrameDecoder:
+    ''' Incremental frame parser over a single reusable buffer
+
+    Bytes are received straight into the buffer (recv_into or an
+    asyncio BufferedProtocol), and frames() yields memoryview slices
+    of it, so each byte is copied at most once when the buffer is
+    compacted. A yielded payload is only valid until the next frame
+    is requested. Compressed payloads are inflated before they are
+    yielded, so callers never see them.
+    '''
+    __slots__ = ("_buffer", "_start", "_end", "max_size")
+
+    def __init__(self, max_size=MAX_FRAME_SIZE):
+        self._buffer = bytearray()
+        self._start = 0
+        self._end = 0
+        self.max_size = max_size
+
+    def get_buffer(self, sizehint=-1):
+        ''' Return writable space at the end of the buffered data '''
+        needed = max(sizehint, READ_SIZE)
+        buffer = self._buffer
+        if len(buffer) - self._end < needed:
+            # Move the partial frame to the front before growing
+            pending = self._end - self._start
+            if self._start:
+                buffer[:pending] = buffer[self._start:self._end]
+                self._start, self._end = 0, pending
+            if len(buffer) - pending < needed:
+                buffer.extend(bytes(max(needed, len(buffer))))
+        return memoryview(buffer)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        ''' Record that nbytes were written into the last get_buffer() '''
+        self._end += nbytes
+
+    def feed(self, data):
+        ''' Copy already received bytes into the buffer '''
+        with self.get_buffer(len(data)) as view:
+            view[:len(data)] = data
+        self.buffer_updated(len(data))
+
+    def recv_from(self, sock):
+        ''' Receive directly into the buffer; returns 0 once the peer closed '''
+        with self.get_buffer() as view:
+            nbytes = sock.recv_into(view)
+        self.buffer_updated(nbytes)
+        return nbytes
+
+    def frames(self):
+        ''' Yield (type, flags, payload) for every complete buffered frame '''
+        buffer = self._buffer
+        with memoryview(buffer) as view:
+            while self._end - self._start >= HEADER_SIZE:
+                length, msg_type, flags = HEADER.unpack_from(buffer, self._start)
+                if length > self.max_size:
+                    raise ProtocolError(f"Frame of {length} bytes exceeds the frame limit")
+                start = self._start + HEADER_SIZE
+                if self._end - start < length:
+                    break
+                self._start = start + length
+                with view[start:self._start] as payload:
+                    if flags & COMPRESSED:
+                        yield msg_type, flags, memoryview(decompress_payload(flags, payload, self.max_size))
+                    else:
+                        yield msg_type, flags, payload
+
+        if self._start == self._end:
+            self._start = self._end = 0
+            if len(buffer) > MAX_IDLE_BUFFER:
+                self._buffer = bytearray()
@@ -0,0 +1,128 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: ratelimit.py protects the server from floods. Every
+connection gets token buckets for frames and bytes per second,
+and all chat shares one fan-out budget: a message to a room of N
+members costs N deliveries, so one sender cannot saturate the
+server's egress by talking in a large room. A client over its
+limit is slowed down, has frames dropped, or is disconnected,
+depending on the configured action. Each check is O(1).
+'''
+
+# IMPORTS
+import threading
+import time
+import metrics
+import protocol
+
+# ACTIONS
+DELAY = "delay"            # Stop reading from the client until it is back within its limit
+DROP = "drop"              # Discard frames over the limit
+DISCONNECT = "disconnect"  # Drop the client altogether
+LIMIT_ACTIONS = (DELAY, DROP, DISCONNECT)
+
+BURST_SECONDS = 2.0  # A bucket holds this many seconds of its rate
+WARN_INTERVAL = 1.0  # Seconds between "too fast" notices to one client
+
+# Defaults used by new connections, set from the server command line
+message_rate = 50.0     # Frames per second per client, 0 for no limit
+byte_rate = 65536.0     # Bytes per second per client, 0 for no limit
+action = DELAY
+
+# Deliveries per second across all chat, None for no limit
+fanout_budget = None
+fanout_lock = threading.Lock()
+
+class RateLimited(protocol.ProtocolError):
+    ''' A client exceeded its rate limit under the disconnect action '''
+
+class TokenBucket:
+    ''' Refills at rate tokens per second up to burst tokens '''
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate * BURST_SECONDS
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def take(self, amount, borrow=False):
+        ''' Spend tokens; returns 0, or seconds until they would have been available
+
+        Without borrow nothing is spent when the tokens are short.
+        With borrow they are spent anyway and the balance goes into
+        debt, which the caller works off by waiting. A charge larger
+        than the bucket costs a full bucket, so it still goes through
+        once the bucket has refilled.
+        '''
+        amount = min(amount, self.burst)
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= amount or borrow:
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+        return (amount - self.tokens) / self.rate
+
+class RateLimiter:
+    ''' Limits of one client connection, used by its reader only '''
+    __slots__ = ("frames", "bytes", "action", "warned")
+
+    def __init__(self):
+        self.frames = TokenBucket(message_rate) if message_rate > 0 else None
+        self.bytes = TokenBucket(byte_rate) if byte_rate > 0 else None
+        self.action = action
+        self.warned = 0.0
+
+    def admit(self, nbytes):
+        ''' Charge one received frame; returns seconds to pause reading, or None to drop it '''
+        borrow = self.action == DELAY
+        wait = 0.0
+        if self.frames is not None:
+            wait = self.frames.take(1, borrow)
+        if self.bytes is not None:
+            wait = max(wait, self.bytes.take(nbytes, borrow))
+        return self._enforce(wait)
+
+    def admit_fanout(self, deliveries):
+        ''' Charge a chat message's deliveries to the shared fan-out budget '''
+        if fanout_budget is None:
+            return 0.0
+        with fanout_lock:
+            wait = fanout_budget.take(deliveries, self.action == DELAY)
+        return self._enforce(wait)
+
+    def should_warn(self):
+        ''' Whether to tell the client about a dropped frame, at most once per interval '''
+        now = time.monotonic()
+        if now - self.warned < WARN_INTERVAL:
+            return False
+        self.warned = now
+        return True
+
+    def _enforce(self, wait):
+        if not wait:
+            return 0.0
+        if self.action == DELAY:
+            metrics.frames_delayed.inc()
+            return wait
+        if self.action == DROP:
+            metrics.frames_rate_dropped.inc()
+            return None
+        metrics.rate_disconnects.inc()
+        raise RateLimited("Rate limit exceeded")
+
+def configure(frames=None, nbytes=None, fanout=None, limit_action=None):
+    ''' Change the limits and action for new connections '''
+    global message_rate, byte_rate, fanout_budget, action
+    if limit_action is not None:
+        if limit_action not in LIMIT_ACTIONS:
+            raise ValueError(f"Unknown limit action: {limit_action}")
+        action = limit_action
+    if frames is not None:
+        message_rate = frames
+    if nbytes is not None:
+        byte_rate = nbytes
+    if fanout is not None:
+        fanout_budget = TokenBucket(fanout) if fanout > 0 else None
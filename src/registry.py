@@ -0,0 +1,109 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: registry.py implements the connection registry
+shared by both server engines. Connections are spread over
+independently locked shards, usernames are indexed for O(1)
+lookups and uniqueness checks, and every shard publishes an
+immutable snapshot so broadcasts can iterate without locking
+while other threads join and leave.
+'''
+
+# IMPORTS
+import threading
+from itertools import chain
+
+DEFAULT_SHARDS = 16
+
+class _Shard:
+    ''' One lock-protected slice of the registry '''
+    __slots__ = ("lock", "entries", "snapshot")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.snapshot = ()  # Immutable (key, value) pairs, replaced on every change
+
+    def publish(self):
+        self.snapshot = tuple(self.entries.items())
+
+class ClientRegistry:
+    ''' Thread-safe map of connections to usernames '''
+
+    def __init__(self, shards=DEFAULT_SHARDS):
+        self._connections = [_Shard() for _ in range(shards)]
+        self._usernames = [_Shard() for _ in range(shards)]
+
+    def _connection_shard(self, connection):
+        return self._connections[hash(connection) % len(self._connections)]
+
+    def _username_shard(self, username):
+        return self._usernames[hash(username) % len(self._usernames)]
+
+    def add(self, connection, username):
+        ''' Register a connection; returns False if the username is taken '''
+        names = self._username_shard(username)
+        with names.lock:
+            if username in names.entries:
+                return False
+            names.entries[username] = connection
+            names.publish()
+
+        shard = self._connection_shard(connection)
+        with shard.lock:
+            shard.entries[connection] = username
+            shard.publish()
+        return True
+
+    def remove(self, connection):
+        ''' Unregister a connection and return its username, or None '''
+        shard = self._connection_shard(connection)
+        with shard.lock:
+            username = shard.entries.pop(connection, None)
+            if username is None:
+                return None
+            shard.publish()
+
+        names = self._username_shard(username)
+        with names.lock:
+            if names.entries.get(username) is connection:
+                del names.entries[username]
+                names.publish()
+        return username
+
+    def replace(self, old, new):
+        ''' Hand a username over to a new connection; returns it, or None '''
+        shard = self._connection_shard(old)
+        with shard.lock:
+            username = shard.entries.pop(old, None)
+            if username is None:
+                return None
+            shard.publish()
+
+        names = self._username_shard(username)
+        with names.lock:
+            names.entries[username] = new
+            names.publish()
+
+        shard = self._connection_shard(new)
+        with shard.lock:
+            shard.entries[new] = username
+            shard.publish()
+        return username
+
+    def lookup(self, username):
+        ''' Connection registered under a username, or None '''
+        return self._username_shard(username).entries.get(username)
+
+    def snapshot(self):
+        ''' Point-in-time (connection, username) pairs, taken without locking '''
+        return chain.from_iterable([shard.snapshot for shard in self._connections])
+
+    def __iter__(self):
+        return (connection for connection, _ in self.snapshot())
+
+    def __contains__(self, connection):
+        return connection in self._connection_shard(connection).entries
+
+    def __len__(self):
+        return sum(len(shard.snapshot) for shard in self._connections)
@@ -0,0 +1,113 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: retransmit.py keeps, for each client connection, the
+numbered chat frames the client has not confirmed yet. Every chat
+message carries its global sequence number, and clients send
+cumulative acks: "I have everything up to N". A client whose send
+queue fills up is no longer dropped or made to lose messages; its
+new chat frames wait in the window and are queued again, in order,
+as soon as the queue drains. Frames it has not acknowledged are
+also what a resumed session is sent, without needing a message log.
+
+The window is a ring buffer of sequence numbers and references to
+the frames that were queued anyway; broadcast frames are shared, so
+holding one costs a slot and not a copy. The ring starts small and
+doubles up to its limit, so idle connections stay cheap. Only a
+client that falls a whole window behind gets the overflow policy.
+'''
+
+# IMPORTS
+from array import array
+
+MIN_CAPACITY = 16
+
+# Frames held per connection at most, set from the server command line; 0 turns windows off
+window_size = 1024
+
+class RetransmitWindow:
+    ''' Ring of (sequence, frame) entries in sequence order, used under its connection's lock
+
+    Entries up to the client's last ack are released. Clients that
+    never ack are taken to have every frame that reached their send
+    queue, so for them the window only holds frames not queued yet.
+    '''
+    __slots__ = ("seqs", "frames", "start", "count", "unsent", "limit", "acked", "queued", "acking")
+
+    def __init__(self, limit=None):
+        self.limit = limit or window_size
+        capacity = min(MIN_CAPACITY, self.limit)
+        self.seqs = array("Q", bytes(8 * capacity))
+        self.frames = [None] * capacity
+        self.start = 0       # Slot of the oldest entry
+        self.count = 0
+        self.unsent = 0      # Newest entries not handed to the send queue yet
+        self.acked = 0       # Highest sequence number the client acknowledged
+        self.queued = 0      # Highest sequence number handed to the send queue
+        self.acking = False  # Set by the first ack
+
+    def push(self, seq, frame):
+        ''' Hold a new frame until it is queued and acknowledged; returns False if the window is full '''
+        self._release()
+        if self.count == len(self.frames):
+            if self.count >= self.limit:
+                return False
+            self._grow()
+        slot = (self.start + self.count) % len(self.frames)
+        self.seqs[slot] = seq
+        self.frames[slot] = frame
+        self.count += 1
+        self.unsent += 1
+        return True
+
+    def take(self, limit):
+        ''' Up to limit of the oldest frames not queued yet, now counted as queued '''
+        taken = []
+        size = len(self.frames)
+        while self.unsent and len(taken) < limit:
+            slot = (self.start + self.count - self.unsent) % size
+            taken.append(self.frames[slot])
+            self.queued = self.seqs[slot]
+            self.unsent -= 1
+        return taken
+
+    def drop_oldest(self):
+        ''' Forget the oldest entry to make room, losing it if it was never queued '''
+        if self.count == self.unsent:
+            self.unsent -= 1
+        self.frames[self.start] = None
+        self.start = (self.start + 1) % len(self.frames)
+        self.count -= 1
+
+    def ack(self, seq):
+        ''' Record a cumulative ack from the client '''
+        self.acking = True
+        self.acked = max(self.acked, seq)
+        self._release()
+
+    def since(self, seq):
+        ''' Every held frame numbered after seq, oldest first '''
+        size = len(self.frames)
+        slots = ((self.start + index) % size for index in range(self.count))
+        return [(self.seqs[slot], self.frames[slot]) for slot in slots if self.seqs[slot] > seq]
+
+    def _release(self):
+        # Acknowledged frames, or queued ones for clients that never ack, are done with
+        floor = self.acked if self.acking else self.queued
+        while self.count > self.unsent and self.seqs[self.start] <= floor:
+            self.frames[self.start] = None
+            self.start = (self.start + 1) % len(self.frames)
+            self.count -= 1
+
+    def _grow(self):
+        # Unroll the ring into a buffer twice the size
+        size = len(self.frames)
+        order = [(self.start + index) % size for index in range(self.count)]
+        capacity = min(size * 2, self.limit)
+        self.seqs = array("Q", [self.seqs[slot] for slot in order] + [0] * (capacity - self.count))
+        self.frames = [self.frames[slot] for slot in order] + [None] * (capacity - self.count)
+        self.start = 0
+
+def new_window():
+    ''' Window for a new client connection, or None if windows are off '''
+    return RetransmitWindow() if window_size > 0 else None
@@ -0,0 +1,174 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: rooms.py tracks which clients are in which chat
+rooms. Two indexes are kept in step: room -> members, used to fan
+a message out to exactly the room's subscribers, and member ->
+rooms, used to clean up after a client in one pass when it
+disconnects. Every room publishes an immutable snapshot of its
+members, so fan-out iterates without locking, and keeps its own
+presence roster. Members connected to other server nodes of a
+cluster appear in the roster but receive messages through their
+own node.
+'''
+
+# IMPORTS
+import threading
+import time
+import metrics
+import presence
+import protocol
+
+MAX_ROOMS_PER_CLIENT = 32
+
+class Room:
+    ''' One chat room with its members and their presence roster '''
+    __slots__ = ("name", "members", "snapshot", "remote", "nodes", "presence")
+
+    def __init__(self, name):
+        self.name = name
+        self.members = {}   # Connection -> username
+        self.snapshot = ()  # Immutable tuple of member connections, replaced on every change
+        self.remote = {}    # Username -> node id of members on other server nodes
+        self.nodes = frozenset()  # Nodes with remote members, replaced on every change
+        self.presence = presence.Presence(name, self.broadcast)
+
+    def publish(self):
+        self.snapshot = tuple(self.members)
+        self.nodes = frozenset(self.remote.values())
+
+    def empty(self):
+        return not self.members and not self.remote
+
+    def broadcast(self, frame, sender=None, seq=None):
+        ''' Queue an encoded frame for every member except the sender
+
+        The frame is compressed at most once per codec and the same
+        bytes are queued for every member that negotiated it. A chat
+        frame passes its sequence number and goes through each
+        member's retransmit window.
+        '''
+        started = time.perf_counter()
+        variants = {None: frame}
+        for connection in self.snapshot:
+            if connection is not sender:
+                shared = variants.get(connection.codec)
+                if shared is None:
+                    shared = variants[connection.codec] = protocol.compress_frame(frame, connection.codec)
+                if seq is not None and connection.window is not None:
+                    connection.send_numbered(seq, shared)
+                else:
+                    connection.send(shared) # Only queues; the connection's writer sends it
+        metrics.fanout_seconds.observe(time.perf_counter() - started)
+
+class RoomDirectory:
+    ''' Thread-safe room -> members and member -> rooms indexes
+
+    Rooms are created by their first member and dropped with their
+    last one. Membership changes happen under one lock; presence
+    updates are sent afterwards under the room's own roster lock.
+    '''
+
+    def __init__(self, max_rooms=MAX_ROOMS_PER_CLIENT):
+        self.lock = threading.Lock()
+        self.rooms = {}        # Room name -> Room
+        self.memberships = {}  # Connection -> set of room names
+        self.max_rooms = max_rooms
+
+    def join(self, connection, username, name):
+        ''' Add a member to a room; returns the Room, or None if not allowed '''
+        with self.lock:
+            joined = self.memberships.setdefault(connection, set())
+            if name in joined or len(joined) >= self.max_rooms:
+                return None
+            room = self.rooms.get(name)
+            if room is None:
+                room = self.rooms[name] = Room(name)
+            joined.add(name)
+            room.members[connection] = username
+            room.publish()
+        room.presence.join(connection, username)
+        return room
+
+    def part(self, connection, name):
+        ''' Remove a member from one room; returns False if it was not in it '''
+        with self.lock:
+            joined = self.memberships.get(connection)
+            if not joined or name not in joined:
+                return False
+            joined.discard(name)
+            room, username = self._remove(connection, name)
+        room.presence.leave(username)
+        return True
+
+    def part_all(self, connection):
+        ''' Remove a disconnecting client from every room it is in '''
+        with self.lock:
+            left = [self._remove(connection, name) for name in self.memberships.pop(connection, ())]
+        for room, username in left:
+            room.presence.leave(username)
+        return [room.name for room, _ in left]
+
+    def _remove(self, connection, name):
+        # Caller holds the lock; empty rooms are forgotten right away
+        room = self.rooms[name]
+        username = room.members.pop(connection)
+        room.publish()
+        if room.empty():
+            del self.rooms[name]
+        return room, username
+
+    def replace(self, old, new):
+        ''' Move every membership of a connection to its successor, silently '''
+        with self.lock:
+            names = self.memberships.pop(old, set())
+            self.memberships[new] = names
+            for name in names:
+                room = self.rooms[name]
+                room.members[new] = room.members.pop(old)
+                room.publish()
+
+    def join_remote(self, node, username, name):
+        ''' Add a member connected to another node; returns False if already known '''
+        with self.lock:
+            room = self.rooms.get(name)
+            if room is None:
+                room = self.rooms[name] = Room(name)
+            if username in room.remote:
+                return False
+            room.remote[username] = node
+            room.publish()
+        room.presence.join(None, username)
+        return True
+
+    def part_remote(self, username, name):
+        ''' Remove a member connected to another node; returns False if unknown '''
+        with self.lock:
+            room = self.rooms.get(name)
+            if room is None or room.remote.pop(username, None) is None:
+                return False
+            room.publish()
+            if room.empty():
+                del self.rooms[name]
+        room.presence.leave(username)
+        return True
+
+    def local_members(self):
+        ''' Every (room name, username) pair of clients connected to this node '''
+        with self.lock:
+            return [(room.name, username) for room in self.rooms.values() for username in room.members.values()]
+
+    def get(self, name):
+        ''' Room with this name, or None if nobody is in it '''
+        return self.rooms.get(name)
+
+    def is_member(self, connection, name):
+        ''' Whether the connection is in the named room '''
+        return name in self.memberships.get(connection, ())
+
+    def rooms_of(self, connection):
+        ''' Names of the rooms a connection is in '''
+        return sorted(self.memberships.get(connection, ()))
+
+    def __len__(self):
+        return len(self.rooms)
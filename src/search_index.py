@@ -0,0 +1,243 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: search_index.py is an inverted index over the chat
+history kept by message_log.py. Every logged message adds its
+sequence number to the posting list of each distinct word in its
+text, of its sender ("@name") and of its room ("#room"). Sequence
+numbers only grow, so every posting list is a sorted array that is
+appended to and intersected with binary searches, and the message
+timestamps, which never go backwards either, turn a date range into
+a sequence range.
+
+A search walks the shortest posting list from the newest match
+backwards and stops after one page, so finding the latest hits
+costs about the same with ten messages or ten million. Hits come
+newest first, and the next page resumes below the last sequence
+number returned. The index is saved next to the log from time to
+time; after a restart only messages logged since the last save are
+indexed again, and messages dropped with the log's oldest segments
+are dropped from the index as well.
+'''
+
+# IMPORTS
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+import protocol
+
+PAGE_SIZE = 20
+SAVE_INTERVAL = 60.0       # Seconds between saves while messages keep coming
+INDEX_FILE = "search.idx"
+MAX_TERM_LENGTH = 64
+MAGIC = b"CHATIDX1"
+FILE_HEADER = struct.Struct("!QQI")  # First sequence, last sequence, number of terms
+TERM_HEADER = struct.Struct("!HI")   # Term length in bytes, postings in the term
+
+WORD = re.compile(r"\w+")
+
+def terms_of(text):
+    ''' Distinct lowercase words of a text, as indexed '''
+    return {word for word in WORD.findall(text.lower()) if len(word) <= MAX_TERM_LENGTH}
+
+def day_millis(text, end=False):
+    ''' Epoch milliseconds at the start (or end) of a YYYY-MM-DD local date '''
+    start = datetime.strptime(text, "%Y-%m-%d").timestamp()
+    return int((start + (86400 if end else 0)) * 1000)
+
+class SearchIndex:
+    ''' Posting lists of sequence numbers per term, plus each message's timestamp
+
+    add() must be called in sequence order (chat_core does so under
+    its chat lock); searches run from any thread without locking.
+    '''
+
+    def __init__(self, chat_log):
+        self.chat_log = chat_log
+        self.path = os.path.join(chat_log.directory, INDEX_FILE)
+        self.lock = threading.Lock()  # Keeps saves consistent with adds
+        self.postings = {}            # Term -> array of sequence numbers, ascending
+        self.stamps = array("Q")      # Timestamp of message base + i
+        self.base = chat_log.first_seq
+        self.saved_seq = 0
+
+    @property
+    def last_seq(self):
+        return self.base + len(self.stamps) - 1
+
+    def add(self, seq, millis, room_name, sender_name, text):
+        ''' Index one message; sequence numbers must follow on from the last one '''
+        with self.lock:
+            if seq != self.last_seq + 1:
+                # Only the first message after an empty or lost index starts a new range
+                self.postings.clear()
+                self.stamps = array("Q")
+                self.base = seq
+            self.stamps.append(millis)
+            for term in terms_of(text) | {f"@{sender_name.lower()}", f"#{room_name}"}:
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = array("Q")
+                posting.append(seq)
+            if self.chat_log.first_seq > self.base:
+                self._prune(self.chat_log.first_seq)
+
+    def _prune(self, first_seq):
+        ''' Forget messages below first_seq, dropped from the log with its oldest segments '''
+        first_seq = min(first_seq, self.last_seq + 1)
+        self.stamps = self.stamps[first_seq - self.base:]
+        self.base = first_seq
+        for term, posting in list(self.postings.items()):
+            position = bisect_left(posting, first_seq)
+            if position == len(posting):
+                del self.postings[term]
+            elif position:
+                self.postings[term] = posting[position:]
+
+    # SEARCHING
+    def search(self, room_name, query, below=None, limit=PAGE_SIZE):
+        ''' Sequence numbers of the newest matches below a cursor; returns (hits, more)
+
+        Every word of the query must match. "from:name" matches the
+        sender, "after:YYYY-MM-DD" and "before:YYYY-MM-DD" the date.
+        '''
+        terms = {f"#{room_name}"}
+        low, high = max(self.base, self.chat_log.first_seq), self.last_seq
+        if below is not None:
+            high = min(high, below - 1)
+        for word in query.split():
+            key, _, value = word.partition(":")
+            if key == "from" and value:
+                terms.add(f"@{value.lower()}")
+            elif key in ("after", "before") and value:
+                try:
+                    millis = day_millis(value, end=key == "after")
+                except ValueError:
+                    continue
+                if key == "after":
+                    low = max(low, self.seq_at(millis))
+                else:
+                    high = min(high, self.seq_at(millis) - 1)
+            else:
+                terms |= terms_of(word)
+
+        lists = [self.postings.get(term) for term in terms]
+        if any(posting is None for posting in lists) or low > high:
+            return [], False
+        lists.sort(key=len)
+        rarest, others = lists[0], lists[1:]
+
+        hits = []
+        for position in range(bisect_right(rarest, high) - 1, bisect_left(rarest, low) - 1, -1):
+            seq = rarest[position]
+            if all(contains(posting, seq) for posting in others):
+                if len(hits) == limit:
+                    return hits, True
+                hits.append(seq)
+        return hits, False
+
+    def seq_at(self, millis):
+        ''' First sequence number stamped at or after millis '''
+        return self.base + bisect_left(self.stamps, millis)
+
+    # PERSISTENCE
+    def load(self):
+        ''' Read the saved index; returns False if there is none or it does not fit the log '''
+        try:
+            with open(self.path, "rb") as file:
+                if file.read(len(MAGIC)) != MAGIC:
+                    return False
+                base, last, term_count = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+                if last > self.chat_log.last_seq:
+                    return False  # The log lost messages the index knows about
+                stamps = read_array(file, last - base + 1)
+                postings = {}
+                for _ in range(term_count):
+                    length, count = TERM_HEADER.unpack(file.read(TERM_HEADER.size))
+                    term = file.read(length).decode("utf-8")
+                    postings[term] = read_array(file, count)
+        except (OSError, struct.error, ValueError, EOFError):
+            return False
+        self.base, self.stamps, self.postings = base, stamps, postings
+        self.saved_seq = last
+        return True
+
+    def save(self):
+        ''' Write the index atomically next to the log '''
+        with self.lock:
+            last = self.last_seq
+            if last == self.saved_seq:
+                return
+            stamps = array("Q", self.stamps)
+            postings = [(term, array("Q", posting)) for term, posting in self.postings.items()]
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(MAGIC)
+            file.write(FILE_HEADER.pack(self.base, last, len(postings)))
+            write_array(file, stamps)
+            for term, posting in postings:
+                encoded = term.encode("utf-8")
+                file.write(TERM_HEADER.pack(len(encoded), len(posting)))
+                file.write(encoded)
+                write_array(file, posting)
+        os.replace(temporary, self.path)
+        self.saved_seq = last
+
+    def catch_up(self):
+        ''' Index every logged message the saved index does not cover yet '''
+        if self.chat_log.first_seq > self.base:
+            with self.lock:
+                self._prune(self.chat_log.first_seq)
+        since = max(self.last_seq, self.chat_log.first_seq - 1)
+        _, chunks = self.chat_log.replay(since, limit=self.chat_log.last_seq)
+        for chunk in chunks:
+            for _, payload, _ in protocol.split_frames(chunk):
+                fields = protocol.decode_fields(payload)
+                if len(fields) >= 5 and fields[3].isdigit():
+                    self.add(int(fields[0]), int(fields[3]), fields[1], fields[2], protocol.FIELD_SEPARATOR.join(fields[4:]))
+
+    def start_saving(self):
+        ''' Save every SAVE_INTERVAL seconds on a background thread '''
+        def save_loop():
+            while True:
+                time.sleep(SAVE_INTERVAL)
+                self.save()
+        threading.Thread(target=save_loop, daemon=True).start()
+
+# UTILITY FUNCTIONS
+def contains(posting, seq):
+    ''' Whether a sorted posting list holds a sequence number '''
+    position = bisect_left(posting, seq)
+    return position < len(posting) and posting[position] == seq
+
+def read_array(file, count):
+    ''' Read count little-endian 64-bit numbers '''
+    values = array("Q")
+    values.frombytes(file.read(count * values.itemsize))
+    if len(values) != count:
+        raise EOFError("Index file is truncated")
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def write_array(file, values):
+    ''' Write numbers as little-endian 64-bit values '''
+    if sys.byteorder == "big":
+        values = array("Q", values)
+        values.byteswap()
+    file.write(values.tobytes())
+
+def open_index(chat_log):
+    ''' Load or rebuild the index of a message log and keep it saved '''
+    index = SearchIndex(chat_log)
+    index.load()
+    index.catch_up()
+    index.save()
+    index.start_saving()
+    return index
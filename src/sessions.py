@@ -0,0 +1,86 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: sessions.py keeps resumable client sessions. Every
+registered client is given a random token. When its connection
+drops, the session is held for a grace period instead of being
+ended, so a client that comes back with the token takes over its
+username and rooms without anyone seeing it leave and join again.
+'''
+
+# IMPORTS
+import secrets
+import threading
+
+RESUME_GRACE = 30.0   # Seconds a dropped session waits for its client
+TOKEN_BYTES = 16
+
+class Session:
+    ''' One client's identity, outliving any single connection '''
+    __slots__ = ("token", "username", "connection", "detached")
+
+    def __init__(self, token, username, connection):
+        self.token = token
+        self.username = username
+        self.connection = connection
+        self.detached = False  # True while waiting for the client to resume
+
+class SessionTable:
+    ''' Thread-safe index of sessions by token and by current connection '''
+
+    def __init__(self, grace=RESUME_GRACE):
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.by_token = {}
+        self.by_connection = {}
+
+    def open(self, connection, username):
+        ''' Start a session for a newly registered client '''
+        session = Session(secrets.token_urlsafe(TOKEN_BYTES), username, connection)
+        with self.lock:
+            self.by_token[session.token] = session
+            self.by_connection[connection] = session
+        return session
+
+    def detach(self, connection):
+        ''' Hold the session of a dropped connection; returns it, or None if ended '''
+        with self.lock:
+            session = self.by_connection.get(connection)
+            if session is None:
+                return None
+            if self.grace <= 0:
+                self._remove(session)
+                return None
+            session.detached = True
+            return session
+
+    def claim(self, token, username, connection):
+        ''' Move a session to a new connection; returns the old one, or None '''
+        with self.lock:
+            session = self.by_token.get(token)
+            if session is None or session.username != username:
+                return None
+            old = session.connection
+            del self.by_connection[old]
+            self.by_connection[connection] = session
+            session.connection = connection
+            session.detached = False
+            return old
+
+    def expire(self, session, connection):
+        ''' End a held session unless its client came back; returns True if ended '''
+        with self.lock:
+            if session.connection is not connection or not session.detached:
+                return False
+            self._remove(session)
+            return True
+
+    def owner(self, token):
+        ''' Username of the session a token belongs to, or None '''
+        session = self.by_token.get(token)
+        return session.username if session is not None else None
+
+    def _remove(self, session):
+        # Caller holds the lock
+        self.by_token.pop(session.token, None)
+        self.by_connection.pop(session.connection, None)
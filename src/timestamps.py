@@ -0,0 +1,44 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: timestamps.py handles message times. The server
+stamps every chat message with integer epoch milliseconds that
+never go backwards, and clients display that time instead of
+their own clock. Displayed times only change once a minute, so
+the formatted text is cached and strftime runs at most once per
+minute rather than once per message.
+'''
+
+# IMPORTS
+import time
+from datetime import datetime
+
+DISPLAY_FORMAT = '%b %d, %Y - %I:%M %p'
+
+def now_millis():
+    ''' Current wall clock time in integer epoch milliseconds '''
+    return time.time_ns() // 1_000_000
+
+class TimestampFormatter:
+    ''' Formats epoch milliseconds, reusing the text within one resolution step '''
+    __slots__ = ("pattern", "step", "cached")
+
+    def __init__(self, pattern=DISPLAY_FORMAT, resolution=60):
+        self.pattern = pattern
+        self.step = resolution * 1000  # Milliseconds sharing one formatted text
+        self.cached = (None, "")       # (step number, text), replaced as a whole
+
+    def format(self, millis=None):
+        ''' Display text for a time in epoch milliseconds, now by default '''
+        slot = (now_millis() if millis is None else millis) // self.step
+        cached = self.cached
+        if cached[0] != slot:
+            cached = self.cached = (slot, datetime.fromtimestamp(slot * self.step / 1000).strftime(self.pattern))
+        return cached[1]
+
+# Shared by everything that shows times in the display format
+display_formatter = TimestampFormatter()
+
+def format_timestamp(millis=None):
+    ''' Display text for a time in epoch milliseconds, now by default '''
+    return display_formatter.format(millis)
@@ -0,0 +1,175 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: tls.py adds optional TLS to chat and file connections.
+A full handshake costs the server an asymmetric key operation, so
+the server issues session tickets and clients keep theirs: a client
+that reconnects resumes its session with a cheaper abbreviated
+handshake, which matters most when a server restart makes every
+client reconnect at once.
+
+Handshakes never run on the accept loop. The threaded engine does
+them on each connection's own thread, and asyncio does them in the
+event loop without blocking it, so a slow or stalled client only
+delays itself. The ticket key belongs to the server's context,
+which is created before any workers are forked, so a ticket issued
+by one worker is accepted by the others.
+
+An SSLSocket keeps one TLS state for both directions, so it must
+never be read on one thread while another writes to it. Chat
+connections used by two threads (the threaded server's reader and
+writer, the client's receiver and outbox) go through a SharedSocket,
+which makes every call under a lock on a non-blocking socket and
+waits for the network outside the lock.
+'''
+
+# IMPORTS
+import errno
+import select
+import ssl
+import threading
+import time
+import metrics
+
+HANDSHAKE_TIMEOUT = 10.0  # Seconds a client has to finish its handshake
+TICKETS = 2               # Session tickets issued per full handshake
+WAIT_INTERVAL = 0.5       # Longest wait before a shared socket tries again
+
+# Server context set by configure(); None while TLS is off
+context = None
+
+def server_context(certfile, keyfile=None):
+    ''' Context for accepting TLS connections with a certificate and private key '''
+    server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server.minimum_version = ssl.TLSVersion.TLSv1_2
+    server.load_cert_chain(certfile, keyfile)
+    server.num_tickets = TICKETS
+    return server
+
+def configure(certfile=None, keyfile=None):
+    ''' Serve TLS with the given certificate, or plaintext without one '''
+    global context
+    context = server_context(certfile, keyfile) if certfile else None
+
+def accept(sock):
+    ''' Finish the server side of the handshake on an accepted socket; returns the TLS socket
+
+    Blocks until the handshake is done or times out, so call it from
+    the connection's own thread.
+    '''
+    started = time.perf_counter()
+    sock.settimeout(HANDSHAKE_TIMEOUT)
+    try:
+        tls_sock = context.wrap_socket(sock, server_side=True)
+    except (OSError, ValueError):
+        metrics.tls_handshakes_failed.inc()
+        raise
+    tls_sock.settimeout(None)
+    handshake_done(tls_sock, started)
+    return tls_sock
+
+def handshake_done(ssl_object, started=None):
+    ''' Record a finished server handshake '''
+    if started is not None:
+        metrics.tls_handshake_seconds.observe(time.perf_counter() - started)
+    if ssl_object.session_reused:
+        metrics.tls_sessions_resumed.inc()
+
+class ClientTLS:
+    ''' Client side settings and the session kept for resuming '''
+
+    def __init__(self, cafile=None, verify=True):
+        self.context = ssl.create_default_context(cafile=cafile)
+        if not verify:
+            # Self-signed test servers only: the connection is encrypted but not authenticated
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.session = None
+
+    def wrap(self, sock, host):
+        ''' Run the client handshake, resuming the kept session when the server still accepts it '''
+        sock.settimeout(HANDSHAKE_TIMEOUT)
+        tls_sock = self.context.wrap_socket(sock, server_hostname=host, session=self.session)
+        tls_sock.settimeout(None)
+        return tls_sock
+
+    def remember(self, tls_sock):
+        ''' Keep a connection's session for the next connection
+
+        TLS 1.3 tickets arrive after the handshake, so call this once
+        something has been received.
+        '''
+        session = tls_sock.session
+        if session is not None and session.has_ticket:
+            self.session = session
+
+class SharedSocket:
+    ''' TLS socket read by one thread and written by another
+
+    Reads and writes never hold the lock while waiting: the socket
+    is non-blocking, and a call that would block waits for the
+    socket outside the lock, at most WAIT_INTERVAL seconds, since
+    the other thread may have consumed what it was waiting for.
+    '''
+
+    def __init__(self, tls_sock):
+        self.sock = tls_sock
+        self.lock = threading.Lock()
+        tls_sock.setblocking(False)
+
+    @property
+    def session(self):
+        with self.lock:
+            return self.sock.session
+
+    def recv_into(self, buffer):
+        ''' Receive into buffer; returns 0 once the peer closed '''
+        while True:
+            with self.lock:
+                try:
+                    return self.sock.recv_into(buffer)
+                except (ssl.SSLWantReadError, BlockingIOError):
+                    writing = False
+                except ssl.SSLWantWriteError:
+                    writing = True
+            self._wait(writing)
+
+    def sendall(self, data):
+        ''' Send all of data, letting reads in between its writes '''
+        with memoryview(data) as view:
+            while view:
+                with self.lock:
+                    try:
+                        sent = self.sock.send(view)
+                    except (ssl.SSLWantWriteError, BlockingIOError):
+                        writing = True
+                    except ssl.SSLWantReadError:
+                        writing = False
+                    else:
+                        view = view[sent:]
+                        continue
+                self._wait(writing)
+
+    def getsockname(self):
+        return self.sock.getsockname()
+
+    def shutdown(self, how):
+        with self.lock:
+            self.sock.shutdown(how)
+
+    def close(self):
+        with self.lock:
+            self.sock.close()
+
+    def _wait(self, writing):
+        fd = self.sock.fileno()
+        if fd < 0:
+            raise OSError(errno.EBADF, "Socket is closed")
+        if hasattr(select, "poll"):
+            poller = select.poll()  # Unlike select(), not limited to the first 1024 descriptors
+            poller.register(fd, select.POLLOUT if writing else select.POLLIN)
+            poller.poll(WAIT_INTERVAL * 1000)
+        elif writing:
+            select.select([], [fd], [], WAIT_INTERVAL)
+        else:
+            select.select([fd], [], [], WAIT_INTERVAL)
@@ -0,0 +1,13 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: Unit tests for the server and protocol modules. The
+modules in src/ import each other by their plain names, as they do
+when run from there, so src/ is put on the import path first.
+'''
+
+# IMPORTS
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,92 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_fanout.py tests the bounded send queues of client
+connections and what their overflow policies discard.
+'''
+
+# IMPORTS
+import unittest
+import fanout
+import metrics
+import protocol
+import retransmit
+
+class Transport:
+    ''' Stand-in for an asyncio transport that keeps what is written '''
+
+    def __init__(self):
+        self.written = []
+        self.closing = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def writelines(self, frames):
+        self.written.extend(frames)
+
+    def is_closing(self):
+        return self.closing
+
+    def abort(self):
+        self.closing = True
+
+    close = abort
+
+def direct_frame(text):
+    return protocol.encode_text(protocol.DIRECT, "alice", "1000", text)
+
+class SendQueueTests(unittest.TestCase):
+    def paused(self, policy=fanout.DROP_OLDEST, window=None):
+        ''' Connection whose transport pushed back, so frames wait in its queue of 4 '''
+        connection = fanout.AsyncConnection(Transport(), policy=policy, queue_size=4, window=window)
+        connection.pause_writing()
+        return connection
+
+    def test_drop_oldest(self):
+        connection = self.paused()
+        frames = [protocol.system_frame(str(index)) for index in range(6)]
+        for frame in frames:
+            self.assertTrue(connection.send(frame))
+        self.assertEqual(list(connection.queue), frames[2:])
+        self.assertEqual(connection.dropped, 2)
+
+    def test_new_frame_dropped_with_a_window(self):
+        connection = self.paused(window=retransmit.RetransmitWindow(16))
+        frames = [protocol.system_frame(str(index)) for index in range(5)]
+        self.assertEqual([connection.send(frame) for frame in frames], [True] * 4 + [False])
+        self.assertEqual(list(connection.queue), frames[:4])
+
+    def test_direct_messages_are_never_dropped(self):
+        for window in (None, retransmit.RetransmitWindow(16)):
+            connection = self.paused(window=window)
+            first = direct_frame("first")
+            connection.send(first, reliable=True)
+            for index in range(3):
+                connection.send(protocol.system_frame(str(index)))
+            self.assertTrue(connection.send(direct_frame("second"), reliable=True))
+            connection.send(protocol.system_frame("extra"))
+            self.assertIn(first, connection.queue)
+            self.assertIn(direct_frame("second"), connection.queue)
+            connection.resume_writing()
+            self.assertEqual(connection.transport.written[0], first)
+
+    def test_disconnect_policy_refuses_even_direct_messages(self):
+        connection = self.paused(policy=fanout.DISCONNECT)
+        for index in range(4):
+            connection.send(protocol.system_frame(str(index)))
+        self.assertFalse(connection.send(direct_frame("late"), reliable=True))
+        self.assertTrue(connection.closed)
+        self.assertTrue(connection.transport.closing)
+        self.assertFalse(connection.send(direct_frame("after"), reliable=True))
+
+    def test_full_window_disconnects_once(self):
+        connection = self.paused(policy=fanout.DISCONNECT, window=retransmit.RetransmitWindow(4))
+        before = metrics.slow_disconnects.value
+        for seq in range(1, 11):
+            connection.send_numbered(seq, protocol.chat_frame(seq, "general", "alice", 1000, "hi"))
+        self.assertTrue(connection.closed)
+        self.assertEqual(metrics.slow_disconnects.value - before, 1)
+
+if __name__ == "__main__":
+    unittest.main()
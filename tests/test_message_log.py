@@ -0,0 +1,113 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_message_log.py tests appending to, replaying
+and recovering the segmented chat message log.
+'''
+
+# IMPORTS
+import os
+import shutil
+import tempfile
+import unittest
+import message_log
+import protocol
+
+def chat(seq, text="hello"):
+    return protocol.chat_frame(seq, "general", "alice", 1000 + seq, text)
+
+def replayed(log, since):
+    ''' Sequence numbers of the frames a replay after since returns '''
+    _, chunks = log.replay(since)
+    return [int(protocol.decode_fields(payload)[0]) for chunk in chunks for _, payload, _ in protocol.split_frames(chunk)]
+
+class MessageLogTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_log(self, **options):
+        log = message_log.MessageLog(self.directory, **options)
+        self.addCleanup(log.close)
+        return log
+
+    def test_append_replay_and_read(self):
+        log = self.open_log()
+        for seq in range(1, 11):
+            log.append(seq, chat(seq))
+        self.assertEqual(replayed(log, 4), list(range(5, 11)))
+        self.assertEqual(log.read(3), chat(3))
+        self.assertIsNone(log.read(11))
+
+    def test_sequence_numbers_must_follow_on(self):
+        log = self.open_log()
+        log.append(1, chat(1))
+        with self.assertRaises(ValueError):
+            log.append(3, chat(3))
+
+    def test_segments_rotate_and_old_ones_go(self):
+        frame_size = len(chat(1))
+        log = self.open_log(segment_bytes=frame_size * 4, max_segments=3)
+        for seq in range(1, 21):
+            log.append(seq, chat(seq))
+        self.assertEqual(len(log.segments), 3)
+        self.assertEqual(log.first_seq, 9)
+        self.assertEqual(replayed(log, 0), list(range(9, 21)))
+        self.assertIsNone(log.read(8))
+
+    def test_reopened_log_continues_numbering(self):
+        log = self.open_log(segment_bytes=200)
+        for seq in range(1, 21):
+            log.append(seq, chat(seq))
+        log.close()
+        reopened = self.open_log(segment_bytes=200)
+        self.assertEqual(reopened.last_seq, 20)
+        reopened.append(21, chat(21))
+        self.assertEqual(replayed(reopened, 15), list(range(16, 22)))
+
+    def test_recovery_cuts_off_a_torn_frame(self):
+        log = self.open_log()
+        for seq in range(1, 6):
+            log.append(seq, chat(seq))
+        log.close()
+        segment = log.segments[-1]
+        os.truncate(segment.log_path, segment.size - 3)  # Crash in the middle of frame 5
+
+        reopened = self.open_log()
+        self.assertEqual(reopened.last_seq, 4)
+        self.assertEqual(os.path.getsize(segment.log_path), segment.size - len(chat(5)))
+        reopened.append(5, chat(5, "again"))
+        self.assertEqual(replayed(reopened, 0), [1, 2, 3, 4, 5])
+        self.assertEqual(reopened.read(5), chat(5, "again"))
+
+    def test_recovery_drops_a_torn_index_entry(self):
+        log = self.open_log()
+        for seq in range(1, 4):
+            log.append(seq, chat(seq))
+        log.close()
+        segment = log.segments[-1]
+        with open(segment.index_path, "ab") as index:
+            index.write(b"\x00\x00\x00")  # Half an entry
+        self.assertEqual(self.open_log().last_seq, 3)
+
+    def test_failed_write_is_rolled_back(self):
+        log = self.open_log()
+        log.append(1, chat(1))
+        real_file = log._log_file
+
+        class FullDisk:
+            def write(self, data):
+                return real_file.write(bytes(data)[:5])  # Short write, as on a full disk
+            def truncate(self, size):
+                return real_file.truncate(size)
+
+        log._log_file = FullDisk()
+        with self.assertRaises(OSError):
+            log.append(2, chat(2))
+        log._log_file = real_file
+        log.append(2, chat(2, "retried"))
+        self.assertEqual(log.read(2), chat(2, "retried"))
+        self.assertEqual(replayed(log, 0), [1, 2])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_presence.py tests the versioned room rosters:
+snapshots, join/leave deltas and catching up resumed clients.
+'''
+
+# IMPORTS
+import unittest
+import presence
+import protocol
+
+class Connection:
+    ''' Stand-in for a client connection that keeps what it is sent '''
+
+    def __init__(self):
+        self.codec = None
+        self.frames = []
+
+    def send(self, frame):
+        self.frames.append(frame)
+
+    def received(self):
+        ''' (type, fields) of every frame sent so far, then forgets them '''
+        frames, self.frames = self.frames, []
+        return [(protocol.HEADER.unpack_from(frame)[1], protocol.decode_fields(frame[protocol.HEADER_SIZE:])) for frame in frames]
+
+class PresenceTests(unittest.TestCase):
+    def setUp(self):
+        self.published = []  # (frame, sender) broadcast to the room
+        self.roster = presence.Presence("general", lambda frame, sender: self.published.append((frame, sender)))
+
+    def deltas(self):
+        frames, self.published = self.published, []
+        return [protocol.decode_fields(frame[protocol.HEADER_SIZE:]) for frame, _ in frames]
+
+    def test_join_sends_a_snapshot_and_publishes_a_delta(self):
+        alice, bob = Connection(), Connection()
+        self.roster.join(alice, "alice")
+        self.roster.join(bob, "bob")
+        self.assertEqual(bob.received(), [(protocol.PRESENCE, ["2", "general", "alice", "bob"])])
+        self.assertEqual(self.deltas(), [["1", "general", "alice"], ["2", "general", "bob"]])
+
+    def test_versions_count_every_change(self):
+        self.roster.join(Connection(), "alice")
+        self.roster.join(Connection(), "bob")
+        self.roster.leave("alice")
+        self.roster.leave("alice")  # Not in the room: no new version
+        self.assertEqual(self.roster.version, 3)
+        self.assertEqual(self.deltas()[-1], ["3", "general", "alice"])
+
+    def test_catch_up_sends_only_missed_deltas(self):
+        self.roster.join(Connection(), "alice")
+        self.roster.join(Connection(), "bob")
+        self.roster.leave("bob")
+        client = Connection()
+        self.roster.catch_up(client, 1)
+        self.assertEqual(client.received(), [(protocol.JOIN, ["2", "general", "bob"]), (protocol.LEAVE, ["3", "general", "bob"])])
+        self.roster.catch_up(client, 3)
+        self.assertEqual(client.received(), [])
+
+    def test_catch_up_past_the_history_sends_a_snapshot(self):
+        for index in range(presence.HISTORY_SIZE + 5):
+            self.roster.join(None, f"user{index}")
+        client = Connection()
+        self.roster.catch_up(client, 1)
+        (msg_type, fields), = client.received()
+        self.assertEqual((msg_type, fields[0]), (protocol.PRESENCE, str(self.roster.version)))
+        self.assertEqual(len(fields), presence.HISTORY_SIZE + 5 + 2)
+
+    def test_snapshot_is_shared_until_the_roster_changes(self):
+        alice = Connection()
+        self.roster.join(alice, "alice")
+        self.roster.resync(alice)
+        self.roster.resync(alice)
+        self.assertIs(alice.frames[1], alice.frames[2])
+        self.roster.join(None, "bob")
+        self.roster.resync(alice)
+        self.assertIsNot(alice.frames[3], alice.frames[2])
+
+if __name__ == "__main__":
+    unittest.main()
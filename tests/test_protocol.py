@@ -0,0 +1,116 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_protocol.py tests frame encoding and the
+incremental frame decoder.
+'''
+
+# IMPORTS
+import struct
+import unittest
+import zlib
+import protocol
+
+def decode_all(decoder):
+    ''' Every complete frame buffered in a decoder, with payloads copied out '''
+    return [(msg_type, bytes(payload)) for msg_type, _, payload in decoder.frames()]
+
+class EncodingTests(unittest.TestCase):
+    def test_fields_round_trip(self):
+        frame = protocol.encode_text(protocol.JOIN, "3", "general", "alice")
+        length, msg_type, flags = protocol.HEADER.unpack_from(frame)
+        self.assertEqual((length, msg_type, flags), (len(frame) - protocol.HEADER_SIZE, protocol.JOIN, 0))
+        self.assertEqual(protocol.decode_fields(frame[protocol.HEADER_SIZE:]), ["3", "general", "alice"])
+
+    def test_empty_payload_has_no_fields(self):
+        self.assertEqual(protocol.decode_fields(b""), [])
+
+    def test_unicode_text(self):
+        frame = protocol.encode_text(protocol.SYSTEM, "héllo ✓")
+        self.assertEqual(protocol.decode_text(frame[protocol.HEADER_SIZE:]), "héllo ✓")
+
+    def test_maxsplit_keeps_separators_in_last_field(self):
+        payload = "1\x1fgeneral\x1falice\x1f1000\x1fa\x1fb".encode("utf-8")
+        self.assertEqual(protocol.decode_fields(payload, 4), ["1", "general", "alice", "1000", "a\x1fb"])
+
+    def test_clean_text_replaces_separators(self):
+        self.assertEqual(protocol.clean_text("a\x1fb\x1fc"), "a b c")
+        self.assertEqual(protocol.clean_text("plain"), "plain")
+
+    def test_chat_frame_keeps_five_fields(self):
+        frame = protocol.chat_frame(7, "general", "alice", 1000, protocol.clean_text("x\x1fy"))
+        self.assertEqual(protocol.decode_fields(frame[protocol.HEADER_SIZE:]), ["7", "general", "alice", "1000", "x y"])
+
+    def test_oversize_payload_is_refused(self):
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.encode_frame(protocol.SYSTEM, bytes(protocol.MAX_FRAME_SIZE + 1))
+
+class FrameDecoderTests(unittest.TestCase):
+    def test_frame_split_across_reads(self):
+        frame = protocol.encode_text(protocol.CHAT, "general", "hello there")
+        decoder = protocol.FrameDecoder()
+        for index in range(len(frame) - 1):
+            decoder.feed(frame[index:index + 1])
+            self.assertEqual(decode_all(decoder), [])
+        decoder.feed(frame[-1:])
+        self.assertEqual(decode_all(decoder), [(protocol.CHAT, b"general\x1fhello there")])
+
+    def test_several_frames_in_one_read(self):
+        frames = [protocol.system_frame(f"message {index}") for index in range(5)]
+        decoder = protocol.FrameDecoder()
+        decoder.feed(b"".join(frames) + frames[0][:3])
+        self.assertEqual([payload for _, payload in decode_all(decoder)], [f"message {index}".encode() for index in range(5)])
+        decoder.feed(frames[0][3:])
+        self.assertEqual(decode_all(decoder), [(protocol.SYSTEM, b"message 0")])
+
+    def test_large_frame_grows_the_buffer(self):
+        frame = protocol.encode_frame(protocol.SYSTEM, bytes(200_000))
+        decoder = protocol.FrameDecoder()
+        for start in range(0, len(frame), 7000):
+            decoder.feed(frame[start:start + 7000])
+        self.assertEqual(decode_all(decoder), [(protocol.SYSTEM, bytes(200_000))])
+
+    def test_empty_payload(self):
+        decoder = protocol.FrameDecoder()
+        decoder.feed(protocol.encode_frame(protocol.PONG))
+        self.assertEqual(decode_all(decoder), [(protocol.PONG, b"")])
+
+    def test_oversize_frame_is_refused_from_its_header(self):
+        decoder = protocol.FrameDecoder(max_size=1024)
+        decoder.feed(struct.pack("!IBB", 1025, protocol.CHAT, 0))
+        with self.assertRaises(protocol.ProtocolError):
+            decode_all(decoder)
+
+class CompressionTests(unittest.TestCase):
+    def test_round_trip(self):
+        frame = protocol.system_frame("the chat is busy " * 40)
+        for codec in protocol.CODECS:
+            compressed = protocol.compress_frame(frame, codec)
+            self.assertLess(len(compressed), len(frame))
+            self.assertEqual(protocol.decompress_frame(compressed), frame)
+
+    def test_small_frames_stay_uncompressed(self):
+        frame = protocol.system_frame("hi")
+        self.assertIs(protocol.compress_frame(frame, "zlib"), frame)
+
+    def test_compressed_frames_are_inflated(self):
+        frame = protocol.compress_frame(protocol.system_frame("you know what " * 50), "zdict")
+        decoder = protocol.FrameDecoder()
+        decoder.feed(frame)
+        self.assertEqual(decode_all(decoder), [(protocol.SYSTEM, ("you know what " * 50).encode())])
+
+    def test_corrupt_compressed_payload(self):
+        decoder = protocol.FrameDecoder()
+        decoder.feed(protocol.encode_frame(protocol.SYSTEM, b"not zlib data", protocol.ZLIB))
+        with self.assertRaises(protocol.ProtocolError):
+            decode_all(decoder)
+
+    def test_compression_bomb_is_refused(self):
+        bomb = protocol.encode_frame(protocol.SYSTEM, zlib.compress(bytes(4096)), protocol.ZLIB)
+        decoder = protocol.FrameDecoder(max_size=1024)
+        decoder.feed(bomb)
+        with self.assertRaises(protocol.ProtocolError):
+            decode_all(decoder)
+
+if __name__ == "__main__":
+    unittest.main()
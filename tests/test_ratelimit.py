@@ -0,0 +1,61 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_ratelimit.py tests the token buckets that limit
+each client's frames and bytes and the shared fan-out budget.
+'''
+
+# IMPORTS
+import unittest
+from unittest import mock
+import ratelimit
+
+class ClockTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit.time, "monotonic", return_value=100.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+class TokenBucketTests(ClockTests):
+    def test_burst_then_refill(self):
+        bucket = ratelimit.TokenBucket(10)
+        self.assertEqual(bucket.take(20), 0.0)
+        self.assertEqual(bucket.take(5), 0.5)
+        self.clock.return_value = 100.5
+        self.assertEqual(bucket.take(5), 0.0)
+
+    def test_borrowing_goes_into_debt(self):
+        bucket = ratelimit.TokenBucket(10)
+        self.assertEqual(bucket.take(30, borrow=True), 0.0)  # Capped at the 20 token burst
+        self.assertEqual(bucket.take(10, borrow=True), 1.0)
+
+    def test_charge_larger_than_the_burst_is_admitted_once_full(self):
+        bucket = ratelimit.TokenBucket(10)
+        self.assertEqual(bucket.take(1000), 0.0)
+        self.assertEqual(bucket.take(1000), 2.0)
+        self.clock.return_value = 102.0
+        self.assertEqual(bucket.take(1000), 0.0)
+
+class RateLimiterTests(ClockTests):
+    def limiter(self, limit_action):
+        with mock.patch.multiple(ratelimit, message_rate=50.0, byte_rate=1000.0, action=limit_action):
+            return ratelimit.RateLimiter()
+
+    def test_frame_larger_than_the_byte_burst_is_not_always_dropped(self):
+        limiter = self.limiter(ratelimit.DROP)
+        self.assertEqual(limiter.admit(10_000), 0.0)
+        self.assertIsNone(limiter.admit(10_000))
+
+    def test_delay_pauses_for_the_debt(self):
+        limiter = self.limiter(ratelimit.DELAY)
+        self.assertEqual(limiter.admit(2000), 0.0)
+        self.assertEqual(limiter.admit(500), 0.5)
+
+    def test_disconnect_raises(self):
+        limiter = self.limiter(ratelimit.DISCONNECT)
+        limiter.admit(2000)
+        with self.assertRaises(ratelimit.RateLimited):
+            limiter.admit(2000)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_registry.py tests the sharded client registry:
+unique usernames, handing a username to a resumed connection and
+the snapshots broadcasts iterate over.
+'''
+
+# IMPORTS
+import unittest
+import registry
+
+class RegistryTests(unittest.TestCase):
+    def test_usernames_are_unique(self):
+        clients = registry.ClientRegistry()
+        alice, impostor = object(), object()
+        self.assertTrue(clients.add(alice, "alice"))
+        self.assertFalse(clients.add(impostor, "alice"))
+        self.assertIs(clients.lookup("alice"), alice)
+        self.assertNotIn(impostor, clients)
+
+    def test_remove_frees_the_username(self):
+        clients = registry.ClientRegistry()
+        alice = object()
+        clients.add(alice, "alice")
+        self.assertEqual(clients.remove(alice), "alice")
+        self.assertIsNone(clients.remove(alice))
+        self.assertIsNone(clients.lookup("alice"))
+        self.assertEqual(len(clients), 0)
+
+    def test_replace_hands_the_username_over(self):
+        clients = registry.ClientRegistry()
+        old, new = object(), object()
+        clients.add(old, "alice")
+        self.assertEqual(clients.replace(old, new), "alice")
+        self.assertIs(clients.lookup("alice"), new)
+        self.assertEqual(list(clients), [new])
+        self.assertIsNone(clients.remove(old))  # A late cleanup of the old connection changes nothing
+
+    def test_snapshot_is_unaffected_by_later_changes(self):
+        clients = registry.ClientRegistry(shards=4)
+        connections = [object() for _ in range(10)]
+        for index, connection in enumerate(connections):
+            clients.add(connection, f"user{index}")
+        snapshot = clients.snapshot()
+        for connection in connections[:5]:
+            clients.remove(connection)
+        self.assertEqual(sorted(name for _, name in snapshot), sorted(f"user{index}" for index in range(10)))
+        self.assertEqual(len(clients), 5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_retransmit.py tests the per-connection window of
+unacknowledged chat frames and resending it to a resumed session.
+'''
+
+# IMPORTS
+import unittest
+import chat_core
+import fanout
+import protocol
+import retransmit
+from .test_fanout import Transport
+
+def frame(seq):
+    return protocol.chat_frame(seq, "general", "alice", 1000 + seq, "hello " * 60)
+
+def sequences(frames):
+    return [int(protocol.decode_fields(protocol.decompress_frame(frame)[protocol.HEADER_SIZE:])[0]) for frame in frames]
+
+class RetransmitWindowTests(unittest.TestCase):
+    def test_frames_are_taken_in_order(self):
+        window = retransmit.RetransmitWindow(limit=64)
+        for seq in range(1, 6):
+            self.assertTrue(window.push(seq, frame(seq)))
+        self.assertEqual(window.unsent, 5)
+        self.assertEqual(sequences(window.take(3)), [1, 2, 3])
+        self.assertEqual(sequences(window.take(10)), [4, 5])
+        self.assertEqual(window.take(10), [])
+
+    def test_cumulative_ack_releases_frames(self):
+        window = retransmit.RetransmitWindow(limit=64)
+        for seq in range(1, 11):
+            window.push(seq, frame(seq))
+        window.take(10)
+        window.ack(6)
+        self.assertEqual(window.count, 4)
+        self.assertEqual([seq for seq, _ in window.since(0)], [7, 8, 9, 10])
+        window.ack(3)  # An older ack arriving late changes nothing
+        self.assertEqual(window.count, 4)
+
+    def test_unsent_frames_are_never_released(self):
+        window = retransmit.RetransmitWindow(limit=64)
+        for seq in range(1, 5):
+            window.push(seq, frame(seq))
+        window.ack(4)
+        self.assertEqual(sequences(window.take(10)), [1, 2, 3, 4])
+
+    def test_clients_that_never_ack_release_queued_frames(self):
+        window = retransmit.RetransmitWindow(limit=64)
+        window.push(1, frame(1))
+        window.push(2, frame(2))
+        window.take(1)
+        window.push(3, frame(3))
+        self.assertEqual([seq for seq, _ in window.since(0)], [2, 3])
+
+    def test_since_skips_older_frames(self):
+        window = retransmit.RetransmitWindow(limit=64)
+        for seq in range(1, 9):
+            window.push(seq, frame(seq))
+        self.assertEqual([seq for seq, _ in window.since(5)], [6, 7, 8])
+        self.assertEqual(window.since(8), [])
+
+    def test_ring_wraps_around_and_grows_in_order(self):
+        window = retransmit.RetransmitWindow(limit=64)
+        for seq in range(1, 13):
+            window.push(seq, frame(seq))
+        window.take(12)
+        window.ack(10)
+        for seq in range(13, 25):  # Wraps past the end of the 16 slots
+            window.push(seq, frame(seq))
+        self.assertEqual(window.start, 10)
+        for seq in range(25, 35):  # Grows while wrapped
+            window.push(seq, frame(seq))
+        self.assertEqual(len(window.frames), 32)
+        self.assertEqual([seq for seq, _ in window.since(0)], list(range(11, 35)))
+        self.assertEqual(sequences(window.take(100)), list(range(13, 35)))
+
+    def test_full_window(self):
+        window = retransmit.RetransmitWindow(limit=16)
+        for seq in range(1, 17):
+            self.assertTrue(window.push(seq, frame(seq)))
+        self.assertFalse(window.push(17, frame(17)))
+        window.drop_oldest()
+        self.assertTrue(window.push(17, frame(17)))
+        self.assertEqual(sequences(window.take(100)), list(range(2, 18)))
+
+class ResendTests(unittest.TestCase):
+    def connection(self, codec=None, window_limit=64):
+        connection = fanout.AsyncConnection(Transport(), queue_size=8, window=retransmit.RetransmitWindow(window_limit))
+        connection.codec = codec
+        return connection
+
+    def test_window_holds_frames_while_paused(self):
+        connection = self.connection()
+        connection.pause_writing()
+        for seq in range(1, 21):
+            connection.send_numbered(seq, frame(seq))
+        self.assertEqual(connection.transport.written, [])
+        connection.resume_writing()
+        self.assertEqual(sequences(connection.transport.written), list(range(1, 21)))
+
+    def test_closed_connection_keeps_holding_frames(self):
+        old = self.connection()
+        old.send_numbered(1, frame(1))
+        old.acknowledge(1)
+        old.closed = True  # Dropped; its session is held for a resume
+        old.send_numbered(2, frame(2))
+        old.send_numbered(3, frame(3))
+        self.assertEqual([seq for seq, _ in old.unacknowledged(1)], [2, 3])
+
+    def test_resend_unacknowledged(self):
+        old = self.connection()
+        old.acknowledge(0)  # A client that acks has its frames held until it does
+        for seq in range(1, 11):
+            old.send_numbered(seq, frame(seq))
+        old.acknowledge(4)
+        new = self.connection()
+        chat_core.resend_unacknowledged(old, new, 6)
+        self.assertEqual(sequences(new.transport.written), [7, 8, 9, 10])
+        self.assertEqual([seq for seq, _ in new.unacknowledged(0)], [7, 8, 9, 10])
+
+    def test_resent_frames_use_the_new_codec(self):
+        old = self.connection(codec="zlib")
+        old.send_numbered(1, protocol.compress_frame(frame(1), "zlib"))
+        new = self.connection(codec="zdict")
+        chat_core.resend_unacknowledged(old, new, 0)
+        written, = new.transport.written
+        self.assertEqual(written, protocol.compress_frame(frame(1), "zdict"))
+
+    def test_nothing_is_resent_without_windows(self):
+        old, new = self.connection(), self.connection()
+        old.send_numbered(1, frame(1))
+        new.window = None
+        chat_core.resend_unacknowledged(old, new, 0)
+        self.assertEqual(new.transport.written, [])
+
+    def test_last_seen_must_be_a_plain_number(self):
+        self.assertEqual(chat_core.parse_last_seen(["alice", "42"]), 42)
+        for text in ("", "-1", "4.2", "\u00b2", "\u0664\u0662"):
+            self.assertIsNone(chat_core.parse_last_seen(["alice", text]))
+        self.assertIsNone(chat_core.parse_last_seen(["alice"]))
+
+if __name__ == "__main__":
+    unittest.main()
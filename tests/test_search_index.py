@@ -0,0 +1,120 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_search_index.py tests searching the chat
+history: paging, sender, room and date filters, saving the index
+and the hits the server sends back.
+'''
+
+# IMPORTS
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import chat_core
+import message_log
+import protocol
+import search_index
+
+DAY = 86_400_000
+
+class SearchIndexTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.log = message_log.MessageLog(directory)
+        self.addCleanup(self.log.close)
+        self.index = search_index.SearchIndex(self.log)
+        self.start = search_index.day_millis("2024-03-01")
+
+    def add(self, room_name, sender_name, text, day=0):
+        ''' Log and index a message sent day days after the first '''
+        seq = self.log.last_seq + 1
+        millis = self.start + day * DAY + seq
+        self.log.append(seq, protocol.chat_frame(seq, room_name, sender_name, millis, text))
+        self.index.add(seq, millis, room_name, sender_name, text)
+        return seq
+
+    def test_newest_first_in_pages(self):
+        seqs = [self.add("general", "alice", f"cats number {index}") for index in range(45)]
+        hits, more = self.index.search("general", "cats")
+        self.assertEqual(hits, seqs[::-1][:20])
+        self.assertTrue(more)
+        hits, more = self.index.search("general", "cats", below=hits[-1])
+        self.assertEqual(hits, seqs[::-1][20:40])
+        hits, more = self.index.search("general", "cats", below=hits[-1])
+        self.assertEqual((hits, more), (seqs[::-1][40:], False))
+
+    def test_every_word_must_match(self):
+        self.add("general", "alice", "cats and dogs")
+        only_cats = self.add("general", "alice", "Cats alone")
+        self.assertEqual(self.index.search("general", "CATS alone")[0], [only_cats])
+        self.assertEqual(self.index.search("general", "birds")[0], [])
+
+    def test_rooms_are_separate(self):
+        self.add("general", "alice", "cats")
+        other = self.add("pets", "alice", "cats")
+        self.assertEqual(self.index.search("pets", "cats")[0], [other])
+
+    def test_from_filter(self):
+        self.add("general", "alice", "hello")
+        bob = self.add("general", "Bob", "hello")
+        self.assertEqual(self.index.search("general", "hello from:bob")[0], [bob])
+        self.assertEqual(self.index.search("general", "from:carol")[0], [])
+
+    def test_date_filters(self):
+        first = self.add("general", "alice", "news", day=0)
+        second = self.add("general", "alice", "news", day=1)
+        third = self.add("general", "alice", "news", day=2)
+        self.assertEqual(self.index.search("general", "news after:2024-03-01")[0], [third, second])
+        self.assertEqual(self.index.search("general", "news before:2024-03-02")[0], [first])
+        self.assertEqual(self.index.search("general", "news after:2024-03-01 before:2024-03-03")[0], [second])
+        self.assertEqual(len(self.index.search("general", "news after:not-a-date")[0]), 3)
+
+    def test_saved_index_is_loaded_and_caught_up(self):
+        for index in range(5):
+            self.add("general", "alice", f"saved {index}")
+        self.index.save()
+        later = self.add("general", "alice", "saved later")
+
+        reloaded = search_index.SearchIndex(self.log)
+        self.assertTrue(reloaded.load())
+        self.assertEqual(reloaded.last_seq, later - 1)
+        reloaded.catch_up()
+        self.assertEqual(reloaded.search("general", "saved")[0], self.index.search("general", "saved")[0])
+
+    def test_messages_dropped_from_the_log_are_pruned(self):
+        self.log.segment_bytes, self.log.max_segments = 1, 2  # One message per segment, two kept
+        for index in range(4):
+            self.add("general", "bob", f"cats {index}")
+        kept = [self.add("general", "alice", f"cats {index}") for index in range(4, 6)]
+        self.assertEqual((self.index.base, len(self.index.stamps)), (kept[0], 2))
+        self.assertNotIn("@bob", self.index.postings)
+        self.assertNotIn("0", self.index.postings)
+        self.assertEqual(list(self.index.postings["cats"]), kept)
+        self.assertEqual(self.index.search("general", "cats")[0], kept[::-1])
+
+    def test_reopened_log_keeps_timestamps_rising(self):
+        seq = self.add("general", "alice", "before the restart", day=1)
+        with mock.patch.multiple(chat_core, chat_log=None, history_index=None, last_sequence=0, last_timestamp=0), \
+                mock.patch.object(search_index.SearchIndex, "start_saving"):
+            chat_core.open_log(self.log.directory)
+            self.addCleanup(chat_core.chat_log.close)
+            self.assertEqual(chat_core.last_sequence, seq)
+            self.assertEqual(chat_core.last_timestamp, self.start + DAY + seq)
+
+    def test_hits_with_separators_stay_aligned(self):
+        # Logged before separators were stripped from chat text
+        self.add("general", "zed", "cats\x1fand\x1fdogs")
+        self.add("general", "alice", "more cats")
+        connection = mock.Mock(codec=None)
+        with mock.patch.multiple(chat_core, chat_log=self.log, history_index=self.index), \
+                mock.patch.object(chat_core.chat_rooms, "is_member", return_value=True):
+            chat_core.search_history(connection, ["general", "", "cats"])
+        frame = connection.send.call_args.args[0]
+        fields = protocol.decode_fields(frame[protocol.HEADER_SIZE:])
+        self.assertEqual(fields, ["general", "", "2", "alice", str(self.start + 2), "1", "more cats",
+                                  "1", "zed", str(self.start + 1), "3", "cats", "and", "dogs"])
+
+if __name__ == "__main__":
+    unittest.main()
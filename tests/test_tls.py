@@ -0,0 +1,80 @@
+'''
+Authors: Kristina Celis & Christian Salinas
+
+Description: test_tls.py tests reading and writing one TLS socket
+from two threads at once through tls.SharedSocket.
+'''
+
+# IMPORTS
+import shutil
+import socket
+import ssl
+import tempfile
+import threading
+import unittest
+import bench
+import tls
+
+@unittest.skipUnless(shutil.which("openssl"), "needs the openssl command for a test certificate")
+class SharedSocketTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directory)
+        certfile, keyfile = bench.make_certificate(directory)
+        cls.server_context = tls.server_context(certfile, keyfile)
+        cls.client = tls.ClientTLS(certfile)
+
+    def connect(self):
+        ''' A client SharedSocket and the server's end of the connection '''
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+        accepted = []
+        server = threading.Thread(target=lambda: accepted.append(self.server_context.wrap_socket(listener.accept()[0], server_side=True)))
+        server.start()
+        client = tls.SharedSocket(self.client.wrap(socket.create_connection(listener.getsockname()), "127.0.0.1"))
+        server.join()
+        self.addCleanup(client.close)
+        self.addCleanup(accepted[0].close)
+        return client, accepted[0]
+
+    def test_reads_and_writes_on_two_threads(self):
+        client, server = self.connect()
+        chunks = [bytes([index % 256]) * (index % 4000 + 1) for index in range(2000)]
+        total = sum(map(len, chunks))
+
+        def echo():
+            left = total
+            while left:
+                data = server.recv(65536)
+                server.sendall(data)
+                left -= len(data)
+        threading.Thread(target=echo, daemon=True).start()
+        writer = threading.Thread(target=lambda: [client.sendall(chunk) for chunk in chunks])
+        writer.start()
+
+        received = bytearray()
+        buffer = bytearray(65536)
+        while len(received) < total:
+            nbytes = client.recv_into(buffer)
+            self.assertTrue(nbytes)
+            received += buffer[:nbytes]
+        writer.join()
+        self.assertEqual(bytes(received), b"".join(chunks))
+
+    def test_shutdown_ends_a_waiting_read(self):
+        client, _ = self.connect()
+        result = []
+        reader = threading.Thread(target=lambda: result.append(client.recv_into(bytearray(16))))
+        reader.start()
+        reader.join(0.2)
+        client.shutdown(socket.SHUT_RDWR)
+        reader.join(5)
+        self.assertEqual(result, [0])
+
+    def test_session_can_be_remembered(self):
+        client, _ = self.connect()
+        self.assertIsInstance(client.session, ssl.SSLSession)
+
+if __name__ == "__main__":
+    unittest.main()